@@ -0,0 +1,5 @@
+# Copyright (c) 2021 Luis Liñán Villafranca. All rights reserved.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>
+"""Benchmarks of the push-ups counter."""
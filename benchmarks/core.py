@@ -0,0 +1,446 @@
+# Copyright (c) 2021 Luis Liñán Villafranca. All rights reserved.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>
+"""Micro and macro benchmarks of the gol core.
+
+Every benchmark is run for several sizes, being the size the number of
+pending normal push-ups for the participant and counter operations, and the
+number of journal records to replay for ``load_count`` and the number of
+packed chats for the binary store cold start. The memory kept by every
+loaded counter is also measured, with ``--footprint`` counters in memory at
+once. The results are printed and written as JSON so they can be compared
+between commits::
+
+    python -m benchmarks.core --sizes 10 1000 100000 --output bench.json
+
+"""
+import argparse
+import gc
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from gol.counter import PushUpsCounter
+from gol.ledger import NormalsLedger
+from gol.snapshot import pack_record, write_snapshot_file
+from gol.store import BinaryCounterStore, JsonCounterStore
+from gol.user import PushUpper
+
+DEFAULT_SIZES = [10, 1_000, 100_000]
+DEFAULT_ITERATIONS = 2_000
+DEFAULT_MAX_TIME = 2.0
+DEFAULT_FOOTPRINT = 10_000
+MEMORY_ITERATIONS = 100
+FOOTPRINT_UPDATES = 16
+FIRST_ID = "1"
+SECOND_ID = "2"
+
+Operation = Callable[[], Any]
+Setup = Callable[[int, Path], Operation]
+
+
+class Benchmark(NamedTuple):
+    """A named operation to measure.
+
+    The setup receives the size and a scratch directory, and returns the
+    operation to call on every iteration.
+
+    """
+
+    name: str
+    setup: Setup
+
+
+def _pusher(size: int, directory: Path) -> PushUpper:
+    """Build a participant owing a number of normal push-ups.
+
+    :param size: number of normal push-up blocks owed.
+    :param directory: scratch directory, unused.
+    :returns: the participant.
+
+    """
+    return PushUpper("First", FIRST_ID, NormalsLedger(FIRST_ID, size))
+
+
+def _counter(
+    size: int, directory: Path, compact_every: Optional[int] = None
+) -> PushUpsCounter:
+    """Build a configured counter with the first participant owing push-ups.
+
+    :param size: number of normal push-up blocks owed by the first
+        participant.
+    :param directory: directory where the counter is saved.
+    :param compact_every: number of changes between two snapshots. The
+        counter default if not provided.
+    :returns: the counter.
+
+    """
+    options = {} if compact_every is None else {"compact_every": compact_every}
+    counter = PushUpsCounter(0, JsonCounterStore(directory), **options)
+    counter.config("First", FIRST_ID, "Second", SECOND_ID)
+    counter.restore(
+        {
+            **counter.snapshot(),
+            "normals": {"holder": FIRST_ID, "count": size},
+        }
+    )
+
+    return counter
+
+
+def setup_add_normals(size: int, directory: Path) -> Operation:
+    """Add normal push-ups to the participant already owing them."""
+    pusher = _pusher(size, directory)
+
+    return pusher.add_normals
+
+
+def setup_complete_pushups(size: int, directory: Path) -> Operation:
+    """Complete push-ups, owing them again once all are done."""
+    pusher = _pusher(size, directory)
+    normals = pusher.normals
+
+    def complete() -> None:
+        if not normals.count:
+            normals.reset(FIRST_ID, size)
+
+        pusher.complete_pushups()
+
+    return complete
+
+
+def setup_n_normals(size: int, directory: Path) -> Operation:
+    """Read the number of normal push-ups owed by the participant."""
+    pusher = _pusher(size, directory)
+
+    return lambda: pusher.n_normals
+
+
+def setup_add_pushups(size: int, directory: Path) -> Operation:
+    """Request push-ups through the counter, journaling every change."""
+    counter = _counter(size, directory)
+
+    return lambda: counter.add_pushups(SECOND_ID, FIRST_ID)
+
+
+def setup_process_error(size: int, directory: Path) -> Operation:
+    """Report errors through the counter, journaling every change."""
+    counter = _counter(size, directory)
+
+    return lambda: counter.process_error(FIRST_ID)
+
+
+def setup_opposite(size: int, directory: Path) -> Operation:
+    """Look up the opposite participant."""
+    counter = _counter(size, directory)
+
+    return lambda: counter.opposite(FIRST_ID)
+
+
+def setup_save_count(size: int, directory: Path) -> Operation:
+    """Save a snapshot of the counter."""
+    counter = _counter(size, directory)
+
+    return counter.save_count
+
+
+def setup_load_count(size: int, directory: Path) -> Operation:
+    """Load a counter snapshot and replay a journal of ``size`` records."""
+    counter = _counter(0, directory, compact_every=size + 1)
+    counter.save_count()
+
+    for _ in range(size):
+        counter.add_pushups(SECOND_ID, FIRST_ID)
+
+    counter.close()
+    loaded = PushUpsCounter(0, JsonCounterStore(directory))
+
+    return loaded.load_count
+
+
+def setup_binary_cold_start(size: int, directory: Path) -> Operation:
+    """Open a binary store with ``size`` packed chats and load one."""
+    record = pack_record(_counter(0, directory).snapshot())
+    write_snapshot_file(
+        directory / BinaryCounterStore.PACKED_FILE,
+        ((chat_id, record) for chat_id in range(size)),
+    )
+
+    def cold_start() -> None:
+        store = BinaryCounterStore(directory)
+        counter = PushUpsCounter(size // 2, store)
+        counter.load_count()
+        store.close()
+
+    return cold_start
+
+
+def setup_push_up_table(size: int, directory: Path) -> Operation:
+    """Render the counter table after every change."""
+    counter = _counter(size, directory)
+    normals = counter.snapshot()["normals"]
+
+    def render() -> str:
+        counter.restore({**counter.snapshot(), "normals": normals})
+
+        return counter.push_up_table()
+
+    return render
+
+
+def setup_cached_push_up_table(size: int, directory: Path) -> Operation:
+    """Render the counter table without changes in between."""
+    counter = _counter(size, directory)
+
+    return counter.push_up_table
+
+
+BENCHMARKS = [
+    Benchmark("PushUpper.add_normals", setup_add_normals),
+    Benchmark("PushUpper.complete_pushups", setup_complete_pushups),
+    Benchmark("PushUpper.n_normals", setup_n_normals),
+    Benchmark("PushUpsCounter.add_pushups", setup_add_pushups),
+    Benchmark("PushUpsCounter.process_error", setup_process_error),
+    Benchmark("PushUpsCounter.opposite", setup_opposite),
+    Benchmark("PushUpsCounter.save_count", setup_save_count),
+    Benchmark("PushUpsCounter.load_count", setup_load_count),
+    Benchmark("BinaryCounterStore[cold start]", setup_binary_cold_start),
+    Benchmark("PushUpsCounter.push_up_table", setup_push_up_table),
+    Benchmark(
+        "PushUpsCounter.push_up_table[cached]", setup_cached_push_up_table
+    ),
+]
+
+
+def percentile(ordered: List[int], fraction: float) -> int:
+    """Get a percentile of some ordered samples.
+
+    :param ordered: the samples, in ascending order.
+    :param fraction: the percentile, between 0 and 1.
+    :returns: the nearest-rank percentile.
+
+    """
+    index = max(0, min(len(ordered) - 1, round(fraction * len(ordered)) - 1))
+
+    return ordered[index]
+
+
+def measure(
+    benchmark: Benchmark, size: int, iterations: int, max_time: float
+) -> Dict[str, Any]:
+    """Run a benchmark for a size.
+
+    The latencies are measured without tracing the memory allocations, and
+    the peak memory in a second run of a few iterations with ``tracemalloc``
+    enabled.
+
+    :param benchmark: the benchmark to run.
+    :param size: the size to run the benchmark for.
+    :param iterations: maximum number of timed iterations.
+    :param max_time: seconds after which no more iterations are started.
+    :returns: the benchmark results.
+
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        operation = benchmark.setup(size, Path(directory))
+        latencies = []
+        deadline = time.perf_counter() + max_time
+
+        for _ in range(iterations):
+            start = time.perf_counter_ns()
+            operation()
+            latencies.append(time.perf_counter_ns() - start)
+
+            if time.perf_counter() > deadline:
+                break
+
+    with tempfile.TemporaryDirectory() as directory:
+        operation = benchmark.setup(size, Path(directory))
+        tracemalloc.start()
+
+        try:
+            for _ in range(min(len(latencies), MEMORY_ITERATIONS)):
+                operation()
+
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    total = sum(latencies)
+    latencies.sort()
+
+    return {
+        "name": benchmark.name,
+        "size": size,
+        "iterations": len(latencies),
+        "ops_per_sec": len(latencies) * 1e9 / total if total else 0.0,
+        "latency_ns": {
+            "min": latencies[0],
+            "p50": percentile(latencies, 0.50),
+            "p90": percentile(latencies, 0.90),
+            "p99": percentile(latencies, 0.99),
+            "max": latencies[-1],
+        },
+        "peak_memory_bytes": peak_memory,
+    }
+
+
+def measure_footprint(number: int) -> Dict[str, Any]:
+    """Measure the memory kept by idle loaded counters.
+
+    The counters are restored from the snapshot of a counter with a few
+    changes of each kind, as the registry loads them, and kept in memory
+    together.
+
+    :param number: number of counters loaded at once.
+    :returns: the total and per-counter retained bytes.
+
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        store = JsonCounterStore(Path(directory))
+        counter = _counter(0, Path(directory))
+
+        for update_id in range(FOOTPRINT_UPDATES):
+            counter.add_pushups(SECOND_ID, FIRST_ID, update_id=update_id)
+            counter.process_error(SECOND_ID, update_id=update_id + 1_000_000)
+
+        counter.complete_pushups(SECOND_ID, 2, update_id=2_000_000)
+        serialized = json.dumps(counter.snapshot())
+        counter.close()
+        gc.collect()
+        tracemalloc.start()
+
+        try:
+            start = tracemalloc.get_traced_memory()[0]
+            counters = []
+
+            for chat_id in range(number):
+                loaded = PushUpsCounter(chat_id, store)
+                loaded.restore(json.loads(serialized))
+                counters.append(loaded)
+
+            gc.collect()
+            retained = tracemalloc.get_traced_memory()[0] - start
+        finally:
+            tracemalloc.stop()
+
+        store.close()
+
+    return {
+        "counters": number,
+        "retained_bytes": retained,
+        "bytes_per_counter": retained / number if number else 0.0,
+    }
+
+
+def current_commit() -> Optional[str]:
+    """Get the commit of the benchmarked code.
+
+    :returns: the git commit hash, or None outside a git checkout.
+
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=str(Path(__file__).resolve().parent),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=True,
+            universal_newlines=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Run the benchmarks.
+
+    :param argv: command line arguments. The process ones if not provided.
+
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SIZES,
+        help="sizes to run every benchmark for",
+    )
+    parser.add_argument(
+        "--iterations",
+        type=int,
+        default=DEFAULT_ITERATIONS,
+        help="maximum number of iterations of every benchmark",
+    )
+    parser.add_argument(
+        "--max-time",
+        type=float,
+        default=DEFAULT_MAX_TIME,
+        help="seconds after which a benchmark stops iterating",
+    )
+    parser.add_argument(
+        "--footprint",
+        type=int,
+        default=DEFAULT_FOOTPRINT,
+        help="counters loaded at once to measure their memory, 0 to skip it",
+    )
+    parser.add_argument(
+        "--filter",
+        default="",
+        help="only run the benchmarks containing this text in their name",
+    )
+    parser.add_argument(
+        "--output", type=Path, help="file where the JSON results are written"
+    )
+    args = parser.parse_args(argv)
+    results = []
+
+    for benchmark in BENCHMARKS:
+        if args.filter not in benchmark.name:
+            continue
+
+        for size in args.sizes:
+            result = measure(benchmark, size, args.iterations, args.max_time)
+            results.append(result)
+            print(
+                f"{result['name']:<40} {size:>8} "
+                f"{result['ops_per_sec']:>12.0f} ops/s "
+                f"p50 {result['latency_ns']['p50']:>9} ns "
+                f"p99 {result['latency_ns']['p99']:>9} ns "
+                f"peak {result['peak_memory_bytes']:>9} B"
+            )
+
+    footprint = None
+
+    if args.footprint > 0:
+        footprint = measure_footprint(args.footprint)
+        print(
+            f"{'PushUpsCounter[footprint]':<40} {args.footprint:>8} "
+            f"{footprint['bytes_per_counter']:>12.0f} B/counter"
+        )
+
+    if args.output is not None:
+        args.output.write_text(
+            json.dumps(
+                {
+                    "commit": current_commit(),
+                    "python": sys.version,
+                    "platform": platform.platform(),
+                    "results": results,
+                    "footprint": footprint,
+                },
+                indent=2,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,451 @@
+# Copyright (c) 2021 Luis Liñán Villafranca. All rights reserved.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>
+"""Offline load test of the bot handlers.
+
+Synthetic updates are built as raw Telegram JSON and dispatched through the
+handlers registered by :func:`gbot.__main__.register_handlers`, against a
+local bot recording the replies, so no network nor token is needed::
+
+    python -m benchmarks.loadtest --chats 500 --updates 20000 --rate 2000
+
+Every chat is configured before the measured phase. The latency of an update
+is the time from its dispatch until its handler, queued in the chat actor,
+has finished. The replies are left in the outbox, which is not started, and
+reported as the number of queued messages after coalescing them.
+
+.. warning:: The counters are saved in the configured store, using chat
+   identifications from ``--first-chat`` downwards.
+
+"""
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import Dispatcher
+
+from benchmarks.core import percentile
+from gbot.__main__ import register_handlers
+from gbot.settings import CHAT_ACTORS, COUNTERS, OUTBOX, PERSISTENCE
+
+DEFAULT_MIX = {
+    "flex": 40,
+    "flexiones": 10,
+    "error": 20,
+    "table": 15,
+    "voice": 10,
+    "help": 5,
+}
+DEFAULT_FIRST_CHAT = -999_000_000_000
+
+RawUpdate = Dict[str, Any]
+
+
+class RecordingBot:
+    """Bot answering locally and recording the sent messages.
+
+    :ivar sent: chat identification and text of every message sent.
+
+    """
+
+    username = "gol_load_test_bot"
+    first_name = "gol"
+    id = 0
+    defaults = None
+
+    def __init__(self) -> None:
+        """Instantiate the class."""
+        self.sent: List[Tuple[int, str]] = []
+
+    def send_message(self, chat_id: int, text: str, *args, **kwargs) -> None:
+        """Record a message instead of sending it.
+
+        :param chat_id: identification of the chat.
+        :param text: text of the message.
+
+        """
+        self.sent.append((chat_id, text))
+
+
+class UpdateFactory:
+    """Build raw Telegram updates.
+
+    :ivar _update_id: identification of the last built update.
+    :ivar _lock: lock protecting the update identification.
+
+    """
+
+    def __init__(self, update_id: Optional[int] = None) -> None:
+        """Instantiate the class.
+
+        :param update_id: identification of the update before the first one.
+            By default it comes from the current time, so the updates of a
+            new run are not taken for the ones already applied to the saved
+            counters.
+
+        """
+        self._update_id: int = (
+            int(time.time() * 1000) if update_id is None else update_id
+        )
+        self._lock = threading.Lock()
+
+    def command(
+        self,
+        chat_id: int,
+        user_id: int,
+        text: str,
+        reply_to: Optional[int] = None,
+    ) -> RawUpdate:
+        """Build a command message update.
+
+        :param chat_id: identification of the chat.
+        :param user_id: identification of the sender.
+        :param text: the message text, starting with the command.
+        :param reply_to: identification of the user the message replies to.
+        :returns: the update.
+
+        """
+        update = self.message(chat_id, user_id, text=text)
+        update["message"]["entities"] = [
+            {
+                "type": "bot_command",
+                "offset": 0,
+                "length": len(text.split(None, 1)[0]),
+            }
+        ]
+
+        if reply_to is not None:
+            update["message"]["reply_to_message"] = {
+                "message_id": 0,
+                "date": update["message"]["date"],
+                "chat": update["message"]["chat"],
+                "from": self._user(reply_to),
+            }
+
+        return update
+
+    def voice(self, chat_id: int, user_id: int) -> RawUpdate:
+        """Build a voice message update.
+
+        :param chat_id: identification of the chat.
+        :param user_id: identification of the sender.
+        :returns: the update.
+
+        """
+        return self.message(
+            chat_id,
+            user_id,
+            voice={
+                "file_id": "voice",
+                "file_unique_id": "voice",
+                "duration": 1,
+            },
+        )
+
+    def message(self, chat_id: int, user_id: int, **content: Any) -> RawUpdate:
+        """Build a message update.
+
+        :param chat_id: identification of the chat.
+        :param user_id: identification of the sender.
+        :param content: the message content fields.
+        :returns: the update.
+
+        """
+        with self._lock:
+            self._update_id += 1
+            update_id = self._update_id
+
+        return {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "group"},
+                "from": self._user(user_id),
+                **content,
+            },
+        }
+
+    @staticmethod
+    def _user(user_id: int) -> Dict[str, Any]:
+        """Build a user.
+
+        :param user_id: identification of the user.
+        :returns: the user.
+
+        """
+        return {"id": user_id, "is_bot": False, "first_name": str(user_id)}
+
+
+def participants(chat_id: int) -> Tuple[int, int]:
+    """Get the participants of a synthetic chat.
+
+    :param chat_id: identification of the chat.
+    :returns: the identification of both participants.
+
+    """
+    return 2 * abs(chat_id) + 1, 2 * abs(chat_id) + 2
+
+
+def config_updates(
+    factory: UpdateFactory, chats: List[int]
+) -> Iterator[RawUpdate]:
+    """Generate the updates configuring the synthetic chats.
+
+    :param factory: factory of the updates.
+    :param chats: identification of the chats.
+    :returns: an iterator over the updates.
+
+    """
+    for chat_id in chats:
+        first, second = participants(chat_id)
+        yield factory.command(
+            chat_id, first, f"/config\nFirst\n{first}\nSecond\n{second}"
+        )
+
+
+def synthetic_updates(
+    factory: UpdateFactory,
+    chats: List[int],
+    number: int,
+    mix: Dict[str, int],
+    seed: int,
+) -> Iterator[RawUpdate]:
+    """Generate a random stream of updates for the synthetic chats.
+
+    :param factory: factory of the updates.
+    :param chats: identification of the chats.
+    :param number: number of updates.
+    :param mix: relative weight of every kind of update, being the kinds the
+        command names and ``voice``.
+    :param seed: seed of the random generator.
+    :returns: an iterator over the updates.
+
+    """
+    rng = random.Random(seed)
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+
+    for kind in rng.choices(kinds, weights, k=number):
+        chat_id = rng.choice(chats)
+        sender, other = participants(chat_id)
+
+        if rng.random() < 0.5:
+            sender, other = other, sender
+
+        if kind == "voice":
+            yield factory.voice(chat_id, sender)
+        elif kind in ("flex", "flexiones") and rng.random() < 0.5:
+            yield factory.command(chat_id, sender, f"/{kind}", reply_to=other)
+        else:
+            yield factory.command(chat_id, sender, f"/{kind}")
+
+
+class LoadTest:
+    """Dispatch updates from several threads at a given arrival rate.
+
+    :ivar _dispatcher: dispatcher with the bot handlers.
+    :ivar _concurrency: number of threads dispatching updates.
+    :ivar _rate: total updates dispatched per second, or 0 to dispatch them
+        as fast as possible.
+    :ivar _latencies: seconds from the dispatch of every update until its
+        handler finished.
+    :ivar _lock: lock protecting the shared iterator over the updates.
+
+    """
+
+    def __init__(
+        self, dispatcher: Dispatcher, concurrency: int = 4, rate: float = 0
+    ) -> None:
+        """Instantiate the class.
+
+        :param dispatcher: dispatcher with the bot handlers.
+        :param concurrency: number of threads dispatching updates.
+        :param rate: total updates dispatched per second, or 0 to dispatch
+            them as fast as possible.
+
+        """
+        self._dispatcher: Dispatcher = dispatcher
+        self._concurrency: int = concurrency
+        self._rate: float = rate
+        self._latencies: List[float] = []
+        self._lock = threading.Lock()
+
+    def run(self, updates: Iterator[RawUpdate]) -> Dict[str, Any]:
+        """Dispatch every update and wait for their handlers.
+
+        :param updates: the raw updates.
+        :returns: the throughput and latency results.
+
+        """
+        self._latencies = []
+        indexed = enumerate(updates)
+        start = time.perf_counter()
+        threads = [
+            threading.Thread(target=self._produce, args=(indexed, start))
+            for _ in range(self._concurrency)
+        ]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        CHAT_ACTORS.wait_idle()
+        elapsed = time.perf_counter() - start
+        latencies = sorted(self._latencies)
+
+        if not latencies:
+            return {"updates": 0, "seconds": elapsed}
+
+        return {
+            "updates": len(latencies),
+            "seconds": elapsed,
+            "updates_per_sec": len(latencies) / elapsed,
+            "latency_ms": {
+                "p50": percentile(latencies, 0.50) * 1e3,
+                "p90": percentile(latencies, 0.90) * 1e3,
+                "p99": percentile(latencies, 0.99) * 1e3,
+                "max": latencies[-1] * 1e3,
+            },
+        }
+
+    def _produce(
+        self, indexed: Iterator[Tuple[int, RawUpdate]], start: float
+    ) -> None:
+        """Dispatch updates until there are no more.
+
+        :param indexed: the shared iterator over the numbered updates.
+        :param start: instant the load test started at.
+
+        """
+        bot = self._dispatcher.bot
+
+        while True:
+            with self._lock:
+                try:
+                    index, data = next(indexed)
+                except StopIteration:
+                    return
+
+            if self._rate:
+                delay = start + index / self._rate - time.perf_counter()
+
+                if delay > 0:
+                    time.sleep(delay)
+
+            dispatched = time.perf_counter()
+            self._dispatcher.process_update(Update.de_json(data, bot))
+            done = CHAT_ACTORS.submit(data["message"]["chat"]["id"], _noop)
+            done.add_done_callback(
+                lambda _, dispatched=dispatched: self._latencies.append(
+                    time.perf_counter() - dispatched
+                )
+            )
+
+
+def _noop() -> None:
+    """Mark the handlers of a chat queued before it as finished."""
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    """Parse a mix of updates, like ``flex=3,error=1``.
+
+    :param mix: comma separated kinds and weights.
+    :returns: the weight of every kind.
+
+    """
+    weights = {}
+
+    for entry in mix.split(","):
+        kind, _, weight = entry.partition("=")
+        weights[kind.strip().lstrip("/")] = int(weight or 1)
+
+    return weights
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Run the load test.
+
+    :param argv: command line arguments. The process ones if not provided.
+
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--updates", type=int, default=10_000)
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="threads dispatching updates",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0,
+        help="updates per second, 0 to dispatch them as fast as possible",
+    )
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default=DEFAULT_MIX,
+        help="relative weight of every kind of update, like flex=3,voice=1",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--first-chat",
+        type=int,
+        default=DEFAULT_FIRST_CHAT,
+        help="identification of the first synthetic chat",
+    )
+    parser.add_argument(
+        "--output", type=Path, help="file where the JSON results are written"
+    )
+    args = parser.parse_args(argv)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    bot = RecordingBot()
+    dispatcher = Dispatcher(bot, None, workers=0)
+    register_handlers(dispatcher)
+    factory = UpdateFactory()
+    chats = [args.first_chat - offset for offset in range(args.chats)]
+    load_test = LoadTest(dispatcher, args.concurrency, args.rate)
+    PERSISTENCE.start()
+
+    try:
+        load_test.run(config_updates(factory, chats))
+        queued = len(OUTBOX)
+        results = load_test.run(
+            synthetic_updates(
+                factory, chats, args.updates, args.mix, args.seed
+            )
+        )
+    finally:
+        CHAT_ACTORS.shutdown()
+        PERSISTENCE.stop()
+        COUNTERS.close()
+
+    results.update(
+        chats=args.chats,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        mix=args.mix,
+        replies=len(OUTBOX) - queued,
+    )
+    print(json.dumps(results, indent=2))
+
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
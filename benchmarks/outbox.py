@@ -0,0 +1,244 @@
+# Copyright (c) 2021 Luis Liñán Villafranca. All rights reserved.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>
+"""Flood control test of the outgoing messages queue.
+
+Bursts of replies, with repeated ``/table`` answers among them, are queued in
+an :class:`gbot.outbox.Outbox` sending them to a local stub of the Bot API.
+The stub enforces the per-chat and global limits and answers with ``retry
+after`` errors when they are exceeded, or at random with ``--flood-rate``::
+
+    python -m benchmarks.outbox --chats 20 --messages 400 --flood-rate 0.05
+
+"""
+import argparse
+import json
+import random
+import threading
+import time
+
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from gbot.metrics import OUTBOX_MESSAGES
+from gbot.outbox import Outbox
+
+DEFAULT_CHATS = 20
+DEFAULT_MESSAGES = 400
+
+
+class RetryAfter(Exception):
+    """Flood control error, as raised by the telegram library.
+
+    :ivar retry_after: seconds to wait before sending again.
+
+    """
+
+    def __init__(self, retry_after: float) -> None:
+        """Instantiate the class.
+
+        :param retry_after: seconds to wait before sending again.
+
+        """
+        super().__init__(f"Flood control exceeded. Retry in {retry_after}")
+        self.retry_after: float = retry_after
+
+
+class StubBotApi:
+    """Bot answering ``sendMessage`` locally with the Bot API limits.
+
+    :ivar sent: chat identification, text and monotonic time of every
+        message accepted.
+    :ivar rejected: number of ``retry after`` errors raised.
+    :ivar _chat_burst: messages accepted in a chat in one second.
+    :ivar _rate: messages per second accepted in every chat together.
+    :ivar _flood_rate: probability of rejecting an allowed message.
+    :ivar _retry_after: seconds requested in the errors.
+    :ivar _chats: times of the messages of every chat in the last second.
+    :ivar _recent: times of every message in the last second.
+    :ivar _random: generator deciding the random rejections.
+    :ivar _lock: lock protecting the recorded messages.
+
+    """
+
+    def __init__(
+        self,
+        chat_burst: int = 3,
+        rate: float = 30.0,
+        flood_rate: float = 0.0,
+        retry_after: float = 0.5,
+        seed: int = 0,
+    ) -> None:
+        """Instantiate the class.
+
+        :param chat_burst: messages accepted in a chat in one second.
+        :param rate: messages per second accepted in every chat together.
+        :param flood_rate: probability of rejecting an allowed message.
+        :param retry_after: seconds requested in the errors.
+        :param seed: seed of the random rejections.
+
+        """
+        self.sent: List[Tuple[int, str, float]] = []
+        self.rejected: int = 0
+        self._chat_burst: int = chat_burst
+        self._rate: float = rate
+        self._flood_rate: float = flood_rate
+        self._retry_after: float = retry_after
+        self._chats: Dict[int, Deque[float]] = defaultdict(deque)
+        self._recent: Deque[float] = deque()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def send_message(self, chat_id: int, text: str, **kwargs: Any) -> None:
+        """Accept or reject a message.
+
+        The limits are checked in a sliding window of one second.
+
+        :param chat_id: identification of the chat.
+        :param text: text of the message.
+
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            chat = self._chats[chat_id]
+
+            for window in (chat, self._recent):
+                while window and now - window[0] >= 1.0:
+                    window.popleft()
+
+            if (
+                len(chat) >= self._chat_burst
+                or len(self._recent) >= self._rate
+                or self._random.random() < self._flood_rate
+            ):
+                self.rejected += 1
+                raise RetryAfter(self._retry_after)
+
+            chat.append(now)
+            self._recent.append(now)
+            self.sent.append((chat_id, text, now))
+
+
+def run(
+    outbox: Outbox,
+    chats: int,
+    messages: int,
+    seed: int,
+) -> Dict[str, Any]:
+    """Queue bursts of replies and wait until they are sent.
+
+    A third of the replies are tables of the chat, the rest are unique.
+
+    :param outbox: the started outbox.
+    :param chats: number of chats.
+    :param messages: number of replies queued.
+    :param seed: seed of the random generator.
+    :returns: the number of queued and sent messages and the elapsed time.
+
+    """
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    futures = []
+
+    for number in range(messages):
+        chat_id = rng.randrange(chats)
+
+        if rng.random() < 1 / 3:
+            futures.append(outbox.send(chat_id, f"table {number}", "table"))
+        else:
+            futures.append(outbox.send(chat_id, f"reply {number}"))
+
+    failed = 0
+
+    for future in futures:
+        if future.exception() is not None:
+            failed += 1
+
+    return {
+        "queued": messages,
+        "failed": failed,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def max_per_second(times: List[float]) -> int:
+    """Get the largest number of events in a one second window.
+
+    :param times: the sorted event times.
+    :returns: the maximum events per second.
+
+    """
+    window: Deque[float] = deque()
+    peak = 0
+
+    for instant in times:
+        window.append(instant)
+
+        while instant - window[0] >= 1.0:
+            window.popleft()
+
+        peak = max(peak, len(window))
+
+    return peak
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Run the flood control test.
+
+    :param argv: command line arguments. The process ones if not provided.
+
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int, default=DEFAULT_CHATS)
+    parser.add_argument("--messages", type=int, default=DEFAULT_MESSAGES)
+    parser.add_argument("--rate", type=float, default=30.0)
+    parser.add_argument("--chat-rate", type=float, default=1.0)
+    parser.add_argument("--chat-burst", type=int, default=3)
+    parser.add_argument(
+        "--flood-rate",
+        type=float,
+        default=0.0,
+        help="probability of the stub rejecting an allowed message",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output", type=Path, help="file where the JSON results are written"
+    )
+    args = parser.parse_args(argv)
+
+    bot = StubBotApi(
+        args.chat_burst, args.rate, args.flood_rate, seed=args.seed
+    )
+    outbox = Outbox(args.rate, args.chat_rate, args.chat_burst)
+    outbox.start(bot)
+
+    try:
+        results = run(outbox, args.chats, args.messages, args.seed)
+    finally:
+        outbox.stop()
+
+    by_chat: Dict[int, List[float]] = defaultdict(list)
+
+    for chat_id, _, instant in bot.sent:
+        by_chat[chat_id].append(instant)
+
+    results.update(
+        sent=len(bot.sent),
+        coalesced=OUTBOX_MESSAGES.value("coalesced"),
+        rejected=bot.rejected,
+        max_per_second=max_per_second([sent[2] for sent in bot.sent]),
+        max_chat_per_second=max(
+            (max_per_second(times) for times in by_chat.values()), default=0
+        ),
+    )
+    print(json.dumps(results, indent=2))
+
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# Copyright (c) 2021 Luis Liñán Villafranca. All rights reserved.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>
+"""Offline scaling test of the sharded runtime.
+
+The synthetic updates of :mod:`benchmarks.loadtest` are routed by a
+:class:`gbot.sharding.ShardRouter` to worker processes answering with a local
+bot, for every number of workers given, so the throughput can be compared::
+
+    python -m benchmarks.sharding --shards 1 2 4 --chats 400 --updates 20000
+
+Every run starts with empty counters in a temporary data directory, and ends
+when the workers have handled every update and saved their counters. The
+outgoing messages are not rate limited.
+
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from benchmarks.loadtest import (
+    DEFAULT_FIRST_CHAT,
+    DEFAULT_MIX,
+    RecordingBot,
+    UpdateFactory,
+    config_updates,
+    parse_mix,
+    synthetic_updates,
+)
+from gbot.sharding import ShardRouter
+
+UNLIMITED_SENDING = {
+    "GOL_BOT_SEND_RATE": "1000000",
+    "GOL_BOT_CHAT_SEND_RATE": "1000000",
+    "GOL_BOT_CHAT_SEND_BURST": "1000000",
+}
+
+
+def run(shards: int, updates: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Route the updates to a number of workers and wait for them.
+
+    :param shards: number of workers.
+    :param updates: the raw updates.
+    :returns: the throughput results and the updates handled by every worker.
+
+    """
+    router = ShardRouter(RecordingBot)
+    router.start(shards)
+    start = time.perf_counter()
+
+    try:
+        for data in updates:
+            router.route(data)
+    finally:
+        handled = router.stop()
+
+    elapsed = time.perf_counter() - start
+
+    return {
+        "shards": shards,
+        "updates": len(updates),
+        "seconds": elapsed,
+        "updates_per_sec": len(updates) / elapsed,
+        "handled": [handled[shard] for shard in sorted(handled)],
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Run the scaling test.
+
+    :param argv: command line arguments. The process ones if not provided.
+
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--shards", type=int, nargs="+", default=[1, 2, os.cpu_count() or 1]
+    )
+    parser.add_argument("--chats", type=int, default=400)
+    parser.add_argument("--updates", type=int, default=20_000)
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default=DEFAULT_MIX,
+        help="relative weight of every kind of update, like flex=3,voice=1",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output", type=Path, help="file where the JSON results are written"
+    )
+    args = parser.parse_args(argv)
+
+    chats = [DEFAULT_FIRST_CHAT - number for number in range(args.chats)]
+    factory = UpdateFactory()
+    updates = list(config_updates(factory, chats))
+    updates.extend(
+        synthetic_updates(factory, chats, args.updates, args.mix, args.seed)
+    )
+    # The workers read the settings from the environment they inherit
+    os.environ.update(UNLIMITED_SENDING)
+    results = []
+
+    for shards in sorted(set(args.shards)):
+        with tempfile.TemporaryDirectory() as data_dir:
+            os.environ["GOL_DATA_DIR"] = data_dir
+            results.append(run(shards, updates))
+
+    for result in results:
+        result["speedup"] = (
+            result["updates_per_sec"] / results[0]["updates_per_sec"]
+        )
+
+    print(json.dumps(results, indent=2))
+
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,22 +2,51 @@
 #
 # This work is licensed under the terms of the MIT license.
 # For a copy, see <https://opensource.org/licenses/MIT>
-"""Bot main executor."""
+"""Bot main executor.
+
+The telegram library, the handlers and the runtime objects are only imported
+when the bot runs, so the maintenance commands start fast and don't depend
+on them.
+
+"""
+import argparse
+import asyncio
+import json
 import logging
+import sys
 
-from telegram.ext import CommandHandler, Filters, MessageHandler, Updater
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Iterator, List, Optional
 
-from gbot.commands import (
-    command_config,
-    command_error,
-    command_help,
-    command_push_ups,
-    command_table,
-    process_audio,
+from gbot.error import BotError, TokenNotDefinedError
+from gbot.metrics import METRICS, MetricsServer
+from gbot.settings import (
+    BOT_TOKEN,
+    METRICS_HOST,
+    METRICS_PORT,
+    PROFILE,
+    RUN_MODE,
+    SHARDS,
+    STORE_BACKEND,
+    WEBHOOK_HOST,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
+)
+from gol.error import CounterError, WrongCounterFileFormatError
+from gol.history import (
+    FORMATS,
+    Row,
+    detect_format,
+    export_history,
+    import_history,
+    read_history,
 )
-from gbot.error import TokenNotDefinedError
-from gbot.settings import BOT_TOKEN, COUNTER
-from gol.error import WrongCounterFileFormatError
+from gol.settings import LEGACY_SAVE_FILE
+
+if TYPE_CHECKING:
+    from telegram.ext import Dispatcher
 
 # Enable logging
 logging.basicConfig(
@@ -28,34 +57,351 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def main():
-    """Start the bot."""
+def main(argv: Optional[List[str]] = None) -> None:
+    """Run the bot, or one of the maintenance commands.
+
+    :param argv: command line arguments. The process ones if not provided.
+
+    """
+    parser = argparse.ArgumentParser(prog="gol-bot")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("run", help="run the bot (default)")
+    export_parser = commands.add_parser(
+        "export", help="write the history of a chat"
+    )
+    export_parser.add_argument("chat_id", type=int)
+    export_parser.add_argument(
+        "-o", "--output", type=Path, help="output file, stdout by default"
+    )
+    export_parser.add_argument(
+        "-f",
+        "--format",
+        choices=FORMATS,
+        help="history format, guessed from the output file by default",
+    )
+    import_parser = commands.add_parser(
+        "import",
+        help="apply an exported history to a configured chat counter",
+    )
+    import_parser.add_argument("chat_id", type=int)
+    import_parser.add_argument("input", type=Path)
+    import_parser.add_argument(
+        "-f",
+        "--format",
+        choices=FORMATS,
+        help="history format, guessed from the input file by default",
+    )
+    adopt_parser = commands.add_parser(
+        "adopt-legacy",
+        help="move the game saved by the single chat versions to a chat",
+    )
+    adopt_parser.add_argument("chat_id", type=int)
+    adopt_parser.add_argument(
+        "save_file",
+        type=Path,
+        nargs="?",
+        default=LEGACY_SAVE_FILE,
+        help=f"legacy save file, {LEGACY_SAVE_FILE} by default",
+    )
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        export_chat(args.chat_id, args.output, args.format)
+    elif args.command == "import":
+        import_chat(args.chat_id, args.input, args.format)
+    elif args.command == "adopt-legacy":
+        adopt_legacy(args.chat_id, args.save_file)
+    else:
+        run_bot()
+
+
+def run_bot() -> None:
+    """Start the bot in the configured run mode."""
     if not BOT_TOKEN:
         raise TokenNotDefinedError("Could not find the token")
 
-    updater = Updater(BOT_TOKEN)
+    if LEGACY_SAVE_FILE.is_file() and LEGACY_SAVE_FILE.stat().st_size:
+        logger.warning(
+            "The game saved in %s is not used, move it to its chat with "
+            "gol-bot adopt-legacy <chat_id>",
+            LEGACY_SAVE_FILE,
+        )
+
+    metrics_server = MetricsServer(METRICS)
+
+    if METRICS_PORT:
+        metrics_server.start(METRICS_HOST, METRICS_PORT)
+
+    try:
+        if RUN_MODE == "webhook":
+            handle_updates(run_webhook)
+        elif RUN_MODE == "sharded":
+            # The workers own the counters, the router only forwards
+            run_sharded()
+        else:
+            handle_updates(run_polling)
+    finally:
+        metrics_server.stop()
+
+
+def handle_updates(runtime: Callable[[], None]) -> None:
+    """Run a runtime handling the updates in this process.
+
+    The counters, the chat actors, the outbox and the jobs are started
+    before it and stopped once it returns.
+
+    :param runtime: function receiving the updates until the bot stops.
+
+    """
+    from gbot.settings import (
+        CHAT_ACTORS,
+        COUNTERS,
+        OUTBOX,
+        PERSISTENCE,
+        PROFILER,
+        SCHEDULER,
+    )
+
+    PERSISTENCE.start()
+
+    if PROFILE:
+        PROFILER.enable()
+
+    try:
+        runtime()
+    finally:
+        SCHEDULER.stop()
+        CHAT_ACTORS.shutdown()
+        OUTBOX.stop()
+        PERSISTENCE.stop()
+        COUNTERS.close()
+        PROFILER.disable()
+
+
+def export_chat(
+    chat_id: int, output: Optional[Path], history_format: Optional[str]
+) -> None:
+    """Write the history of a chat counter.
+
+    :param chat_id: identification of the chat.
+    :param output: file where the history is written, or None for stdout.
+    :param history_format: format of the history. Guessed from the output
+        file if not provided.
+
+    """
+    from gbot.settings import STORE
+
+    if history_format is None:
+        history_format = detect_format(output) if output else "ndjson"
+
+    lines = export_history(
+        chat_id, STORE.history(chat_id), history_format
+    )
+
+    try:
+        if output is None:
+            sys.stdout.writelines(lines)
+        else:
+            with output.open("w", encoding="utf-8", newline="") as out_file:
+                out_file.writelines(lines)
+    finally:
+        STORE.close()
+
+
+def import_chat(
+    chat_id: int, history_file: Path, history_format: Optional[str]
+) -> None:
+    """Apply an exported history to a chat counter.
+
+    The chat counter must be configured, and the bot should not be running.
+
+    :param chat_id: identification of the chat.
+    :param history_file: file with the exported history.
+    :param history_format: format of the history. Guessed from the file if
+        not provided.
+
+    """
+    from gbot.settings import COUNTERS
+
+    try:
+        counter = COUNTERS[chat_id]
+
+        if not counter.is_configured():
+            raise CounterError(
+                f"The counter of the chat {chat_id} is not configured"
+            )
+
+        history_format = history_format or detect_format(history_file)
+
+        with history_file.open("r", encoding="utf-8", newline="") as lines:
+
+            def read_rows() -> Iterator[Row]:
+                lines.seek(0)
 
-    dispatcher = updater.dispatcher
+                return read_history(lines, history_format)
+
+            imported = import_history(counter, read_rows)
+
+        logger.info("Imported %s events in the chat %s", imported, chat_id)
+    finally:
+        COUNTERS.close()
+
+
+def adopt_legacy(chat_id: int, save_file: Path) -> None:
+    """Move the game saved by the single chat versions to a chat counter.
+
+    The saved game is restored in the chat counter, which must not be
+    configured, and saved in the store. The file is then renamed, so the
+    game is only adopted once. The bot should not be running.
+
+    :param chat_id: identification of the chat.
+    :param save_file: file with the saved game.
+
+    """
+    from gbot.settings import COUNTERS
+
+    try:
+        counter = COUNTERS[chat_id]
+
+        if counter.is_configured():
+            raise CounterError(
+                f"The counter of the chat {chat_id} is already configured"
+            )
+
+        try:
+            snapshot = json.loads(save_file.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as error:
+            raise WrongCounterFileFormatError(
+                f"Couldn't read the saved game: {error}"
+            )
+
+        if not isinstance(snapshot, dict) or "normals" not in snapshot:
+            raise WrongCounterFileFormatError(
+                f"There is no saved game in {save_file}"
+            )
+
+        counter.restore(snapshot)
+        counter.save_count()
+        save_file.rename(save_file.with_name(save_file.name + ".adopted"))
+        logger.info("Adopted the saved game in the chat %s", chat_id)
+    finally:
+        COUNTERS.close()
+
+
+def register_handlers(dispatcher: "Dispatcher") -> None:
+    """Add the bot command and message handlers to a dispatcher.
+
+    :param dispatcher: the dispatcher receiving the updates.
+
+    """
+    from telegram.ext import CommandHandler, Filters, MessageHandler
+
+    from gbot.commands import HANDLERS, process_audio
+    from gbot.settings import UPDATE_FILTER
 
     # Commands
-    dispatcher.add_handler(CommandHandler("help", command_help))
-    dispatcher.add_handler(CommandHandler("config", command_config))
-    dispatcher.add_handler(CommandHandler("flex", command_push_ups))
-    dispatcher.add_handler(CommandHandler("flexiones", command_push_ups))
-    dispatcher.add_handler(CommandHandler("error", command_error))
-    dispatcher.add_handler(CommandHandler("table", command_table))
+    for name, handler in HANDLERS.items():
+        dispatcher.add_handler(CommandHandler(name, handler))
 
     # Filters
-    dispatcher.add_handler(MessageHandler(Filters.voice, process_audio))
+    dispatcher.add_handler(
+        MessageHandler(
+            Filters.voice & UPDATE_FILTER.voice_filter(), process_audio
+        )
+    )
 
-    try:
-        COUNTER.load_count()
-    except WrongCounterFileFormatError:
-        logger.error("Couldn't load the file, configure the bot.")
 
-    updater.start_polling()
+def run_polling():
+    """Receive the updates by polling with the threaded dispatcher.
+
+    The polling resumes after the update checkpoint, so the updates already
+    processed are not requested again.
+
+    """
+    from telegram.ext import Updater
+
+    from gbot.prefilter import ALLOWED_UPDATES
+    from gbot.settings import CHECKPOINT, OUTBOX, SCHEDULER
+
+    updater = Updater(BOT_TOKEN)
+    checkpoint = CHECKPOINT.load()
+
+    if checkpoint is not None:
+        logger.info("Resuming the polling after the update %s", checkpoint)
+        updater.last_update_id = checkpoint + 1
+
+    register_handlers(updater.dispatcher)
+    OUTBOX.start(updater.bot)
+    SCHEDULER.schedule(updater.job_queue)
+
+    updater.start_polling(allowed_updates=ALLOWED_UPDATES)
     updater.idle()
 
 
+def run_webhook():
+    """Receive the updates through the asyncio webhook server."""
+    from telegram import Bot
+
+    from gbot.settings import OUTBOX, SCHEDULER, UPDATE_FILTER
+    from gbot.webhook import serve_webhook
+
+    bot = Bot(BOT_TOKEN)
+    OUTBOX.start(bot)
+
+    async def serve() -> None:
+        jobs = asyncio.get_running_loop().create_task(SCHEDULER.serve())
+
+        try:
+            await serve_webhook(
+                bot,
+                WEBHOOK_HOST,
+                WEBHOOK_PORT,
+                WEBHOOK_PATH,
+                WEBHOOK_URL or None,
+                OUTBOX,
+                UPDATE_FILTER,
+                WEBHOOK_SECRET or None,
+            )
+        finally:
+            SCHEDULER.stop()
+            await jobs
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        logger.info("Webhook server stopped")
+
+
+def run_sharded():
+    """Route the webhook updates to one worker process per shard of chats."""
+    from telegram import Bot
+
+    from gbot.sharding import ShardRouter, serve_sharded
+
+    # Every chat must have its own files, so each worker owns its chats
+    if STORE_BACKEND != "json":
+        raise BotError("The sharded mode needs the json store")
+
+    router = ShardRouter()
+    router.start(SHARDS)
+
+    try:
+        asyncio.run(
+            serve_sharded(
+                router,
+                WEBHOOK_HOST,
+                WEBHOOK_PORT,
+                WEBHOOK_PATH,
+                WEBHOOK_URL or None,
+                Bot(BOT_TOKEN),
+                WEBHOOK_SECRET or None,
+            )
+        )
+    except KeyboardInterrupt:
+        logger.info("Webhook router stopped")
+    finally:
+        router.stop()
+
+
 if __name__ == "__main__":
     main()
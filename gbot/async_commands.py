@@ -0,0 +1,63 @@
+# Copyright (c) 2021 Luis Liñán Villafranca. All rights reserved.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>
+#
+# pylint: disable=W0613, C0116
+# type: ignore[union-attr]
+"""Asynchronous versions of the :mod:`gbot.commands` handlers.
+
+The commands of :mod:`gbot.processing` run in the chat actors, as the
+threaded handlers do, so the journal writes and the snapshot saves never
+block the event loop. Their replies are sent through the webhook context.
+
+"""
+from functools import wraps
+from typing import TYPE_CHECKING, Any, Callable, Dict
+
+from telegram import Update
+
+from gbot import processing
+from gbot.decorators import (
+    call_in_chat_actor,
+    ensure_counter_initialization,
+    instrument,
+)
+
+if TYPE_CHECKING:
+    from gbot.webhook import WebhookContext
+
+
+def handler(command: processing.Command) -> Callable:
+    """Build the coroutine function handling a command.
+
+    :param command: the command.
+    :returns: the handler.
+
+    """
+    func = command.func
+
+    @wraps(func)
+    async def wrapper(
+        update: Update, context: "WebhookContext", *args: Any
+    ) -> None:
+        replies = await call_in_chat_actor(
+            update.effective_chat.id, func, update, *args
+        )
+
+        for reply in replies:
+            if reply.document is not None:
+                await context.reply_document(reply.document, reply.filename)
+            else:
+                await context.reply(reply.text, reply.parse_mode, reply.key)
+
+    if command.counter:
+        wrapper = ensure_counter_initialization(command.warn)(wrapper)
+
+    return instrument(wrapper)
+
+
+COMMANDS: Dict[str, Callable] = {
+    name: handler(command) for name, command in processing.COMMANDS.items()
+}
+process_audio = handler(processing.VOICE)
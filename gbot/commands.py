@@ -5,91 +5,66 @@
 #
 # pylint: disable=W0613, C0116
 # type: ignore[union-attr]
-"""Methods to allow commands and messages processing."""
-from telegram import Update
-from telegram.ext import CallbackContext
-from telegram.constants import PARSEMODE_MARKDOWN
+"""Methods to allow commands and messages processing.
 
-from gbot.decorators import ensure_counter_initialization
-from gbot.settings import COUNTER, HELP_FILE
+The handlers run the commands of :mod:`gbot.processing` in the chat actors
+and send their replies through the outbox.
 
+"""
+from functools import wraps
+from typing import TYPE_CHECKING, Any, Callable, Dict
 
-def command_help(update: Update, context: CallbackContext) -> None:
-    """Send a message when the command /help is issued.
+from gbot import processing
+from gbot.decorators import (
+    ensure_counter_initialization,
+    instrument,
+    run_in_chat_actor,
+)
+from gbot.settings import OUTBOX
 
-    :param update: the update information.
-    :param context: context for the current update.
+if TYPE_CHECKING:
+    from telegram import Update
+    from telegram.ext import CallbackContext
 
-    """
-    update.message.reply_text(open(HELP_FILE, "r").read())
-
-
-def command_config(update: Update, context: CallbackContext) -> None:
-    """Configure the Push-Ups counter.
-
-    :param update: the update information.
-    :param context: context for the current update.
-
-    """
-    lines = update.message.text.splitlines()[1:]
-
-    if len(lines) != 4:
-        command_help(update, context)
-        return
 
-    COUNTER.config(*lines)
+def send_replies(update: "Update", replies: processing.Replies) -> None:
+    """Queue the replies to an update in the outbox.
 
-
-@ensure_counter_initialization(True)
-def command_push_ups(update: Update, context: CallbackContext) -> None:
-    """Add a new push-ups.
-
-    :param update: the update information.
-    :param context: context for the current update.
+    :param update: the update being answered.
+    :param replies: the replies.
 
     """
-    sender = str(update.message.from_user.id)
-    receiber = (
-        str(update.message.reply_to_message.from_user.id)
-        if update.message.reply_to_message
-        else COUNTER.opposite(sender)
-    )
-    COUNTER.add_pushups(
-        receiber,
-        sender,
-    )
+    for reply in replies:
+        if reply.document is not None:
+            OUTBOX.reply_document(update, reply.document, reply.filename)
+        elif reply.parse_mode:
+            OUTBOX.reply(
+                update, reply.text, reply.key, parse_mode=reply.parse_mode
+            )
+        else:
+            OUTBOX.reply(update, reply.text, reply.key)
 
 
-@ensure_counter_initialization(True)
-def command_error(update: Update, context: CallbackContext) -> None:
-    """Process an error push-up.
+def handler(command: processing.Command) -> Callable:
+    """Build the handler of a command for the threaded dispatcher.
 
-    :param update: the update information.
-    :param context: context for the current update.
+    :param command: the command.
+    :returns: the handler.
 
     """
-    COUNTER.process_error(str(update.message.from_user.id))
+    func = command.func
 
+    @wraps(func)
+    def wrapper(update: "Update", context: "CallbackContext", *args: Any):
+        send_replies(update, func(update, *args))
 
-@ensure_counter_initialization(True)
-def command_table(update: Update, context: CallbackContext) -> None:
-    """Send a table with the current push-up information.
+    if command.counter:
+        wrapper = ensure_counter_initialization(command.warn)(wrapper)
 
-    :param update: the update information.
-    :param context: context for the current update.
-
-    """
-    update.message.reply_text(
-        f"```{COUNTER.push_up_table()}```", parse_mode=PARSEMODE_MARKDOWN
-    )
+    return run_in_chat_actor(instrument(wrapper))
 
 
-@ensure_counter_initialization()
-def process_audio(update: Update, context: CallbackContext) -> None:
-    """Process an audio message.
-
-    :param update: the update information.
-    :param context: context for the current update.
-
-    """
-    COUNTER.process_audio(str(update.message.from_user.id))
+HANDLERS: Dict[str, Callable] = {
+    name: handler(command) for name, command in processing.COMMANDS.items()
+}
+process_audio = handler(processing.VOICE)
@@ -6,20 +6,179 @@
 # pylint: disable=W0613, C0116
 # type: ignore[union-attr]
 """Util decorators for the  :mod:`gbot` module."""
-from typing import Callable
+import asyncio
+import logging
+import time
 
-from telegram import Update
-from telegram.ext import CallbackContext
+from concurrent.futures import Future
+from functools import wraps
+from typing import TYPE_CHECKING, Any, Callable
 
-from gbot.settings import COUNTER
+from gbot.metrics import HANDLER_CALLS, HANDLER_ERRORS, HANDLER_LATENCY
+from gbot.settings import (
+    CHAT_ACTORS,
+    CHECKPOINT,
+    COUNTERS,
+    OUTBOX,
+    PROFILER,
+    UPDATE_FILTER,
+)
+
+if TYPE_CHECKING:
+    from telegram import Update
+    from telegram.ext import CallbackContext
+
+NOT_CONFIGURED_MESSAGE = "Please, configure the bot with /config first"
+
+logger = logging.getLogger(__name__)
+
+
+def run_in_chat_actor(func: Callable) -> Callable:
+    """Run the handler after the pending ones of the same chat.
+
+    The handler is queued in the chat actor and the dispatcher thread is
+    released immediately. Updates of a chat are applied in order, while
+    different chats are handled in parallel. The chat counter is pinned while
+    the handler runs, so it is not evicted under it, and the update
+    checkpoint doesn't move past the update until the handler finishes.
+
+    :param func: bot function to run.
+
+    """
+
+    def log_error(future: Future) -> None:
+        """Log the exception raised by the handler, if any.
+
+        :param future: the handler future.
+
+        """
+        error = future.exception()
+
+        if error is not None:
+            logger.error("Error in handler %s", func.__name__, exc_info=error)
+
+    @wraps(func)
+    def wrapper(update: "Update", context: "CallbackContext") -> None:
+        chat_id = update.effective_chat.id
+        update_id = update.update_id
+        CHECKPOINT.begin(update_id)
+
+        try:
+            future = CHAT_ACTORS.submit(
+                chat_id, _call_pinned, chat_id, func, update, context
+            )
+        except BaseException:
+            CHECKPOINT.done(update_id)
+            raise
+
+        future.add_done_callback(log_error)
+        future.add_done_callback(lambda _: CHECKPOINT.done(update_id))
+
+    return wrapper
+
+
+async def call_in_chat_actor(
+    chat_id: int, func: Callable, *args: Any
+) -> Any:
+    """Run a blocking call after the pending ones of the same chat.
+
+    The call runs in the chat actor with the chat counter pinned, so the
+    counter disk access doesn't block the event loop.
+
+    :param chat_id: identification of the chat.
+    :param func: function to run.
+    :param args: arguments for the function.
+    :returns: the function result.
+
+    """
+    return await asyncio.wrap_future(
+        CHAT_ACTORS.submit(chat_id, _call_pinned, chat_id, func, *args)
+    )
+
+
+def _call_pinned(chat_id: int, func: Callable, *args: Any) -> Any:
+    """Run a function with the counter of a chat pinned.
+
+    :param chat_id: identification of the chat.
+    :param func: function to run.
+    :param args: arguments for the function.
+    :returns: the function result.
+
+    """
+    COUNTERS.pin(chat_id)
+
+    try:
+        return func(*args)
+    finally:
+        COUNTERS.unpin(chat_id)
+
+
+def instrument(func: Callable) -> Callable:
+    """Record the calls, errors and latency of a handler.
+
+    The metrics are labeled with the handler name, which also names the
+    handler in the profiling reports. Coroutine functions are also accepted.
+
+    :param func: bot function to run.
+
+    """
+    name = func.__name__
+
+    def record(start: float, failed: bool) -> None:
+        """Record a finished call of the handler.
+
+        :param start: ``time.perf_counter`` value when the call started.
+        :param failed: whether the handler raised an error.
+
+        """
+        HANDLER_LATENCY.observe(time.perf_counter() - start, name)
+        HANDLER_CALLS.inc(name)
+
+        if failed:
+            HANDLER_ERRORS.inc(name)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        failed = True
+
+        try:
+            result = PROFILER.call(name, func, *args, **kwargs)
+            failed = False
+            return result
+        finally:
+            record(start, failed)
+
+    @wraps(func)
+    async def async_wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        failed = True
+
+        try:
+            result = await PROFILER.call_async(name, func, *args, **kwargs)
+            failed = False
+            return result
+        finally:
+            record(start, failed)
+
+    if asyncio.iscoroutinefunction(func):
+        return async_wrapper
+
+    return wrapper
 
 
 def ensure_counter_initialization(
     warn: bool = False,
 ) -> Callable:
-    """Ensure the counter is correctly configured.
+    """Ensure the chat counter is correctly configured.
+
+    The decorated function receives the chat counter as a third argument.
+    Coroutine functions are also accepted, in which case the counter is
+    loaded in the chat actor and pinned until the function returns, and the
+    warning is sent through the webhook context. The update filter learns the
+    chat state once the function returns.
 
-    :param warn: bot function to run.
+    :param warn: whether to warn the user when the counter is not configured.
 
     """
 
@@ -30,15 +189,44 @@ def ensure_counter_initialization(
 
         """
 
-        def wrapper(update: Update, context: CallbackContext) -> None:
-            if COUNTER.is_configured():
-                return func(update, context)
+        @wraps(func)
+        def wrapper(update: "Update", context: "CallbackContext") -> None:
+            counter = COUNTERS[update.effective_chat.id]
 
-            if warn:
-                update.message.reply_text(
-                    "Please, configure the bot with /config first"
+            try:
+                if counter.is_configured():
+                    return func(update, context, counter)
+
+                if warn:
+                    OUTBOX.reply(update, NOT_CONFIGURED_MESSAGE)
+            finally:
+                UPDATE_FILTER.track(counter)
+
+        @wraps(func)
+        async def async_wrapper(update: "Update", context) -> None:
+            chat_id = update.effective_chat.id
+            COUNTERS.pin(chat_id)
+
+            try:
+                counter = await call_in_chat_actor(
+                    chat_id, COUNTERS.get, chat_id
                 )
 
+                try:
+                    if counter.is_configured():
+                        return await func(update, context, counter)
+
+                    if warn:
+                        await context.reply(NOT_CONFIGURED_MESSAGE)
+                finally:
+                    UPDATE_FILTER.track(counter)
+            finally:
+                # Unpinning may unload counters, so it is done in the actor
+                CHAT_ACTORS.submit(chat_id, COUNTERS.unpin, chat_id)
+
+        if asyncio.iscoroutinefunction(func):
+            return async_wrapper
+
         return wrapper
 
     return inner
@@ -0,0 +1,333 @@
+# Copyright (c) 2021 Luis Liñán Villafranca. All rights reserved.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>
+"""Scheduled jobs run over every chat: weekly rollover and reminders.
+
+Every run reads the snapshots of the chats once, and works out what each one
+needs from the day and hour of its timezone:
+
+- On weekdays, the weekend flags still set are cleared. The rollover is
+  idempotent, so a run missed on Monday is caught up by the next one.
+- At the reminder hour, the chats with pending push-ups get a digest of them,
+  once a day per timezone.
+
+The work is split in batches. The rollovers of a batch are done in bulk by
+the counters store, and the reminders are queued in the outbox. Between two
+batches the scheduler waits a random time, and while the outbox has too many
+pending messages, so a run over thousands of chats doesn't take over the CPU
+nor the sending rate of the replies.
+
+"""
+import asyncio
+import logging
+import random
+import threading
+
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
+
+from gbot.metrics import JOB_CHATS
+from gol.clock import DEFAULT_CLOCK, RuleClock
+from gol.error import UnknownTimezoneError, WrongCounterFileFormatError
+from gol.ledger import NormalsLedger
+from gol.rules import DayClass
+
+if TYPE_CHECKING:
+    from telegram.ext import JobQueue
+
+    from gbot.outbox import Outbox
+    from gbot.prefilter import UpdateFilter
+    from gol.registry import CounterRegistry
+
+logger = logging.getLogger(__name__)
+
+Item = TypeVar("Item")
+DayEntry = Tuple[DayClass, int, int]
+
+
+class Scheduler:
+    """Run the rollover and reminder jobs periodically over every chat.
+
+    :ivar _registry: registry with the counters of every chat.
+    :ivar _outbox: outbox sending the reminders.
+    :ivar _update_filter: filter forgetting the chats after a rollover, if
+        any.
+    :ivar _clock: clock telling the day and hour of the chats.
+    :ivar _reminder_hour: local hour when the reminders are sent, or None to
+        not send them.
+    :ivar _batch_size: chats handled in every batch.
+    :ivar _jitter: maximum seconds waited between two batches.
+    :ivar _max_pending: outbox pending messages above which the reminders
+        wait.
+    :ivar _interval: seconds between two runs.
+    :ivar _owns: function telling if a chat is handled by this scheduler.
+    :ivar _reminded: day ordinal of the last reminders of every timezone.
+    :ivar _random: generator of the waits.
+    :ivar _stopped: event set when the scheduler is asked to stop.
+
+    """
+
+    def __init__(
+        self,
+        registry: "CounterRegistry",
+        outbox: "Outbox",
+        update_filter: Optional["UpdateFilter"] = None,
+        clock: RuleClock = DEFAULT_CLOCK,
+        reminder_hour: Optional[int] = 20,
+        batch_size: int = 200,
+        jitter: float = 2.0,
+        max_pending: int = 100,
+        interval: float = 900.0,
+    ) -> None:
+        """Instantiate the class.
+
+        :param registry: registry with the counters of every chat.
+        :param outbox: outbox sending the reminders.
+        :param update_filter: filter forgetting the chats after a rollover.
+        :param clock: clock telling the day and hour of the chats.
+        :param reminder_hour: local hour when the reminders are sent, or None
+            to not send them.
+        :param batch_size: chats handled in every batch.
+        :param jitter: maximum seconds waited between two batches.
+        :param max_pending: outbox pending messages above which the reminders
+            wait.
+        :param interval: seconds between two runs. It should not be longer
+            than an hour, or the reminders of some timezones may be missed.
+
+        """
+        if batch_size <= 0 or interval <= 0:
+            raise ValueError("The batch size and interval must be positive")
+
+        self._registry: "CounterRegistry" = registry
+        self._outbox: "Outbox" = outbox
+        self._update_filter: Optional["UpdateFilter"] = update_filter
+        self._clock: RuleClock = clock
+        self._reminder_hour: Optional[int] = reminder_hour
+        self._batch_size: int = batch_size
+        self._jitter: float = jitter
+        self._max_pending: int = max_pending
+        self._interval: float = interval
+        self._owns: Callable[[int], bool] = lambda chat_id: True
+        self._reminded: Dict[Optional[str], int] = {}
+        self._random = random.Random()
+        self._stopped = threading.Event()
+
+    @property
+    def owns(self) -> Callable[[int], bool]:
+        """Variable ``_owns`` getter.
+
+        :returns: the ``_owns`` value.
+
+        """
+        return self._owns
+
+    @owns.setter
+    def owns(self, owns: Callable[[int], bool]) -> None:
+        """Variable ``_owns`` setter.
+
+        :param owns: function telling if a chat, given its identification, is
+            handled by this scheduler.
+
+        """
+        self._owns = owns
+
+    def run(self, timestamp: Optional[float] = None) -> Dict[str, int]:
+        """Run the jobs once over every chat.
+
+        :param timestamp: the UNIX timestamp of the run. The current one if
+            not provided.
+        :returns: the number of chats reset and reminded.
+
+        """
+        if timestamp is None:
+            timestamp = self._clock.now()
+
+        rollover, reminders, reminded = self._plan(timestamp)
+        reset = 0
+
+        for batch in self._batches(rollover):
+            reset += self._registry.reset_weekend(batch)
+
+            if self._update_filter is not None:
+                self._update_filter.forget(batch)
+
+        JOB_CHATS.inc("rollover", amount=reset)
+        sent = 0
+
+        for batch in self._batches(reminders):
+            for chat_id, text in batch:
+                self._outbox.send(chat_id, text, key="reminder")
+
+            sent += len(batch)
+
+        JOB_CHATS.inc("reminder", amount=sent)
+        self._reminded.update(reminded)
+        logger.info(
+            "Scheduled jobs reset %s chats and reminded %s chats", reset, sent
+        )
+
+        return {"rollover": reset, "reminder": sent}
+
+    def schedule(self, job_queue: "JobQueue") -> None:
+        """Run the jobs periodically in the job queue of the bot.
+
+        :param job_queue: the job queue of the updater.
+
+        """
+        job_queue.run_repeating(
+            lambda context: self._run_safely(),
+            self._interval,
+            first=self._random.uniform(0, self._jitter),
+            name="gol-scheduled-jobs",
+        )
+
+    async def serve(self) -> None:
+        """Run the jobs periodically in the running event loop.
+
+        The runs are done in an executor thread, until cancelled or stopped.
+
+        """
+        loop = asyncio.get_running_loop()
+        delay = self._random.uniform(0, self._jitter)
+        self._stopped.clear()
+
+        while not await loop.run_in_executor(None, self._stopped.wait, delay):
+            await loop.run_in_executor(None, self._run_safely)
+            delay = self._interval
+
+    def stop(self) -> None:
+        """Stop the running jobs after the current batch."""
+        self._stopped.set()
+
+    def _run_safely(self) -> None:
+        """Run the jobs once, logging the errors instead of raising them."""
+        try:
+            self.run()
+        except Exception:  # pylint: disable=W0703
+            logger.exception("The scheduled jobs failed")
+
+    def _plan(
+        self, timestamp: float
+    ) -> Tuple[List[int], List[Tuple[int, str]], Dict[Optional[str], int]]:
+        """Decide what every chat needs, reading their snapshots once.
+
+        :param timestamp: the UNIX timestamp of the run.
+        :returns: the chats to reset, the reminders to send and the day of the
+            timezones being reminded.
+
+        """
+        days: Dict[Optional[str], Optional[DayEntry]] = {}
+        rollover: List[int] = []
+        reminders: List[Tuple[int, str]] = []
+        reminded: Dict[Optional[str], int] = {}
+
+        for chat_id, snapshot in self._registry.snapshots(self._owns):
+            timezone = snapshot.get("timezone")
+
+            if timezone not in days:
+                days[timezone] = self._day(timezone, timestamp)
+
+            day = days[timezone]
+
+            if day is None:
+                continue
+
+            day_class, day_number, hour = day
+            participants = snapshot.get("participants") or []
+
+            if day_class is DayClass.WEEKDAY and any(
+                person.get("rip_wknd") for person in participants
+            ):
+                rollover.append(chat_id)
+
+            if (
+                hour == self._reminder_hour
+                and self._reminded.get(timezone) != day_number
+            ):
+                reminded[timezone] = day_number
+                text = digest(snapshot)
+
+                if text is not None:
+                    reminders.append((chat_id, text))
+
+        return rollover, reminders, reminded
+
+    def _day(
+        self, timezone: Optional[str], timestamp: float
+    ) -> Optional[DayEntry]:
+        """Get the day class, day ordinal and hour of a timezone.
+
+        :param timezone: name of the timezone, or None for the local time.
+        :param timestamp: the UNIX timestamp of the run.
+        :returns: the day class, ordinal and hour, or None if the timezone is
+            not known.
+
+        """
+        try:
+            return (
+                self._clock.day_class(timezone, timestamp),
+                self._clock.day_number(timezone, timestamp),
+                self._clock.hour(timezone, timestamp),
+            )
+        except UnknownTimezoneError as error:
+            logger.error("Skipped the chats of a timezone: %s", error)
+            return None
+
+    def _batches(self, items: Sequence[Item]) -> Iterator[List[Item]]:
+        """Split some work in batches, waiting between them.
+
+        Before every batch but the first, a random time up to the jitter is
+        waited, and then until the outbox has room for the batch. No more
+        batches are given once stopped.
+
+        :param items: the work items.
+        :returns: an iterator over the batches.
+
+        """
+        for start in range(0, len(items), self._batch_size):
+            if start and self._stopped.wait(
+                self._random.uniform(0, self._jitter)
+            ):
+                return
+
+            while len(self._outbox) > self._max_pending:
+                if self._stopped.wait(max(self._jitter, 0.1)):
+                    return
+
+            yield list(items[start : start + self._batch_size])
+
+
+def digest(snapshot: Dict[str, Any]) -> Optional[str]:
+    """Write the pending push-ups of a chat.
+
+    :param snapshot: the counter snapshot.
+    :returns: the digest, or None if nobody has pending push-ups.
+
+    """
+    try:
+        normals = NormalsLedger.from_json(snapshot.get("normals") or {})
+    except WrongCounterFileFormatError:
+        return None
+
+    lines = [
+        f"{person['name']} has to do {normals.owed_by(person['id'])} normal "
+        f"and {person['punishments']} punishment push-up blocks"
+        for person in snapshot.get("participants") or []
+        if normals.owed_by(person["id"]) or person["punishments"]
+    ]
+
+    if not lines:
+        return None
+
+    return "Pending push-ups:\n" + "\n".join(lines)
@@ -0,0 +1,537 @@
+# Copyright (c) 2021 Luis Liñán Villafranca. All rights reserved.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>
+"""Bot metrics exposed in the Prometheus text format."""
+import logging
+import threading
+
+from bisect import bisect_left
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+LabelValues = Tuple[str, ...]
+MetricType = TypeVar("MetricType", bound="Metric")
+
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Metric:
+    """Base class of the metrics, with one value per set of label values.
+
+    :ivar _name: name of the metric.
+    :ivar _documentation: description of the metric.
+    :ivar _labels: names of the labels of the metric.
+    :ivar _lock: lock protecting the metric values.
+
+    """
+
+    TYPE = "untyped"
+
+    def __init__(
+        self, name: str, documentation: str, labels: Sequence[str] = ()
+    ) -> None:
+        """Instantiate the class.
+
+        :param name: name of the metric.
+        :param documentation: description of the metric.
+        :param labels: names of the labels of the metric.
+
+        """
+        self._name: str = name
+        self._documentation: str = documentation
+        self._labels: LabelValues = tuple(labels)
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        """Variable ``_name`` getter.
+
+        :returns: the ``_name`` value.
+
+        """
+        return self._name
+
+    def expose(self) -> List[str]:
+        """Write the metric in the text exposition format.
+
+        :returns: the lines of the metric.
+
+        """
+        return [
+            f"# HELP {self._name} {self._documentation}",
+            f"# TYPE {self._name} {self.TYPE}",
+            *self._samples(),
+        ]
+
+    def _samples(self) -> List[str]:
+        """Write the samples of the metric.
+
+        :returns: a line per sample.
+
+        """
+        return []
+
+    def _check(self, label_values: LabelValues) -> None:
+        """Check the number of label values.
+
+        :param label_values: values of the labels.
+
+        """
+        if len(label_values) != len(self._labels):
+            raise ValueError(
+                f"{self._name} expects the labels {', '.join(self._labels)}"
+            )
+
+    def _format(
+        self,
+        suffix: str,
+        label_values: LabelValues,
+        value: float,
+        extra: Optional[Tuple[str, str]] = None,
+    ) -> str:
+        """Write a sample line.
+
+        :param suffix: suffix appended to the metric name.
+        :param label_values: values of the labels.
+        :param value: value of the sample.
+        :param extra: additional label name and value.
+        :returns: the sample line.
+
+        """
+        pairs = list(zip(self._labels, label_values))
+
+        if extra is not None:
+            pairs.append(extra)
+
+        labels = ",".join(
+            f'{label}="{_escape(str(label_value))}"'
+            for label, label_value in pairs
+        )
+        labels = f"{{{labels}}}" if labels else ""
+
+        return f"{self._name}{suffix}{labels} {_number(value)}"
+
+
+class Counter(Metric):
+    """Metric that only increases.
+
+    :ivar _values: value for every set of label values.
+
+    """
+
+    TYPE = "counter"
+
+    def __init__(
+        self, name: str, documentation: str, labels: Sequence[str] = ()
+    ) -> None:
+        """Instantiate the class.
+
+        :param name: name of the metric.
+        :param documentation: description of the metric.
+        :param labels: names of the labels of the metric.
+
+        """
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        """Increase the metric.
+
+        :param label_values: values of the labels.
+        :param amount: amount to increase.
+
+        """
+        self._check(label_values)
+
+        with self._lock:
+            self._values[label_values] = (
+                self._values.get(label_values, 0) + amount
+            )
+
+    def value(self, *label_values: str) -> float:
+        """Get the current value of the metric.
+
+        :param label_values: values of the labels.
+        :returns: the value, 0 if it was never increased.
+
+        """
+        self._check(label_values)
+
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def _samples(self) -> List[str]:
+        """Write the samples of the metric.
+
+        :returns: a line per sample.
+
+        """
+        with self._lock:
+            values = sorted(self._values.items())
+
+        return [
+            self._format("", label_values, value)
+            for label_values, value in values
+        ]
+
+
+class Histogram(Metric):
+    """Metric counting the observed values in cumulative buckets.
+
+    :ivar _buckets: upper bounds of the buckets, in ascending order.
+    :ivar _values: count of every bucket, sum and count of the observed
+        values for every set of label values.
+
+    """
+
+    TYPE = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        """Instantiate the class.
+
+        :param name: name of the metric.
+        :param documentation: description of the metric.
+        :param labels: names of the labels of the metric.
+        :param buckets: upper bounds of the buckets, in ascending order.
+
+        """
+        super().__init__(name, documentation, labels)
+        self._buckets: Tuple[float, ...] = tuple(buckets)
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        """Count an observed value.
+
+        :param value: the observed value.
+        :param label_values: values of the labels.
+
+        """
+        self._check(label_values)
+        bucket = bisect_left(self._buckets, value)
+
+        with self._lock:
+            entry = self._values.get(label_values)
+
+            if entry is None:
+                entry = self._values[label_values] = (
+                    [0] * (len(self._buckets) + 1),
+                    [0.0],
+                )
+
+            entry[0][bucket] += 1
+            entry[1][0] += value
+
+    def _samples(self) -> List[str]:
+        """Write the samples of the metric.
+
+        :returns: a line per sample.
+
+        """
+        with self._lock:
+            values = sorted(
+                (label_values, list(counts), total[0])
+                for label_values, (counts, total) in self._values.items()
+            )
+
+        samples = []
+
+        for label_values, counts, total in values:
+            cumulative = 0
+
+            for bound, count in zip(self._buckets + (float("inf"),), counts):
+                cumulative += count
+                samples.append(
+                    self._format(
+                        "_bucket",
+                        label_values,
+                        cumulative,
+                        ("le", _number(bound)),
+                    )
+                )
+
+            samples.append(self._format("_sum", label_values, total))
+            samples.append(self._format("_count", label_values, cumulative))
+
+        return samples
+
+
+class Gauge(Metric):
+    """Metric reading its value from a function when exposed.
+
+    :ivar _function: function returning the current value.
+
+    """
+
+    TYPE = "gauge"
+
+    def __init__(
+        self, name: str, documentation: str, function: Callable[[], float]
+    ) -> None:
+        """Instantiate the class.
+
+        :param name: name of the metric.
+        :param documentation: description of the metric.
+        :param function: function returning the current value.
+
+        """
+        super().__init__(name, documentation)
+        self._function: Callable[[], float] = function
+
+    def _samples(self) -> List[str]:
+        """Write the samples of the metric.
+
+        :returns: a line per sample.
+
+        """
+        return [self._format("", (), self._function())]
+
+
+class MetricsRegistry:
+    """Collection of metrics exposed together.
+
+    :ivar _metrics: registered metrics by name.
+
+    """
+
+    def __init__(self) -> None:
+        """Instantiate the class."""
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: MetricType) -> MetricType:
+        """Add a metric to the registry.
+
+        :param metric: the metric.
+        :returns: the registered metric.
+
+        """
+        if metric.name in self._metrics:
+            raise ValueError(f"The metric {metric.name} already exists")
+
+        self._metrics[metric.name] = metric
+
+        return metric
+
+    def exposition(self) -> str:
+        """Write every metric in the text exposition format.
+
+        :returns: the metrics text.
+
+        """
+        lines = []
+
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.expose())
+
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """HTTP server exposing the metrics on ``/metrics`` from a thread.
+
+    :ivar _registry: metrics to expose.
+    :ivar _server: the running HTTP server, if any.
+    :ivar _thread: thread running the server, if any.
+
+    """
+
+    def __init__(self, registry: MetricsRegistry) -> None:
+        """Instantiate the class.
+
+        :param registry: metrics to expose.
+
+        """
+        self._registry: MetricsRegistry = registry
+        self._server: Optional["ThreadingHTTPServer"] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        """Get the port the server is listening on.
+
+        :returns: the port, useful when started on port 0.
+
+        """
+        if self._server is None:
+            raise RuntimeError("The metrics server is not running")
+
+        return self._server.server_address[1]
+
+    def start(self, host: str, port: int) -> None:
+        """Listen for metrics requests.
+
+        :param host: address to listen on.
+        :param port: port to listen on.
+
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        registry = self._registry
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            """Answer the metrics requests."""
+
+            def do_GET(self) -> None:  # pylint: disable=C0103
+                """Send the metrics."""
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+
+                body = registry.exposition().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                """Log the requests in debug level."""
+                logger.debug(format, *args)
+
+        self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="gol-metrics", daemon=True
+        )
+        self._thread.start()
+        logger.info("Serving metrics on %s:%s/metrics", host, self.port)
+
+    def stop(self) -> None:
+        """Stop listening for metrics requests."""
+        if self._server is None:
+            return
+
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = self._thread = None
+
+
+def _escape(value: str) -> str:
+    """Escape a label value.
+
+    :param value: the label value.
+    :returns: the escaped value.
+
+    """
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    """Write a sample value.
+
+    :param value: the value.
+    :returns: the value text.
+
+    """
+    if value == float("inf"):
+        return "+Inf"
+
+    if float(value).is_integer():
+        return str(int(value))
+
+    return repr(float(value))
+
+
+METRICS = MetricsRegistry()
+HANDLER_CALLS = METRICS.register(
+    Counter("gol_handler_calls_total", "Handled updates.", ("handler",))
+)
+HANDLER_ERRORS = METRICS.register(
+    Counter(
+        "gol_handler_errors_total",
+        "Updates whose handler raised an error.",
+        ("handler",),
+    )
+)
+HANDLER_LATENCY = METRICS.register(
+    Histogram(
+        "gol_handler_latency_seconds",
+        "Time running the update handlers.",
+        ("handler",),
+    )
+)
+STORE_WRITE_LATENCY = METRICS.register(
+    Histogram(
+        "gol_store_write_seconds",
+        "Time writing to the counters store.",
+        ("kind",),
+    )
+)
+STORE_WRITE_SIZE = METRICS.register(
+    Histogram(
+        "gol_store_write_bytes",
+        "Serialized bytes written to the counters store.",
+        ("kind",),
+        SIZE_BUCKETS,
+    )
+)
+OUTBOX_MESSAGES = METRICS.register(
+    Counter(
+        "gol_outbox_messages_total",
+        "Outgoing messages sent, coalesced, retried or failed.",
+        ("outcome",),
+    )
+)
+UPDATES_DROPPED = METRICS.register(
+    Counter(
+        "gol_updates_dropped_total",
+        "Updates discarded before being dispatched.",
+        ("reason",),
+    )
+)
+JOB_CHATS = METRICS.register(
+    Counter(
+        "gol_job_chats_total",
+        "Chats reset or reminded by the scheduled jobs.",
+        ("job",),
+    )
+)
+
+
+def observe_write(kind: str, seconds: float, size: int) -> None:
+    """Record a write of the counters store.
+
+    :param kind: kind of write, ``append`` or ``save``.
+    :param seconds: duration of the write.
+    :param size: number of serialized bytes written.
+
+    """
+    STORE_WRITE_LATENCY.observe(seconds, kind)
+    STORE_WRITE_SIZE.observe(size, kind)
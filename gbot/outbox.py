@@ -0,0 +1,513 @@
+# Copyright (c) 2021 Luis Liñán Villafranca. All rights reserved.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>
+"""Rate limited queue of the outgoing messages."""
+import heapq
+import logging
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import Future
+from typing import (
+    IO,
+    TYPE_CHECKING,
+    Any,
+    Deque,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+from gbot.metrics import OUTBOX_MESSAGES
+
+if TYPE_CHECKING:
+    from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Allow a number of events per second, with bursts of a given size.
+
+    :ivar _rate: tokens added per second.
+    :ivar _burst: maximum number of tokens.
+    :ivar _tokens: tokens available at ``_updated``.
+    :ivar _updated: monotonic time of the last update of the tokens.
+
+    """
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        """Instantiate the class.
+
+        :param rate: tokens added per second.
+        :param burst: maximum number of tokens.
+
+        """
+        if rate <= 0 or burst <= 0:
+            raise ValueError("The rate and burst must be positive")
+
+        self._rate: float = rate
+        self._burst: int = burst
+        self._tokens: float = burst
+        self._updated: float = time.monotonic()
+
+    def delay(self, now: float) -> float:
+        """Get the time until a token is available.
+
+        :param now: current monotonic time.
+        :returns: the seconds to wait, 0 if a token is available now.
+
+        """
+        self._refill(now)
+
+        return max(0.0, (1 - self._tokens) / self._rate)
+
+    def is_full(self, now: float) -> bool:
+        """Check if the bucket has every token.
+
+        :param now: current monotonic time.
+        :returns: True if the bucket is as if it was never used.
+
+        """
+        self._refill(now)
+
+        return self._tokens >= self._burst
+
+    def drain(self, now: float, seconds: float) -> None:
+        """Take the tokens so the next one is only available after a time.
+
+        :param now: current monotonic time.
+        :param seconds: seconds until the next token.
+
+        """
+        self._refill(now)
+        self._tokens = min(self._tokens, 1 - seconds * self._rate)
+
+    def take(self, now: float) -> None:
+        """Consume a token, which may leave the bucket in debt.
+
+        :param now: current monotonic time.
+
+        """
+        self._refill(now)
+        self._tokens -= 1
+
+    def _refill(self, now: float) -> None:
+        """Add the tokens generated since the last update.
+
+        :param now: current monotonic time.
+
+        """
+        elapsed = max(0.0, now - self._updated)
+        self._tokens = min(self._burst, self._tokens + elapsed * self._rate)
+        self._updated = now
+
+
+class Message:
+    """A message waiting to be sent.
+
+    :ivar chat_id: identification of the destination chat.
+    :ivar key: key of the message, pending messages of a chat with the same
+        key are sent only once. None if the message is never coalesced.
+    :ivar method: bot method sending the message.
+    :ivar content: text of the message, or file of the document.
+    :ivar options: other arguments of the bot method.
+    :ivar future: future completed when the message is sent.
+    :ivar attempts: number of times the message was rejected by the API.
+
+    """
+
+    def __init__(
+        self,
+        chat_id: int,
+        key: Optional[str],
+        content: Any,
+        options: Dict[str, Any],
+        method: str = "send_message",
+    ) -> None:
+        """Instantiate the class.
+
+        :param chat_id: identification of the destination chat.
+        :param key: coalescing key of the message.
+        :param content: text of the message, or file of the document.
+        :param options: other arguments of the bot method.
+        :param method: bot method sending the message.
+
+        """
+        self.chat_id: int = chat_id
+        self.key: Optional[str] = key
+        self.method: str = method
+        self.content: Any = content
+        self.options: Dict[str, Any] = options
+        self.future: Future = Future()
+        self.attempts: int = 0
+
+
+class Outbox:
+    """Send the messages from a thread, respecting the Bot API limits.
+
+    Every message takes a token from the global bucket and from the bucket of
+    its chat. Chats with pending messages are served in turns, so a busy
+    chat doesn't delay the others. When the API answers with a ``retry
+    after`` error every chat is paused for the requested time, as the flood
+    limits may be the bot ones, and the message is sent again, up to
+    ``max_retries`` times.
+
+    Sending a message with the same key as one still pending in the chat
+    replaces the pending message instead of queueing a new one. By default
+    the key is the text, so duplicate replies are only sent once. Documents
+    are never coalesced, and their files are closed once sent or failed.
+
+    The replies quote the message they answer in group chats, as the
+    ``reply_text`` method of the telegram messages does.
+
+    :ivar _bot: bot sending the messages, set when started.
+    :ivar _global: bucket shared by every chat.
+    :ivar _chat_rate: messages per second allowed in a chat.
+    :ivar _chat_burst: messages a chat can send at once.
+    :ivar _max_retries: times a message is sent again after being rejected.
+    :ivar _buckets: bucket of every chat with pending messages or recently
+        sent ones.
+    :ivar _pending: pending messages of every chat.
+    :ivar _ready: chats whose next message can be sent, in turn order.
+    :ivar _paused: chats waiting for their bucket or a retry delay, as a heap
+        of monotonic times and chat identifications.
+    :ivar _condition: condition protecting the queues and used to wake the
+        thread up.
+    :ivar _stopped: whether the outbox was asked to stop.
+    :ivar _thread: the sending thread, if started.
+
+    """
+
+    def __init__(
+        self,
+        rate: float = 30.0,
+        chat_rate: float = 1.0,
+        chat_burst: int = 3,
+        max_retries: int = 3,
+    ) -> None:
+        """Instantiate the class.
+
+        :param rate: messages per second allowed in every chat together.
+        :param chat_rate: messages per second allowed in a chat.
+        :param chat_burst: messages a chat can send at once.
+        :param max_retries: times a message is sent again after being
+            rejected.
+
+        """
+        self._bot: Any = None
+        self._global = TokenBucket(rate, max(1, int(rate)))
+        self._chat_rate: float = chat_rate
+        self._chat_burst: int = chat_burst
+        self._max_retries: int = max_retries
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._pending: Dict[int, Deque[Message]] = {}
+        self._ready: Deque[int] = deque()
+        self._paused: List[Tuple[float, int]] = []
+        self._condition = threading.Condition()
+        self._stopped: bool = False
+        self._thread: Optional[threading.Thread] = None
+
+    def set_rate(self, rate: float) -> None:
+        """Change the messages per second allowed in every chat together.
+
+        :param rate: the new rate.
+
+        """
+        with self._condition:
+            self._global = TokenBucket(rate, max(1, int(rate)))
+
+    def start(self, bot: Any) -> None:
+        """Start sending the messages.
+
+        :param bot: bot sending the messages.
+
+        """
+        self._bot = bot
+        self._stopped = False
+        self._thread = threading.Thread(
+            target=self._run, name="gol-outbox", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Send the pending messages and stop the thread."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def send(
+        self,
+        chat_id: int,
+        text: str,
+        key: Optional[str] = None,
+        **options: Any,
+    ) -> Future:
+        """Queue a message.
+
+        :param chat_id: identification of the destination chat.
+        :param text: text of the message.
+        :param key: coalescing key of the message. The text if not provided.
+        :param options: other ``send_message`` arguments.
+        :returns: a future completed when the message is sent.
+
+        """
+        return self._queue(
+            Message(chat_id, text if key is None else key, text, options)
+        )
+
+    def send_document(
+        self, chat_id: int, document: IO[bytes], filename: str, **options: Any
+    ) -> Future:
+        """Queue a document. The file is closed once sent or failed.
+
+        :param chat_id: identification of the destination chat.
+        :param document: the file content.
+        :param filename: name of the file.
+        :param options: other ``send_document`` arguments.
+        :returns: a future completed when the document is sent.
+
+        """
+        return self._queue(
+            Message(
+                chat_id,
+                None,
+                document,
+                dict(options, filename=filename),
+                "send_document",
+            )
+        )
+
+    def reply(
+        self,
+        update: "Update",
+        text: str,
+        key: Optional[str] = None,
+        **options: Any,
+    ) -> Future:
+        """Queue a message to the chat of an update.
+
+        :param update: the update being answered.
+        :param text: text of the message.
+        :param key: coalescing key of the message. The text if not provided.
+        :param options: other ``send_message`` arguments.
+        :returns: a future completed when the message is sent.
+
+        """
+        return self.send(
+            update.effective_chat.id, text, key, **quote(update, options)
+        )
+
+    def reply_document(
+        self,
+        update: "Update",
+        document: IO[bytes],
+        filename: str,
+        **options: Any,
+    ) -> Future:
+        """Queue a document to the chat of an update.
+
+        :param update: the update being answered.
+        :param document: the file content, closed once sent or failed.
+        :param filename: name of the file.
+        :param options: other ``send_document`` arguments.
+        :returns: a future completed when the document is sent.
+
+        """
+        return self.send_document(
+            update.effective_chat.id,
+            document,
+            filename,
+            **quote(update, options),
+        )
+
+    def __len__(self) -> int:
+        """Get the number of pending messages.
+
+        :returns: the pending messages.
+
+        """
+        with self._condition:
+            return sum(len(pending) for pending in self._pending.values())
+
+    def _queue(self, message: Message) -> Future:
+        """Add a message to the pending ones of its chat.
+
+        :param message: the message.
+        :returns: the future of the message, or of the pending one it was
+            coalesced with.
+
+        """
+        with self._condition:
+            pending = self._pending.get(message.chat_id)
+
+            if pending is None:
+                pending = self._pending[message.chat_id] = deque()
+                self._ready.append(message.chat_id)
+                self._condition.notify()
+            elif message.key is not None:
+                for queued in pending:
+                    if queued.key == message.key and not queued.attempts:
+                        queued.content = message.content
+                        queued.options = message.options
+                        OUTBOX_MESSAGES.inc("coalesced")
+                        return queued.future
+
+            pending.append(message)
+
+        return message.future
+
+    def _run(self) -> None:
+        """Send the messages until stopped with nothing pending."""
+        while True:
+            with self._condition:
+                if self._stopped and not self._pending:
+                    return
+
+                message = self._next()
+
+            if message is not None:
+                self._deliver(message)
+
+    def _next(self) -> Optional[Message]:
+        """Wait for the next message that can be sent.
+
+        .. note:: The outbox condition must be held.
+
+        :returns: the message, or None if the outbox has to be checked again.
+
+        """
+        now = time.monotonic()
+
+        while self._paused and self._paused[0][0] <= now:
+            self._ready.append(heapq.heappop(self._paused)[1])
+
+        if not self._ready:
+            if not self._paused:
+                self._prune(now)
+
+            self._condition.wait(
+                self._paused[0][0] - now if self._paused else None
+            )
+            return None
+
+        delay = self._global.delay(now)
+
+        if delay:
+            self._condition.wait(delay)
+            return None
+
+        chat_id = self._ready.popleft()
+        bucket = self._buckets.get(chat_id)
+
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(
+                self._chat_rate, self._chat_burst
+            )
+
+        delay = bucket.delay(now)
+
+        if delay:
+            heapq.heappush(self._paused, (now + delay, chat_id))
+            return None
+
+        self._global.take(now)
+        bucket.take(now)
+
+        return self._pending[chat_id].popleft()
+
+    def _deliver(self, message: Message) -> None:
+        """Send a message and schedule the next one of its chat.
+
+        :param message: the message.
+
+        """
+        retry_after = None
+
+        if message.method == "send_document":
+            # The file is read again on every attempt
+            message.content.seek(0)
+
+        try:
+            result = getattr(self._bot, message.method)(
+                message.chat_id, message.content, **message.options
+            )
+        except Exception as error:  # pylint: disable=W0703
+            retry_after = getattr(error, "retry_after", None)
+
+            if retry_after is None or message.attempts >= self._max_retries:
+                logger.error(
+                    "Couldn't send a message to %s: %s", message.chat_id, error
+                )
+                OUTBOX_MESSAGES.inc("failed")
+                message.future.set_exception(error)
+        else:
+            OUTBOX_MESSAGES.inc("sent")
+            message.future.set_result(result)
+
+        if message.future.done() and message.method == "send_document":
+            message.content.close()
+
+        with self._condition:
+            pending = self._pending[message.chat_id]
+
+            if retry_after is not None and not message.future.done():
+                OUTBOX_MESSAGES.inc("retried")
+                message.attempts += 1
+                pending.appendleft(message)
+                now = time.monotonic()
+                self._global.drain(now, float(retry_after))
+                heapq.heappush(
+                    self._paused, (now + float(retry_after), message.chat_id)
+                )
+            elif pending:
+                self._ready.append(message.chat_id)
+            else:
+                del self._pending[message.chat_id]
+
+    def _prune(self, now: float) -> None:
+        """Forget the buckets of the chats that are not limited any more.
+
+        .. note:: The outbox condition must be held.
+
+        :param now: current monotonic time.
+
+        """
+        for chat_id in [
+            chat_id
+            for chat_id, bucket in self._buckets.items()
+            if chat_id not in self._pending and bucket.is_full(now)
+        ]:
+            del self._buckets[chat_id]
+
+
+def quote(update: "Update", options: Dict[str, Any]) -> Dict[str, Any]:
+    """Make a reply quote the message it answers, in group chats.
+
+    :param update: the update being answered.
+    :param options: the arguments of the reply.
+    :returns: the arguments, with the quoted message if any.
+
+    """
+    message = update.effective_message
+
+    if (
+        message is None
+        or update.effective_chat.type == "private"
+        or "reply_to_message_id" in options
+    ):
+        return options
+
+    # The message may be deleted while the reply is queued
+    return dict(
+        options,
+        reply_to_message_id=message.message_id,
+        allow_sending_without_reply=True,
+    )
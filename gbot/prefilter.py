@@ -0,0 +1,188 @@
+# Copyright (c) 2021 Luis Liñán Villafranca. All rights reserved.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>
+"""Discard the updates no handler would act on before dispatching them.
+
+Only message updates are requested to Telegram. Among them, only the
+commands and the voice messages of chats whose rules give push-ups for them
+at the moment are dispatched. Most of the traffic of a large group is plain
+messages and voice messages on days without voice rules, which are dropped
+after a few dictionary lookups, without decoding them nor loading the chat
+counter.
+
+"""
+import threading
+
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from gbot.metrics import UPDATES_DROPPED
+from gol.clock import DEFAULT_CLOCK, RuleClock
+from gol.rules import DayClass
+
+if TYPE_CHECKING:
+    from telegram.ext import MessageFilter
+
+    from gol.counter import PushUpsCounter
+
+ALLOWED_UPDATES: List[str] = ["message"]
+
+
+class UpdateFilter:
+    """Remember which chats care about which updates.
+
+    The chats are learnt from their counters as the handlers use them, so a
+    chat not seen yet has every update dispatched until its counter is
+    loaded.
+
+    :ivar _clock: clock telling the day class of the chats.
+    :ivar _tracked: chats whose counter state is known.
+    :ivar _voice: timezone and day classes in which voice messages give
+        push-ups, of every configured chat with voice rules.
+    :ivar _lock: lock serializing the changes of the chats.
+
+    """
+
+    def __init__(self, clock: RuleClock = DEFAULT_CLOCK) -> None:
+        """Instantiate the class.
+
+        :param clock: clock telling the day class of the chats.
+
+        """
+        self._clock: RuleClock = clock
+        self._tracked: Set[int] = set()
+        self._voice: Dict[
+            int, Tuple[Optional[str], FrozenSet[DayClass]]
+        ] = {}
+        self._lock = threading.Lock()
+
+    def track(self, counter: "PushUpsCounter") -> None:
+        """Learn the state of a chat from its counter.
+
+        :param counter: the chat counter, after handling an update.
+
+        """
+        chat_id = counter.chat_id
+        voice_days = counter.voice_days()
+
+        with self._lock:
+            self._tracked.add(chat_id)
+
+            if voice_days:
+                self._voice[chat_id] = (counter.timezone, voice_days)
+            else:
+                self._voice.pop(chat_id, None)
+
+    def forget(self, chat_ids: Iterable[int]) -> None:
+        """Forget the state of some chats, changed without their handlers.
+
+        The updates of the chats are dispatched again until their counters
+        are used.
+
+        :param chat_ids: identification of the chats.
+
+        """
+        with self._lock:
+            for chat_id in chat_ids:
+                self._tracked.discard(chat_id)
+                self._voice.pop(chat_id, None)
+
+    def wants_voice(
+        self, chat_id: int, timestamp: Optional[float] = None
+    ) -> bool:
+        """Check if a voice message may give push-ups in a chat.
+
+        :param chat_id: identification of the chat.
+        :param timestamp: the UNIX timestamp of the message. The current one
+            if not provided.
+        :returns: False if the voice message can be discarded.
+
+        """
+        if chat_id not in self._tracked:
+            return True
+
+        rule = self._voice.get(chat_id)
+
+        if rule is None:
+            return False
+
+        timezone, voice_days = rule
+
+        return (
+            len(voice_days) == len(DayClass)
+            or self._clock.day_class(timezone, timestamp) in voice_days
+        )
+
+    def accepts(self, data: Dict[str, Any]) -> bool:
+        """Check if a raw update has to be dispatched.
+
+        :param data: the update as posted by Telegram.
+        :returns: False if no handler would act on the update.
+
+        """
+        message = data.get("message")
+
+        if not isinstance(message, dict):
+            reason = "type"
+        elif "voice" in message:
+            if self.wants_voice(message["chat"]["id"]):
+                return True
+
+            reason = "voice"
+        elif _is_command(message):
+            return True
+        else:
+            reason = "message"
+
+        UPDATES_DROPPED.inc(reason)
+
+        return False
+
+    def voice_filter(self) -> "MessageFilter":
+        """Build the dispatcher filter of the voice messages worth handling.
+
+        :returns: the filter, to combine with ``Filters.voice``.
+
+        """
+        from telegram.ext import MessageFilter
+
+        update_filter = self
+
+        class WantedVoice(MessageFilter):
+            """Pass the voice messages that may give push-ups."""
+
+            def filter(self, message: Any) -> bool:
+                if update_filter.wants_voice(message.chat_id):
+                    return True
+
+                UPDATES_DROPPED.inc("voice")
+
+                return False
+
+        return WantedVoice()
+
+
+def _is_command(message: Dict[str, Any]) -> bool:
+    """Check if a raw message starts with a bot command.
+
+    :param message: the message as posted by Telegram.
+    :returns: True if the message is a command.
+
+    """
+    entities = message.get("entities")
+
+    return bool(
+        entities
+        and entities[0].get("type") == "bot_command"
+        and entities[0].get("offset") == 0
+    )
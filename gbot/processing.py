@@ -2,5 +2,401 @@
 #
 # This work is licensed under the terms of the MIT license.
 # For a copy, see <https://opensource.org/licenses/MIT>
+#
+# pylint: disable=C0116
+# type: ignore[union-attr]
+"""Processing of the commands and messages, whatever the bot runtime.
+
+Every command is a blocking function receiving the update, and the chat
+counter if it needs one, and returning the replies to send. The threaded
+handlers of :mod:`gbot.commands` and the asynchronous ones of
+:mod:`gbot.async_commands` run them in the chat actors and only differ in
+how the replies are sent.
+
+"""
+import io
+import tempfile
+
+from pathlib import Path
+from typing import (
+    IO,
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+)
+
+from gbot.settings import (
+    ADMINS,
+    COUNTERS,
+    HELP_TEXT,
+    PROFILER,
+    UPDATE_FILTER,
+)
+from gol.counter import PushUpsCounter
+from gol.error import CounterError, RulesetNotFound, UnknownTimezoneError
+from gol.history import (
+    FORMATS,
+    Row,
+    detect_format,
+    import_history,
+    read_history,
+    spool_history,
+)
+from gol.rules import RULESETS
+
+if TYPE_CHECKING:
+    from telegram import Update
+
+MARKDOWN = "Markdown"
+
+
+class Reply:
+    """A message answering an update.
+
+    :ivar text: text of the message, empty for a document.
+    :ivar key: coalescing key of the message in the outbox. The text if not
+        provided.
+    :ivar parse_mode: parse mode of the text, if any.
+    :ivar document: file sent as a document, if any.
+    :ivar filename: name of the document file.
+
+    """
+
+    __slots__ = ("text", "key", "parse_mode", "document", "filename")
+
+    def __init__(
+        self,
+        text: str = "",
+        key: Optional[str] = None,
+        parse_mode: Optional[str] = None,
+        document: Optional[IO[bytes]] = None,
+        filename: str = "",
+    ) -> None:
+        """Instantiate the class.
+
+        :param text: text of the message.
+        :param key: coalescing key of the message in the outbox.
+        :param parse_mode: parse mode of the text.
+        :param document: file sent as a document.
+        :param filename: name of the document file.
+
+        """
+        self.text: str = text
+        self.key: Optional[str] = key
+        self.parse_mode: Optional[str] = parse_mode
+        self.document: Optional[IO[bytes]] = document
+        self.filename: str = filename
+
+
+Replies = List[Reply]
+
+
+class Command:
+    """A command of the bot, or the processing of a kind of message.
+
+    :ivar func: function processing the update and returning the replies.
+        It also receives the chat counter when ``counter`` is set.
+    :ivar counter: whether the function needs the configured chat counter.
+    :ivar warn: whether to warn the user when the counter is not configured.
+
+    """
+
+    __slots__ = ("func", "counter", "warn")
+
+    def __init__(
+        self,
+        func: Callable[..., Replies],
+        counter: bool = False,
+        warn: bool = True,
+    ) -> None:
+        """Instantiate the class.
+
+        :param func: function processing the update.
+        :param counter: whether the function needs the chat counter.
+        :param warn: whether to warn the user when the counter is not
+            configured.
+
+        """
+        self.func: Callable[..., Replies] = func
+        self.counter: bool = counter
+        self.warn: bool = warn
+
+
+def command_help(update: "Update") -> Replies:
+    """Send a message when the command /help is issued.
+
+    :param update: the update information.
+    :returns: the replies.
+
+    """
+    return [Reply(HELP_TEXT)]
+
+
+def command_config(update: "Update") -> Replies:
+    """Configure the Push-Ups counter.
+
+    :param update: the update information.
+    :returns: the replies.
+
+    """
+    lines = update.message.text.splitlines()[1:]
+
+    if len(lines) != 4:
+        return command_help(update)
+
+    counter = COUNTERS[update.effective_chat.id]
+    counter.config(*lines)
+    UPDATE_FILTER.track(counter)
+
+    return []
+
+
+def command_push_ups(update: "Update", counter: PushUpsCounter) -> Replies:
+    """Add a new push-ups.
+
+    :param update: the update information.
+    :param counter: the chat counter.
+    :returns: the replies.
+
+    """
+    sender = str(update.message.from_user.id)
+    receiber = (
+        str(update.message.reply_to_message.from_user.id)
+        if update.message.reply_to_message
+        else counter.opposite(sender)
+    )
+    counter.add_pushups(receiber, sender, update_id=update.update_id)
+
+    return []
+
+
+def command_error(update: "Update", counter: PushUpsCounter) -> Replies:
+    """Process an error push-up.
+
+    :param update: the update information.
+    :param counter: the chat counter.
+    :returns: the replies.
+
+    """
+    counter.process_error(
+        str(update.message.from_user.id), update_id=update.update_id
+    )
+
+    return []
+
+
+def command_table(update: "Update", counter: PushUpsCounter) -> Replies:
+    """Send a table with the current push-up information.
+
+    :param update: the update information.
+    :param counter: the chat counter.
+    :returns: the replies.
+
+    """
+    table = counter.push_up_table()
+
+    return [Reply(f"```{table}```", key="table", parse_mode=MARKDOWN)]
+
+
+def command_stats(update: "Update", counter: PushUpsCounter) -> Replies:
+    """Send a table with the participants statistics.
+
+    :param update: the update information.
+    :param counter: the chat counter.
+    :returns: the replies.
+
+    """
+    table = counter.stats_table()
+
+    return [Reply(f"```{table}```", key="stats", parse_mode=MARKDOWN)]
+
+
+def process_audio(update: "Update", counter: PushUpsCounter) -> Replies:
+    """Process an audio message.
+
+    :param update: the update information.
+    :param counter: the chat counter.
+    :returns: the replies.
+
+    """
+    counter.process_audio(
+        str(update.message.from_user.id), update_id=update.update_id
+    )
+
+    return []
+
+
+def command_rules(update: "Update", counter: PushUpsCounter) -> Replies:
+    """Show or change the ruleset of the chat.
+
+    :param update: the update information.
+    :param counter: the chat counter.
+    :returns: the replies.
+
+    """
+    args = command_args(update)
+
+    if args:
+        try:
+            counter.set_ruleset(args[0])
+        except RulesetNotFound:
+            return [Reply(f"Unknown ruleset {args[0]}")]
+
+    return [
+        Reply(
+            f"Ruleset: {counter.ruleset.name}\n"
+            f"Available: {', '.join(sorted(RULESETS))}"
+        )
+    ]
+
+
+def command_timezone(update: "Update", counter: PushUpsCounter) -> Replies:
+    """Show or change the timezone of the chat.
+
+    :param update: the update information.
+    :param counter: the chat counter.
+    :returns: the replies.
+
+    """
+    args = command_args(update)
+
+    if args:
+        try:
+            counter.set_timezone(args[0])
+        except UnknownTimezoneError:
+            return [Reply(f"Unknown timezone {args[0]}")]
+
+    return [Reply(f"Timezone: {counter.timezone or 'server local time'}")]
+
+
+def command_profile(update: "Update") -> Replies:
+    """Show, enable or disable the profiling. Only for the bot admins.
+
+    :param update: the update information.
+    :returns: the replies.
+
+    """
+    if not is_admin(update):
+        return []
+
+    args = command_args(update)
+
+    if args and args[0] == "on":
+        PROFILER.enable()
+    elif args and args[0] == "off":
+        PROFILER.disable()
+
+    return [
+        Reply(f"Profiling: {'enabled' if PROFILER.enabled else 'disabled'}")
+    ]
+
+
+def command_export(update: "Update", counter: PushUpsCounter) -> Replies:
+    """Send the history of the chat as a file.
+
+    :param update: the update information.
+    :param counter: the chat counter.
+    :returns: the replies.
+
+    """
+    args = command_args(update)
+    history_format = args[0].lower() if args else "ndjson"
+
+    if history_format not in FORMATS:
+        return [
+            Reply(
+                f"Unknown format {history_format}. "
+                f"Use {' or '.join(FORMATS)}"
+            )
+        ]
+
+    return [
+        Reply(
+            document=spool_history(
+                counter.chat_id, counter.history(), history_format
+            ),
+            filename=f"history-{counter.chat_id}.{history_format}",
+        )
+    ]
+
+
+def command_import(update: "Update", counter: PushUpsCounter) -> Replies:
+    """Apply the exported history the message replies to. Only for the bot
+    admins.
+
+    :param update: the update information.
+    :param counter: the chat counter.
+    :returns: the replies.
+
+    """
+    if not is_admin(update):
+        return []
+
+    replied = update.message.reply_to_message
+    document = replied.document if replied else None
+
+    if document is None:
+        return [Reply("Reply to an exported history file with /import")]
+
+    with tempfile.TemporaryFile() as history_file:
+        document.get_file().download(out=history_file)
+        history_format = detect_format(Path(document.file_name or ""))
+
+        def read_rows() -> Iterator[Row]:
+            history_file.seek(0)
+            lines = io.TextIOWrapper(
+                history_file, encoding="utf-8", newline=""
+            )
+
+            try:
+                yield from read_history(lines, history_format)
+            finally:
+                # Keep the file open for the next read
+                lines.detach()
+
+        try:
+            imported = import_history(counter, read_rows)
+        except (CounterError, ValueError) as error:
+            return [Reply(f"Couldn't import the history: {error}")]
+
+    return [Reply(f"Imported {imported} events")]
+
+
+def command_args(update: "Update") -> List[str]:
+    """Get the arguments of a command, the words after it.
+
+    :param update: the update information.
+    :returns: the arguments.
+
+    """
+    return (update.message.text or "").split()[1:]
+
+
+def is_admin(update: "Update") -> bool:
+    """Check if the sender of an update is one of the bot admins.
+
+    :param update: the update information.
+    :returns: True for the bot admins.
+
+    """
+    return str(update.message.from_user.id) in ADMINS
 
 
+COMMANDS: Dict[str, Command] = {
+    "help": Command(command_help),
+    "config": Command(command_config),
+    "flex": Command(command_push_ups, counter=True),
+    "flexiones": Command(command_push_ups, counter=True),
+    "error": Command(command_error, counter=True),
+    "table": Command(command_table, counter=True),
+    "stats": Command(command_stats, counter=True),
+    "rules": Command(command_rules, counter=True),
+    "timezone": Command(command_timezone, counter=True),
+    "profile": Command(command_profile),
+    "export": Command(command_export, counter=True),
+    "import": Command(command_import, counter=True),
+}
+VOICE = Command(process_audio, counter=True, warn=False)
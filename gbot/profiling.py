@@ -0,0 +1,312 @@
+# Copyright (c) 2021 Luis Liñán Villafranca. All rights reserved.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>
+"""On-demand profiling of the handlers and the persistence.
+
+The profiling modules are only imported when the profiler is enabled or a
+call is sampled.
+
+"""
+import io
+import logging
+import threading
+import time
+
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+
+from gol.persistence import PersistenceWorker
+
+if TYPE_CHECKING:
+    import cProfile
+    import pstats
+
+    from gol.checkpoint import UpdateCheckpoint
+
+logger = logging.getLogger(__name__)
+
+PROFILED_FILES = (
+    "gbot/async_commands.py",
+    "gbot/commands.py",
+    "gbot/processing.py",
+    "gol/counter.py",
+)
+TRACEMALLOC_FRAMES = 16
+
+
+class Profiler:
+    """Sample the CPU time and memory allocations of the profiled calls.
+
+    One out of every ``sample_every`` calls is run under :mod:`cProfile`,
+    and only one call is profiled at a time. While enabled, the allocations
+    are traced with :mod:`tracemalloc`, and the tracing is stopped when
+    disabled only if the profiler started it. Every ``interval`` seconds the
+    collected data is written to the reports directory and discarded:
+
+    * ``<time>-<name>.prof``: the CPU profile of the calls with that name,
+      which can be loaded with :mod:`pstats` or tools like snakeviz.
+    * ``<time>-<name>.txt``: the most expensive functions of
+      :data:`PROFILED_FILES` in that profile.
+    * ``<time>.tracemalloc``: the allocations made from
+      :data:`PROFILED_FILES`, which can be loaded with
+      :meth:`tracemalloc.Snapshot.load`.
+
+    :ivar _directory: directory where the reports are written.
+    :ivar _sample_every: number of calls between two profiled ones.
+    :ivar _interval: seconds between two reports.
+    :ivar _calls: number of calls since the profiler was enabled.
+    :ivar _stats: collected CPU profiles by call name.
+    :ivar _lock: lock protecting the calls and the collected profiles.
+    :ivar _profiling: lock held while a call is profiled.
+    :ivar _stopped: event set when the profiler is disabled.
+    :ivar _thread: thread writing the periodic reports, if enabled.
+    :ivar _tracing: whether the allocations tracing was started by the
+        profiler, which stops it when disabled.
+
+    """
+
+    def __init__(
+        self, directory: Path, sample_every: int = 1, interval: float = 60.0
+    ) -> None:
+        """Instantiate the class.
+
+        :param directory: directory where the reports are written.
+        :param sample_every: number of calls between two profiled ones.
+        :param interval: seconds between two reports.
+
+        """
+        if sample_every <= 0:
+            raise ValueError("The sampling period must be positive")
+
+        self._directory: Path = directory
+        self._sample_every: int = sample_every
+        self._interval: float = interval
+        self._calls: int = 0
+        self._stats: Dict[str, "pstats.Stats"] = {}
+        self._lock = threading.Lock()
+        self._profiling = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._tracing: bool = False
+
+    @property
+    def enabled(self) -> bool:
+        """Check if the profiler is collecting data.
+
+        :returns: True when the profiler is enabled.
+
+        """
+        return self._thread is not None
+
+    def enable(self) -> None:
+        """Start collecting data and writing the periodic reports."""
+        with self._lock:
+            if self._thread is not None:
+                return
+
+            import tracemalloc
+
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+                self._tracing = True
+
+            self._calls = 0
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="gol-profiler", daemon=True
+            )
+            self._thread.start()
+
+        logger.info("Profiling enabled, reports in %s", self._directory)
+
+    def disable(self) -> None:
+        """Stop collecting data and write the last report."""
+        with self._lock:
+            thread = self._thread
+
+            if thread is None:
+                return
+
+            self._thread = None
+            self._stopped.set()
+            tracing = self._tracing
+            self._tracing = False
+
+        thread.join()
+        self.report()
+
+        if tracing:
+            import tracemalloc
+
+            tracemalloc.stop()
+
+        logger.info("Profiling disabled")
+
+    def call(self, name: str, func: Callable, *args, **kwargs) -> Any:
+        """Run a function, profiling it if it is sampled.
+
+        :param name: name of the call in the reports.
+        :param func: the function.
+        :returns: the function result.
+
+        """
+        if not self._sampled() or not self._profiling.acquire(False):
+            return func(*args, **kwargs)
+
+        import cProfile
+
+        profile = cProfile.Profile()
+
+        try:
+            profile.enable()
+
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.disable()
+        finally:
+            self._profiling.release()
+            self._collect(name, profile)
+
+    async def call_async(
+        self, name: str, func: Callable, *args, **kwargs
+    ) -> Any:
+        """Await a coroutine function, profiling it if it is sampled.
+
+        Other tasks running while the coroutine is suspended are profiled
+        too.
+
+        :param name: name of the call in the reports.
+        :param func: the coroutine function.
+        :returns: the function result.
+
+        """
+        if not self._sampled() or not self._profiling.acquire(False):
+            return await func(*args, **kwargs)
+
+        import cProfile
+
+        profile = cProfile.Profile()
+
+        try:
+            profile.enable()
+
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                profile.disable()
+        finally:
+            self._profiling.release()
+            self._collect(name, profile)
+
+    def report(self) -> List[Path]:
+        """Write the collected data and discard it.
+
+        :returns: the written files.
+
+        """
+        with self._lock:
+            collected = self._stats
+            self._stats = {}
+
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        self._directory.mkdir(parents=True, exist_ok=True)
+        written = []
+
+        for name, stats in collected.items():
+            profile_file = self._directory / f"{stamp}-{name}.prof"
+            stats.dump_stats(str(profile_file))
+            summary = io.StringIO()
+            stats.stream = summary
+            stats.sort_stats("cumulative").print_stats(
+                "|".join(PROFILED_FILES)
+            )
+            summary_file = profile_file.with_suffix(".txt")
+            summary_file.write_text(summary.getvalue())
+            written.extend((profile_file, summary_file))
+
+        import tracemalloc
+
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                [
+                    tracemalloc.Filter(True, f"*/{profiled}", all_frames=True)
+                    for profiled in PROFILED_FILES
+                ]
+            )
+            snapshot_file = self._directory / f"{stamp}.tracemalloc"
+            snapshot.dump(str(snapshot_file))
+            written.append(snapshot_file)
+
+        return written
+
+    def _sampled(self) -> bool:
+        """Count a call and check if it has to be profiled.
+
+        :returns: True when the call has to be profiled.
+
+        """
+        if self._thread is None:
+            return False
+
+        with self._lock:
+            self._calls += 1
+
+            return self._calls % self._sample_every == 0
+
+    def _collect(self, name: str, profile: "cProfile.Profile") -> None:
+        """Add a finished profile to the collected ones.
+
+        :param name: name of the call.
+        :param profile: the profile.
+
+        """
+        with self._lock:
+            if name in self._stats:
+                self._stats[name].add(profile)
+            else:
+                import pstats
+
+                self._stats[name] = pstats.Stats(profile)
+
+    def _run(self) -> None:
+        """Write a report every interval until the profiler is disabled."""
+        while not self._stopped.wait(self._interval):
+            try:
+                self.report()
+            except OSError as error:
+                logger.error("Couldn't write the profiling report: %s", error)
+
+
+class ProfiledPersistenceWorker(PersistenceWorker):
+    """Persistence worker whose flushes can be profiled.
+
+    :ivar _profiler: profiler sampling the flushes.
+
+    """
+
+    def __init__(
+        self,
+        profiler: Profiler,
+        interval: float = 5.0,
+        threshold: int = 64,
+        checkpoint: Optional["UpdateCheckpoint"] = None,
+    ) -> None:
+        """Instantiate the class.
+
+        :param profiler: profiler sampling the flushes.
+        :param interval: maximum seconds between two flushes.
+        :param threshold: number of dirty counters that triggers a flush.
+        :param checkpoint: checkpoint of the processed updates.
+
+        """
+        super().__init__(interval, threshold, checkpoint)
+        self._profiler: Profiler = profiler
+
+    def flush(self) -> None:
+        """Save every dirty counter now, profiling the non empty flushes."""
+        if self._dirty:
+            self._profiler.call("persistence", super().flush)
+        else:
+            super().flush()
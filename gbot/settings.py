@@ -2,15 +2,284 @@
 #
 # This work is licensed under the terms of the MIT license.
 # For a copy, see <https://opensource.org/licenses/MIT>
-"""Common globals and settings for the :mod:`gbot` module."""
+"""Common globals and settings for the :mod:`gbot` module.
+
+The settings are read from the environment when imported. The runtime
+objects, like the counters registry or the outbox, are built the first time
+they are used, so the maintenance commands only build the ones they need.
+The data paths are the ones of :mod:`gol.settings`.
+
+"""
+import os
+import threading
+
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+
+from decouple import Csv, config
+
+from gol.settings import CHATS_DIR, SAVE_DIR, SQLITE_FILE
 
-from decouple import config
+if TYPE_CHECKING:
+    from gbot.jobs import Scheduler
+    from gbot.outbox import Outbox
+    from gbot.prefilter import UpdateFilter
+    from gbot.profiling import ProfiledPersistenceWorker, Profiler
+    from gol.actors import ChatExecutor
+    from gol.checkpoint import UpdateCheckpoint
+    from gol.registry import CounterRegistry
+    from gol.store import CounterStore
 
-from gol.counter import PushUpsCounter
+    HELP_TEXT: str
+    PROFILER: Profiler
+    CHAT_ACTORS: ChatExecutor
+    STORE: CounterStore
+    CHECKPOINT: UpdateCheckpoint
+    PERSISTENCE: ProfiledPersistenceWorker
+    COUNTERS: CounterRegistry
+    UPDATE_FILTER: UpdateFilter
+    OUTBOX: Outbox
+    SCHEDULER: Scheduler
 
 CURRENT_DIR = Path(__file__).resolve().parent
 HELP_FILE: Path = CURRENT_DIR / "data" / "help.txt"
 BOT_TOKEN: Optional[str] = config("GOL_BOT_TOKEN", cast=str, default=None)
-COUNTER: PushUpsCounter = PushUpsCounter()
+RUN_MODE: str = config("GOL_BOT_MODE", cast=str, default="polling")
+WEBHOOK_HOST: str = config(
+    "GOL_BOT_WEBHOOK_HOST", cast=str, default="127.0.0.1"
+)
+WEBHOOK_PORT: int = config("GOL_BOT_WEBHOOK_PORT", cast=int, default=8443)
+WEBHOOK_PATH: str = config("GOL_BOT_WEBHOOK_PATH", cast=str, default="/")
+WEBHOOK_URL: str = config("GOL_BOT_WEBHOOK_URL", cast=str, default="")
+WEBHOOK_SECRET: str = config("GOL_BOT_WEBHOOK_SECRET", cast=str, default="")
+SHARDS: int = config("GOL_BOT_SHARDS", cast=int, default=os.cpu_count() or 1)
+MAX_COUNTERS: int = config("GOL_BOT_MAX_COUNTERS", cast=int, default=1024)
+MAX_IDLE: float = config("GOL_BOT_MAX_IDLE", cast=float, default=0)
+FLUSH_INTERVAL: float = config(
+    "GOL_BOT_FLUSH_INTERVAL", cast=float, default=5.0
+)
+FLUSH_THRESHOLD: int = config("GOL_BOT_FLUSH_THRESHOLD", cast=int, default=64)
+PROFILE: bool = config("GOL_BOT_PROFILE", cast=bool, default=False)
+PROFILE_DIR: Path = config(
+    "GOL_BOT_PROFILE_DIR", cast=Path, default=str(SAVE_DIR / "profiles")
+)
+PROFILE_SAMPLE: int = config("GOL_BOT_PROFILE_SAMPLE", cast=int, default=1)
+PROFILE_INTERVAL: float = config(
+    "GOL_BOT_PROFILE_INTERVAL", cast=float, default=60.0
+)
+ADMINS: List[str] = config("GOL_BOT_ADMINS", cast=Csv(), default="")
+CHAT_WORKERS: int = config("GOL_BOT_CHAT_WORKERS", cast=int, default=8)
+RULES_FILE: str = config("GOL_BOT_RULES_FILE", cast=str, default="")
+STORE_BACKEND: str = config("GOL_BOT_STORE", cast=str, default="json")
+SEND_RATE: float = config("GOL_BOT_SEND_RATE", cast=float, default=30.0)
+CHAT_SEND_RATE: float = config(
+    "GOL_BOT_CHAT_SEND_RATE", cast=float, default=1.0
+)
+CHAT_SEND_BURST: int = config("GOL_BOT_CHAT_SEND_BURST", cast=int, default=3)
+SEND_RETRIES: int = config("GOL_BOT_SEND_RETRIES", cast=int, default=3)
+REMINDER_HOUR: int = config("GOL_BOT_REMINDER_HOUR", cast=int, default=20)
+JOB_INTERVAL: float = config("GOL_BOT_JOB_INTERVAL", cast=float, default=900)
+JOB_BATCH: int = config("GOL_BOT_JOB_BATCH", cast=int, default=200)
+JOB_JITTER: float = config("GOL_BOT_JOB_JITTER", cast=float, default=2.0)
+JOB_MAX_PENDING: int = config("GOL_BOT_JOB_MAX_PENDING", cast=int, default=100)
+METRICS_HOST: str = config(
+    "GOL_BOT_METRICS_HOST", cast=str, default="127.0.0.1"
+)
+METRICS_PORT: int = config("GOL_BOT_METRICS_PORT", cast=int, default=0)
+
+_BUILD_LOCK = threading.RLock()
+
+
+def _build_help_text() -> str:
+    """Read the help message.
+
+    :returns: the help message.
+
+    """
+    return HELP_FILE.read_text(encoding="utf-8")
+
+
+def _build_profiler() -> "Profiler":
+    """Build the profiler of the handlers and the persistence.
+
+    :returns: the profiler, disabled.
+
+    """
+    from gbot.profiling import Profiler
+
+    return Profiler(PROFILE_DIR, PROFILE_SAMPLE, PROFILE_INTERVAL)
+
+
+def _build_chat_actors() -> "ChatExecutor":
+    """Build the executor running the tasks of every chat in order.
+
+    :returns: the executor.
+
+    """
+    from gol.actors import ChatExecutor
+
+    return ChatExecutor(CHAT_WORKERS)
+
+
+def _build_store() -> "CounterStore":
+    """Build the configured counters store.
+
+    :returns: the store.
+
+    """
+    from gbot.metrics import observe_write
+    from gol.store import (
+        BinaryCounterStore,
+        JsonCounterStore,
+        SqliteCounterStore,
+    )
+
+    if STORE_BACKEND == "sqlite":
+        return SqliteCounterStore(SQLITE_FILE, on_write=observe_write)
+
+    if STORE_BACKEND == "binary":
+        return BinaryCounterStore(CHATS_DIR, on_write=observe_write)
+
+    return JsonCounterStore(CHATS_DIR, on_write=observe_write)
+
+
+def _build_checkpoint() -> "UpdateCheckpoint":
+    """Build the checkpoint of the processed updates.
+
+    :returns: the checkpoint.
+
+    """
+    from gol.checkpoint import UpdateCheckpoint
+
+    return UpdateCheckpoint(__getattr__("STORE"))
+
+
+def _build_persistence() -> "ProfiledPersistenceWorker":
+    """Build the worker saving the changed counters.
+
+    :returns: the worker, not started.
+
+    """
+    from gbot.profiling import ProfiledPersistenceWorker
+
+    return ProfiledPersistenceWorker(
+        __getattr__("PROFILER"),
+        FLUSH_INTERVAL,
+        FLUSH_THRESHOLD,
+        __getattr__("CHECKPOINT"),
+    )
+
+
+def _build_counters() -> "CounterRegistry":
+    """Build the registry of the chat counters, with the configured rules.
+
+    :returns: the registry.
+
+    """
+    from gbot.metrics import METRICS, Gauge
+    from gol.registry import CounterRegistry
+    from gol.rules import load_rulesets
+
+    if RULES_FILE:
+        load_rulesets(Path(RULES_FILE))
+
+    counters = CounterRegistry(
+        __getattr__("STORE"),
+        capacity=MAX_COUNTERS,
+        max_idle=MAX_IDLE or None,
+        persistence=__getattr__("PERSISTENCE"),
+    )
+    METRICS.register(
+        Gauge(
+            "gol_active_counters",
+            "Counters loaded in memory.",
+            lambda: len(counters),
+        )
+    )
+
+    return counters
+
+
+def _build_update_filter() -> "UpdateFilter":
+    """Build the filter of the updates without handler.
+
+    :returns: the filter.
+
+    """
+    from gbot.prefilter import UpdateFilter
+
+    return UpdateFilter()
+
+
+def _build_outbox() -> "Outbox":
+    """Build the queue of the outgoing messages.
+
+    :returns: the outbox, not started.
+
+    """
+    from gbot.metrics import METRICS, Gauge
+    from gbot.outbox import Outbox
+
+    outbox = Outbox(SEND_RATE, CHAT_SEND_RATE, CHAT_SEND_BURST, SEND_RETRIES)
+    METRICS.register(
+        Gauge(
+            "gol_outbox_pending",
+            "Outgoing messages waiting to be sent.",
+            lambda: len(outbox),
+        )
+    )
+
+    return outbox
+
+
+def _build_scheduler() -> "Scheduler":
+    """Build the scheduler of the periodic jobs.
+
+    :returns: the scheduler, not started.
+
+    """
+    from gbot.jobs import Scheduler
+
+    return Scheduler(
+        __getattr__("COUNTERS"),
+        __getattr__("OUTBOX"),
+        __getattr__("UPDATE_FILTER"),
+        reminder_hour=REMINDER_HOUR if REMINDER_HOUR >= 0 else None,
+        batch_size=JOB_BATCH,
+        jitter=JOB_JITTER,
+        max_pending=JOB_MAX_PENDING,
+        interval=JOB_INTERVAL,
+    )
+
+
+_BUILDERS: Dict[str, Callable[[], Any]] = {
+    "HELP_TEXT": _build_help_text,
+    "PROFILER": _build_profiler,
+    "CHAT_ACTORS": _build_chat_actors,
+    "STORE": _build_store,
+    "CHECKPOINT": _build_checkpoint,
+    "PERSISTENCE": _build_persistence,
+    "COUNTERS": _build_counters,
+    "UPDATE_FILTER": _build_update_filter,
+    "OUTBOX": _build_outbox,
+    "SCHEDULER": _build_scheduler,
+}
+
+
+def __getattr__(name: str) -> Any:
+    """Build a runtime object the first time it is used.
+
+    :param name: name of the object.
+    :returns: the object, the same one on every call.
+
+    """
+    try:
+        builder = _BUILDERS[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    with _BUILD_LOCK:
+        if name not in globals():
+            globals()[name] = builder()
+
+    return globals()[name]
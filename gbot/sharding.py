@@ -0,0 +1,442 @@
+# Copyright (c) 2021 Luis Liñán Villafranca. All rights reserved.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>
+"""Sharded runtime, with the chats split among worker processes.
+
+The router receives the webhook updates and sends every one of them to the
+worker owning its chat. Each worker runs the handlers in its own process,
+with its own counters, persistence and outbox, so the chats of different
+shards are handled in parallel and a chat is only loaded, changed and saved
+by one process.
+
+The chats are assigned with :func:`jump_hash`. When the number of workers
+changes, only the chats of the removed shards, or the ones taken by the new
+shards, move. The updates are held in the router while the workers that lose
+chats save and unload them, so the new owner loads them up to date.
+
+The workers import the bot settings themselves, so the module can be
+imported without the telegram library.
+
+"""
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from gbot.error import BotError
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_UPDATES = (
+    "message",
+    "edited_message",
+    "channel_post",
+    "edited_channel_post",
+)
+READY = "ready"
+RELEASED = "released"
+STOPPED = "stopped"
+STATUS_TIMEOUT = 1.0
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Assign a key to a bucket with the jump consistent hash.
+
+    Going from ``n`` to ``n + 1`` buckets only moves ``1 / (n + 1)`` of the
+    keys, all of them to the new bucket.
+
+    :param key: the key, like a chat identification.
+    :param buckets: number of buckets.
+    :returns: the bucket, from 0 to ``buckets - 1``.
+
+    """
+    if buckets <= 0:
+        raise ValueError("The number of buckets must be positive")
+
+    key &= 0xFFFFFFFFFFFFFFFF
+    bucket, jump = -1, 0
+
+    while jump < buckets:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+
+    return bucket
+
+
+def update_chat_id(data: Dict[str, Any]) -> Optional[int]:
+    """Get the chat of a raw update without decoding it.
+
+    :param data: the update as posted by Telegram.
+    :returns: the chat identification, or None if the update has no chat.
+
+    """
+    for kind in MESSAGE_UPDATES:
+        message = data.get(kind)
+
+        if isinstance(message, dict):
+            return message.get("chat", {}).get("id")
+
+    return None
+
+
+class ShardRouter:
+    """Route the raw updates to one worker process per shard of chats.
+
+    The updates and the control messages of a worker go through the same
+    queue, so a worker handles every update routed to it before resizing or
+    stopping.
+
+    :ivar _bot_factory: callable building the bot of every worker. A bot
+        with the configured token if not provided.
+    :ivar _context: multiprocessing context spawning the workers.
+    :ivar _workers: process and update queue of every shard.
+    :ivar _status: queue where the workers report their state changes.
+
+    """
+
+    def __init__(
+        self, bot_factory: Optional[Callable[[], Any]] = None
+    ) -> None:
+        """Instantiate the class.
+
+        :param bot_factory: callable building the bot of every worker, which
+            must be importable from the workers.
+
+        """
+        self._bot_factory: Optional[Callable[[], Any]] = bot_factory
+        self._context = multiprocessing.get_context("spawn")
+        self._workers: List[Tuple[Any, Any]] = []
+        self._status: Any = self._context.Queue()
+
+    @property
+    def shards(self) -> int:
+        """Get the number of workers.
+
+        :returns: the running workers.
+
+        """
+        return len(self._workers)
+
+    def start(self, shards: int) -> None:
+        """Start the workers and wait until they are ready.
+
+        :param shards: number of workers.
+
+        """
+        if self._workers:
+            raise BotError("The shard workers are already running")
+
+        self._spawn(range(shards), shards)
+
+    def route(self, data: Dict[str, Any]) -> Optional[int]:
+        """Send an update to the worker of its chat.
+
+        :param data: the update as posted by Telegram.
+        :returns: the shard of the update, or None if it was dropped for not
+            having a chat.
+
+        """
+        chat_id = update_chat_id(data)
+
+        if chat_id is None:
+            logger.debug("Dropped the update without chat %s", data)
+            return None
+
+        shard = jump_hash(chat_id, len(self._workers))
+        self._workers[shard][1].put(data)
+
+        return shard
+
+    def resize(self, shards: int) -> None:
+        """Change the number of workers, moving the chats between them.
+
+        The kept workers unload the chats they lose, the removed ones stop
+        after saving every counter, and then the new ones are started. Until
+        it returns, no update must be routed.
+
+        :param shards: the new number of workers.
+
+        """
+        if shards <= 0:
+            raise ValueError("There must be at least one shard worker")
+
+        current = len(self._workers)
+
+        if shards == current:
+            return
+
+        logger.info("Resizing from %s to %s shard workers", current, shards)
+
+        for shard, (_, updates) in enumerate(self._workers):
+            updates.put(shards if shard < shards else None)
+
+        expected = {shard: RELEASED for shard in range(min(current, shards))}
+        expected.update((shard, STOPPED) for shard in range(shards, current))
+        self._wait(expected)
+
+        for process, _ in self._workers[shards:]:
+            process.join()
+
+        del self._workers[shards:]
+        self._spawn(range(current, shards), shards)
+
+    def stop(self) -> Dict[int, int]:
+        """Stop the workers once they handle every routed update.
+
+        :returns: the number of updates handled by every worker.
+
+        """
+        for _, updates in self._workers:
+            updates.put(None)
+
+        handled = self._wait(
+            {shard: STOPPED for shard in range(len(self._workers))}
+        )
+
+        for process, _ in self._workers:
+            process.join()
+
+        self._workers.clear()
+
+        return handled
+
+    def _spawn(self, shards: Iterable[int], total: int) -> None:
+        """Start new workers and wait until they are ready.
+
+        :param shards: the shards of the new workers.
+        :param total: total number of workers.
+
+        """
+        started = []
+
+        for shard in shards:
+            updates = self._context.Queue()
+            process = self._context.Process(
+                target=run_worker,
+                args=(shard, total, updates, self._status, self._bot_factory),
+                name=f"gol-shard-{shard}",
+                daemon=True,
+            )
+            process.start()
+            self._workers.append((process, updates))
+            started.append(shard)
+
+        self._wait({shard: READY for shard in started})
+
+    def _wait(self, expected: Dict[int, str]) -> Dict[int, int]:
+        """Wait until some workers report a state.
+
+        :param expected: the state expected from every shard.
+        :returns: the value reported by every shard.
+
+        """
+        values: Dict[int, int] = {}
+
+        while len(values) < len(expected):
+            try:
+                shard, state, value = self._status.get(timeout=STATUS_TIMEOUT)
+            except queue.Empty:
+                for shard in expected:
+                    process = self._workers[shard][0]
+
+                    if shard not in values and not process.is_alive():
+                        raise BotError(
+                            f"The shard worker {shard} exited with code "
+                            f"{process.exitcode}"
+                        )
+
+                continue
+
+            if expected.get(shard) == state:
+                values[shard] = value
+
+        return values
+
+
+def run_worker(
+    shard: int,
+    shards: int,
+    updates: Any,
+    status: Any,
+    bot_factory: Optional[Callable[[], Any]] = None,
+) -> None:
+    """Handle the updates of a shard until asked to stop.
+
+    This is the entry point of the worker processes. Interruptions are
+    ignored, the router stops the workers when it is interrupted.
+
+    :param shard: the shard of the worker.
+    :param shards: number of workers.
+    :param updates: queue with the raw updates and control messages: the new
+        number of workers after a resize, or None to stop.
+    :param status: queue where the worker reports its state changes.
+    :param bot_factory: callable building the bot of the worker.
+
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_serve_shard(shard, shards, updates, status, bot_factory))
+
+
+async def _serve_shard(
+    shard: int,
+    shards: int,
+    updates: Any,
+    status: Any,
+    bot_factory: Optional[Callable[[], Any]],
+) -> None:
+    """Handle the updates of a shard, one at a time in arrival order.
+
+    :param shard: the shard of the worker.
+    :param shards: number of workers.
+    :param updates: queue with the raw updates and control messages.
+    :param status: queue where the worker reports its state changes.
+    :param bot_factory: callable building the bot of the worker.
+
+    """
+    from gbot.settings import (
+        BOT_TOKEN,
+        COUNTERS,
+        OUTBOX,
+        PERSISTENCE,
+        SCHEDULER,
+        SEND_RATE,
+        UPDATE_FILTER,
+    )
+    from gbot.webhook import WebhookServer
+
+    if bot_factory is None:
+        from telegram import Bot
+
+        bot = Bot(BOT_TOKEN)
+    else:
+        bot = bot_factory()
+
+    def owns(chat_id: int) -> bool:
+        return jump_hash(chat_id, shards) == shard
+
+    # Every worker sends a share of the messages allowed to the bot
+    OUTBOX.set_rate(SEND_RATE / shards)
+    OUTBOX.start(bot)
+    PERSISTENCE.start()
+    server = WebhookServer(
+        bot=bot, outbox=OUTBOX, update_filter=UPDATE_FILTER
+    )
+    loop = asyncio.get_running_loop()
+    SCHEDULER.owns = owns
+    jobs = loop.create_task(SCHEDULER.serve())
+    handled = 0
+    status.put((shard, READY, 0))
+
+    try:
+        while True:
+            try:
+                message = updates.get_nowait()
+            except queue.Empty:
+                message = await loop.run_in_executor(None, updates.get)
+
+            if message is None:
+                break
+
+            if isinstance(message, int):
+                shards = message
+                OUTBOX.set_rate(SEND_RATE / shards)
+                released = COUNTERS.release(owns)
+                status.put((shard, RELEASED, released))
+                continue
+
+            reply = await server.process_update(message)
+            handled += 1
+
+            if reply is not None:
+                OUTBOX.send(
+                    **{k: v for k, v in reply.items() if k != "method"}
+                )
+    finally:
+        SCHEDULER.stop()
+        await jobs
+        OUTBOX.stop()
+        PERSISTENCE.stop()
+        COUNTERS.close()
+        status.put((shard, STOPPED, handled))
+
+
+async def serve_sharded(
+    router: ShardRouter,
+    host: str,
+    port: int,
+    path: str,
+    url: Optional[str] = None,
+    bot: Any = None,
+    secret_token: Optional[str] = None,
+) -> None:
+    """Receive the webhook updates and route them until cancelled.
+
+    The webhook responses are always empty, the replies are sent by the
+    workers. ``SIGUSR1`` adds a worker and ``SIGUSR2`` removes one.
+
+    :param router: the router with its workers started.
+    :param host: address to listen on.
+    :param port: port to listen on.
+    :param path: URL path where the updates are posted.
+    :param url: public URL of the webhook. If not provided, the webhook is
+        expected to be already registered.
+    :param bot: the bot registering the webhook.
+    :param secret_token: token Telegram must send in every request, if any.
+
+    """
+    from gbot.prefilter import ALLOWED_UPDATES
+    from gbot.webhook import WebhookServer
+
+    loop = asyncio.get_running_loop()
+    routing = asyncio.Event()
+    routing.set()
+
+    async def handle(data: Dict[str, Any]) -> None:
+        await routing.wait()
+        router.route(data)
+
+    async def resize(shards: int) -> None:
+        try:
+            await loop.run_in_executor(None, router.resize, shards)
+        except BotError:
+            logger.exception("Couldn't resize the shard workers")
+        finally:
+            routing.set()
+
+    def rescale(delta: int) -> None:
+        if routing.is_set() and router.shards + delta > 0:
+            routing.clear()
+            loop.create_task(resize(router.shards + delta))
+
+    if hasattr(signal, "SIGUSR1"):
+        loop.add_signal_handler(signal.SIGUSR1, rescale, 1)
+        loop.add_signal_handler(signal.SIGUSR2, rescale, -1)
+
+    server = WebhookServer(path, handle=handle, secret_token=secret_token)
+    await server.start(host, port)
+    logger.info(
+        "Routing the updates on %s:%s%s to %s shard workers",
+        host,
+        server.port,
+        path,
+        router.shards,
+    )
+
+    if url and bot is not None:
+        await loop.run_in_executor(
+            None,
+            partial(
+                bot.set_webhook,
+                url=url,
+                allowed_updates=ALLOWED_UPDATES,
+                secret_token=secret_token,
+            ),
+        )
+
+    await server.serve_forever()
@@ -0,0 +1,470 @@
+# Copyright (c) 2021 Luis Liñán Villafranca. All rights reserved.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>
+"""Asyncio webhook runtime for the bot."""
+import asyncio
+import hmac
+import json
+import logging
+
+from functools import partial
+from typing import (
+    IO,
+    TYPE_CHECKING,
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+from telegram import Bot, Update
+
+from gbot.async_commands import COMMANDS, process_audio
+from gbot.error import BotError
+from gbot.outbox import quote
+from gbot.prefilter import ALLOWED_UPDATES
+
+if TYPE_CHECKING:
+    from gbot.outbox import Outbox
+    from gbot.prefilter import UpdateFilter
+
+logger = logging.getLogger(__name__)
+
+HTTP_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+}
+MAX_BODY_SIZE = 1 << 20
+SECRET_TOKEN_HEADER = "x-telegram-bot-api-secret-token"
+
+
+class WebhookContext:
+    """Context for an update received through the webhook.
+
+    The replies are queued in the outbox if any, so they respect the Bot API
+    limits. Otherwise the first message is sent back as the webhook response,
+    which saves a request to the Bot API, and the rest are sent by the bot
+    from a thread. The replies quote the update message in group chats.
+
+    :ivar chat_id: identification of the update chat.
+    :ivar bot: bot used to send files.
+    :ivar outbox: queue sending the replies, if any.
+    :ivar quote: arguments making a reply quote the update message, if it
+        has to be quoted.
+    :ivar replies: ``sendMessage`` calls produced by the handler, when there
+        is no outbox.
+
+    """
+
+    def __init__(
+        self,
+        update: Update,
+        bot: Optional[Bot] = None,
+        outbox: Optional["Outbox"] = None,
+    ) -> None:
+        """Instantiate the class.
+
+        :param update: the update being handled.
+        :param bot: bot used to send files.
+        :param outbox: queue sending the replies.
+
+        """
+        self.chat_id: int = update.effective_chat.id
+        self.bot: Optional[Bot] = bot
+        self.outbox: Optional["Outbox"] = outbox
+        self.quote: Dict[str, Any] = quote(update, {})
+        self.replies: List[Dict[str, Any]] = []
+
+    async def reply(
+        self,
+        text: str,
+        parse_mode: Optional[str] = None,
+        key: Optional[str] = None,
+    ) -> None:
+        """Reply to the update chat.
+
+        :param text: text of the message.
+        :param parse_mode: parse mode of the message text.
+        :param key: coalescing key of the message in the outbox. The text if
+            not provided.
+
+        """
+        if self.outbox is not None:
+            options = dict(self.quote)
+
+            if parse_mode:
+                options["parse_mode"] = parse_mode
+
+            self.outbox.send(self.chat_id, text, key, **options)
+            return
+
+        reply: Dict[str, Any] = {
+            "method": "sendMessage",
+            "chat_id": self.chat_id,
+            "text": text,
+            **self.quote,
+        }
+
+        if parse_mode:
+            reply["parse_mode"] = parse_mode
+
+        self.replies.append(reply)
+
+    async def reply_document(self, document: IO[bytes], filename: str) -> None:
+        """Send a file to the update chat.
+
+        :param document: the file content, closed once sent or failed.
+        :param filename: name of the file.
+
+        """
+        if self.outbox is not None:
+            self.outbox.send_document(
+                self.chat_id, document, filename, **self.quote
+            )
+            return
+
+        with document:
+            await self._call_bot(
+                "send_document",
+                self.chat_id,
+                document,
+                filename=filename,
+                **self.quote,
+            )
+
+    async def _call_bot(self, method: str, *args, **kwargs) -> Any:
+        """Call a bot method from a thread.
+
+        :param method: name of the bot method.
+        :returns: the method result.
+
+        """
+        if self.bot is None:
+            raise BotError("There is no bot to send the request through")
+
+        loop = asyncio.get_running_loop()
+
+        return await loop.run_in_executor(
+            None, partial(getattr(self.bot, method), *args, **kwargs)
+        )
+
+
+class WebhookServer:
+    """Local HTTP server receiving the updates posted by Telegram.
+
+    :ivar _path: URL path where the updates are posted.
+    :ivar _bot: bot used to send the replies that don't fit in the webhook
+        response.
+    :ivar _outbox: queue sending every reply, if any. Otherwise the first
+        one is the webhook response and the rest are sent by the bot.
+    :ivar _update_filter: filter discarding the updates without handler
+        before decoding them, if any.
+    :ivar _handle: coroutine function receiving the raw updates instead of
+        :meth:`process_update`, if any.
+    :ivar _secret_token: token Telegram sends in every request, if any. The
+        requests without it are rejected.
+    :ivar _server: the running asyncio server.
+
+    """
+
+    def __init__(
+        self,
+        path: str = "/",
+        bot: Optional[Bot] = None,
+        outbox: Optional["Outbox"] = None,
+        update_filter: Optional["UpdateFilter"] = None,
+        handle: Optional[
+            Callable[[Dict[str, Any]], Awaitable[Optional[Dict[str, Any]]]]
+        ] = None,
+        secret_token: Optional[str] = None,
+    ) -> None:
+        """Instantiate the class.
+
+        :param path: URL path where the updates are posted.
+        :param bot: bot used to send the replies that don't fit in the
+            webhook response.
+        :param outbox: queue sending every reply.
+        :param update_filter: filter discarding the updates without handler
+            before decoding them.
+        :param handle: coroutine function receiving the raw updates and
+            returning the webhook response, instead of running the handlers
+            in this process.
+        :param secret_token: token Telegram sends in every request, as
+            registered with the webhook.
+
+        """
+        self._path: str = path
+        self._bot: Optional[Bot] = bot
+        self._outbox: Optional["Outbox"] = outbox
+        self._update_filter: Optional["UpdateFilter"] = update_filter
+        self._handle = handle if handle is not None else self.process_update
+        self._secret_token: Optional[str] = secret_token
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, host: str, port: int) -> None:
+        """Start listening for updates.
+
+        :param host: address to listen on.
+        :param port: port to listen on.
+
+        """
+        self._server = await asyncio.start_server(
+            self._handle_connection, host, port
+        )
+
+    async def serve_forever(self) -> None:
+        """Serve the updates until the task is cancelled."""
+        async with self._server:
+            await self._server.serve_forever()
+
+    @property
+    def port(self) -> int:
+        """Get the port the server is listening on.
+
+        :returns: the listening port.
+
+        """
+        return self._server.sockets[0].getsockname()[1]
+
+    async def process_update(
+        self, data: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+        """Run the handler for a raw update.
+
+        :param data: the update as posted by Telegram.
+        :returns: the first reply of the handler when there is no outbox, if
+            any.
+
+        """
+        if self._update_filter and not self._update_filter.accepts(data):
+            return None
+
+        update = Update.de_json(data, self._bot)
+
+        if update is None or update.message is None:
+            return None
+
+        handler = self._select_handler(update)
+
+        if handler is None:
+            return None
+
+        context = WebhookContext(update, self._bot, self._outbox)
+
+        try:
+            await handler(update, context)
+        except Exception:  # pylint: disable=W0703
+            logger.exception("Error while handling the update %s", data)
+            return None
+
+        loop = asyncio.get_running_loop()
+
+        for reply in context.replies[1:]:
+            kwargs = {k: v for k, v in reply.items() if k != "method"}
+
+            if self._bot is not None:
+                await loop.run_in_executor(
+                    None, partial(self._bot.send_message, **kwargs)
+                )
+
+        return context.replies[0] if context.replies else None
+
+    @staticmethod
+    def _select_handler(update: Update):
+        """Choose the handler for an update.
+
+        :param update: the update information.
+        :returns: the handler coroutine function, or None if the update is
+            not handled.
+
+        """
+        message = update.message
+
+        if message.voice:
+            return process_audio
+
+        if not message.text or not message.entities:
+            return None
+
+        entity = message.entities[0]
+
+        if entity.type != "bot_command" or entity.offset != 0:
+            return None
+
+        command = message.text[1 : entity.length].split("@")[0].lower()
+
+        return COMMANDS.get(command)
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Serve the requests of a keep-alive HTTP connection.
+
+        :param reader: the connection reader.
+        :param writer: the connection writer.
+
+        """
+        try:
+            while True:
+                request = await self._read_request(reader)
+
+                if request is None:
+                    break
+
+                method, path, headers, body = request
+
+                if body is None:
+                    self._write_response(writer, 413, None)
+                    await writer.drain()
+                    break
+
+                status, response = await self._handle_request(
+                    method, path, headers, body
+                )
+                self._write_response(writer, status, response)
+                await writer.drain()
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _write_response(
+        writer: asyncio.StreamWriter,
+        status: int,
+        body: Optional[Dict[str, Any]],
+    ) -> None:
+        """Write an HTTP response.
+
+        :param writer: the connection writer.
+        :param status: the response status.
+        :param body: the response body, if any.
+
+        """
+        payload = json.dumps(body).encode() if body else b""
+        writer.write(
+            f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload
+        )
+
+    @staticmethod
+    async def _read_request(
+        reader: asyncio.StreamReader,
+    ) -> Optional[Tuple[str, str, Dict[str, str], Optional[bytes]]]:
+        """Read an HTTP request.
+
+        :param reader: the connection reader.
+        :returns: the method, path, headers and body of the request, or None
+            if the connection was closed. The header names are lowercase, and
+            the body is None when it is too large to be read.
+
+        """
+        request_line = await reader.readline()
+
+        if not request_line:
+            return None
+
+        method, path, _ = request_line.decode("latin-1").split(" ", 2)
+        headers = {}
+
+        while True:
+            line = await reader.readline()
+
+            if line in (b"\r\n", b"\n", b""):
+                break
+
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get("content-length", 0))
+
+        if length > MAX_BODY_SIZE:
+            return method, path, headers, None
+
+        body = await reader.readexactly(length) if length else b""
+
+        return method, path, headers, body
+
+    async def _handle_request(
+        self, method: str, path: str, headers: Dict[str, str], body: bytes
+    ) -> Tuple[int, Optional[Dict[str, Any]]]:
+        """Process an HTTP request.
+
+        :param method: the request method.
+        :param path: the request path.
+        :param headers: the request headers, with lowercase names.
+        :param body: the request body.
+        :returns: the response status and body.
+
+        """
+        if path != self._path:
+            return 404, None
+
+        if method != "POST":
+            return 405, None
+
+        if self._secret_token and not hmac.compare_digest(
+            headers.get(SECRET_TOKEN_HEADER, "").encode(),
+            self._secret_token.encode(),
+        ):
+            return 403, None
+
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return 400, None
+
+        return 200, await self._handle(data)
+
+
+async def serve_webhook(
+    bot: Bot,
+    host: str,
+    port: int,
+    path: str,
+    url: Optional[str] = None,
+    outbox: Optional["Outbox"] = None,
+    update_filter: Optional["UpdateFilter"] = None,
+    secret_token: Optional[str] = None,
+) -> None:
+    """Register the webhook and serve the updates until cancelled.
+
+    :param bot: the bot receiving the updates.
+    :param host: address to listen on.
+    :param port: port to listen on.
+    :param path: URL path where the updates are posted.
+    :param url: public URL of the webhook. If not provided, the webhook is
+        expected to be already registered.
+    :param outbox: queue sending the replies.
+    :param update_filter: filter discarding the updates without handler.
+    :param secret_token: token Telegram must send in every request, if any.
+
+    """
+    server = WebhookServer(
+        path, bot, outbox, update_filter, secret_token=secret_token
+    )
+    await server.start(host, port)
+    logger.info("Listening for updates on %s:%s%s", host, server.port, path)
+
+    if url:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            None,
+            partial(
+                bot.set_webhook,
+                url=url,
+                allowed_updates=ALLOWED_UPDATES,
+                secret_token=secret_token,
+            ),
+        )
+
+    await server.serve_forever()
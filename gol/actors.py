@@ -0,0 +1,119 @@
+# Copyright (c) 2021 Luis Liñán Villafranca. All rights reserved.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>
+"""Per-chat serialized execution on a shared pool of threads."""
+import threading
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+Task = Tuple[Callable[..., Any], Tuple[Any, ...], Future]
+
+
+class ChatExecutor:
+    """Run the tasks of every chat in order, and different chats in parallel.
+
+    Each chat behaves as an actor with its own queue of pending tasks. A chat
+    with pending tasks is drained by one pool thread at a time, so the tasks
+    of a chat never run concurrently, without any lock shared by all chats.
+
+    :ivar _batch: maximum tasks of a chat run before yielding the thread to
+        other chats.
+    :ivar _pool: threads running the tasks.
+    :ivar _queues: pending tasks of the chats being drained.
+    :ivar _lock: lock protecting the queues.
+    :ivar _idle: condition notified when there are no pending tasks.
+
+    """
+
+    def __init__(self, workers: int = 8, batch: int = 32) -> None:
+        """Instantiate the class.
+
+        :param workers: number of threads running the tasks.
+        :param batch: maximum tasks of a chat run before yielding the thread
+            to other chats.
+
+        """
+        self._batch: int = batch
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="gol-chat")
+        self._queues: Dict[int, Deque[Task]] = {}
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+    def submit(
+        self, chat_id: int, func: Callable[..., Any], *args: Any
+    ) -> Future:
+        """Schedule a task after the pending ones of the same chat.
+
+        :param chat_id: identification of the chat.
+        :param func: function to run.
+        :param args: arguments for the function.
+        :returns: a future with the result of the function.
+
+        """
+        future: Future = Future()
+
+        with self._lock:
+            queue = self._queues.get(chat_id)
+            schedule = queue is None
+
+            if schedule:
+                queue = self._queues[chat_id] = deque()
+
+            queue.append((func, args, future))
+
+        if schedule:
+            self._pool.submit(self._drain, chat_id)
+
+        return future
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every submitted task has run.
+
+        :param timeout: maximum seconds to wait.
+        :returns: True if there are no pending tasks.
+
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._queues, timeout)
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop the threads once the pending tasks are run.
+
+        :param wait: whether to wait for the pending tasks.
+
+        """
+        if wait:
+            self.wait_idle()
+
+        self._pool.shutdown(wait)
+
+    def _drain(self, chat_id: int) -> None:
+        """Run the pending tasks of a chat.
+
+        :param chat_id: identification of the chat.
+
+        """
+        for _ in range(self._batch):
+            with self._lock:
+                queue = self._queues[chat_id]
+
+                if not queue:
+                    del self._queues[chat_id]
+
+                    if not self._queues:
+                        self._idle.notify_all()
+
+                    return
+
+                func, args, future = queue.popleft()
+
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(func(*args))
+                except BaseException as error:  # pylint: disable=W0703
+                    future.set_exception(error)
+
+        self._pool.submit(self._drain, chat_id)
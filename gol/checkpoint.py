@@ -0,0 +1,104 @@
+# Copyright (c) 2021 Luis Liñán Villafranca. All rights reserved.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>
+"""Checkpoint of the processed updates."""
+import threading
+
+from typing import Optional, Set
+
+from gol.store import CounterStore
+
+
+class UpdateCheckpoint:
+    """Track the last update processed after every previous one.
+
+    The updates of different chats finish in any order, so the checkpoint is
+    the update before the oldest one still running, or the newest finished
+    one if none is running. It is saved by the persistence worker once the
+    counters changed until then are saved, so a restart can resume from the
+    next update without skipping nor applying twice any of them.
+
+    :ivar _store: store where the checkpoint is saved.
+    :ivar _running: updates started and not finished yet.
+    :ivar _last: newest finished update.
+    :ivar _saved: checkpoint saved in the store.
+    :ivar _lock: lock protecting the updates.
+
+    """
+
+    def __init__(self, store: CounterStore) -> None:
+        """Instantiate the class.
+
+        :param store: store where the checkpoint is saved.
+
+        """
+        self._store: CounterStore = store
+        self._running: Set[int] = set()
+        self._last: Optional[int] = None
+        self._saved: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def load(self) -> Optional[int]:
+        """Read the saved checkpoint, resuming the tracking from it.
+
+        :returns: the last update fully processed, or None if there is no
+            checkpoint.
+
+        """
+        saved = self._store.load_checkpoint()
+
+        with self._lock:
+            self._saved = saved
+
+            if self._last is None:
+                self._last = saved
+
+        return saved
+
+    def begin(self, update_id: int) -> None:
+        """Mark an update as started.
+
+        :param update_id: identification of the update.
+
+        """
+        with self._lock:
+            self._running.add(update_id)
+
+    def done(self, update_id: int) -> None:
+        """Mark an update as finished, successfully or not.
+
+        :param update_id: identification of the update.
+
+        """
+        with self._lock:
+            self._running.discard(update_id)
+
+            if self._last is None or update_id > self._last:
+                self._last = update_id
+
+    def position(self) -> Optional[int]:
+        """Get the last update processed after every previous one.
+
+        :returns: the update identification, or None if no update finished.
+
+        """
+        with self._lock:
+            if self._running:
+                return min(self._running) - 1
+
+            return self._last
+
+    def save(self, position: Optional[int]) -> None:
+        """Save a checkpoint, if it moved forward.
+
+        :param position: the checkpoint, taken before saving the counters.
+
+        """
+        if position is None or (
+            self._saved is not None and position <= self._saved
+        ):
+            return
+
+        self._store.save_checkpoint(position)
+        self._saved = position
@@ -0,0 +1,180 @@
+# Copyright (c) 2021 Luis Liñán Villafranca. All rights reserved.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>
+"""Timezone aware clock classifying the days for the rules."""
+import time
+
+from datetime import datetime, timedelta, tzinfo
+from typing import Callable, Dict, FrozenSet, Optional, Tuple
+
+from gol.error import UnknownTimezoneError
+from gol.rules import DayClass
+
+try:
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+except ImportError:  # pragma: no cover
+    from backports.zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# Friday, Saturday and Sunday
+WEEKEND_DAYS: FrozenSet[int] = frozenset({4, 5, 6})
+
+DayEntry = Tuple[float, float, DayClass, int]
+
+
+class RuleClock:
+    """Tell the day class and number of an instant in a timezone.
+
+    The day class and number of every timezone are cached together with the
+    instants where the current day starts and ends, so checking the current
+    day is a timestamp comparison until the next midnight.
+
+    :ivar _time_source: function returning the current UNIX timestamp.
+    :ivar _weekend_days: week days, as in :meth:`datetime.weekday`,
+        considered weekend.
+    :ivar _days: cached day boundaries and class by timezone name.
+    :ivar _zones: resolved timezones by name.
+
+    """
+
+    def __init__(
+        self,
+        time_source: Callable[[], float] = time.time,
+        weekend_days: FrozenSet[int] = WEEKEND_DAYS,
+    ) -> None:
+        """Instantiate the class.
+
+        :param time_source: function returning the current UNIX timestamp.
+        :param weekend_days: week days, as in :meth:`datetime.weekday`,
+            considered weekend.
+
+        """
+        self._time_source: Callable[[], float] = time_source
+        self._weekend_days: FrozenSet[int] = weekend_days
+        self._days: Dict[Optional[str], DayEntry] = {}
+        self._zones: Dict[str, tzinfo] = {}
+
+    def now(self) -> float:
+        """Get the current instant.
+
+        :returns: the current UNIX timestamp.
+
+        """
+        return self._time_source()
+
+    def day_class(
+        self, timezone: Optional[str] = None, timestamp: Optional[float] = None
+    ) -> DayClass:
+        """Classify the day of an instant.
+
+        :param timezone: name of the timezone. The server local time if not
+            provided.
+        :param timestamp: the UNIX timestamp. The current one if not provided.
+        :returns: the day class.
+
+        """
+        return self._day(timezone, timestamp)[2]
+
+    def day_number(
+        self, timezone: Optional[str] = None, timestamp: Optional[float] = None
+    ) -> int:
+        """Get the day of an instant as a proleptic Gregorian ordinal.
+
+        :param timezone: name of the timezone. The server local time if not
+            provided.
+        :param timestamp: the UNIX timestamp. The current one if not provided.
+        :returns: the day ordinal, as in :meth:`date.toordinal`.
+
+        """
+        return self._day(timezone, timestamp)[3]
+
+    def hour(
+        self, timezone: Optional[str] = None, timestamp: Optional[float] = None
+    ) -> int:
+        """Get the local hour of an instant.
+
+        :param timezone: name of the timezone. The server local time if not
+            provided.
+        :param timestamp: the UNIX timestamp. The current one if not provided.
+        :returns: the hour, from 0 to 23.
+
+        """
+        if timestamp is None:
+            timestamp = self._time_source()
+
+        zone = self.zone(timezone) if timezone else None
+
+        return datetime.fromtimestamp(timestamp, zone).hour
+
+    def is_weekend(
+        self, timezone: Optional[str] = None, timestamp: Optional[float] = None
+    ) -> bool:
+        """Check if an instant is in the weekend.
+
+        :param timezone: name of the timezone. The server local time if not
+            provided.
+        :param timestamp: the UNIX timestamp. The current one if not provided.
+        :returns: True when the day of the instant is weekend.
+
+        """
+        return self.day_class(timezone, timestamp) is DayClass.WEEKEND
+
+    def zone(self, timezone: str) -> tzinfo:
+        """Resolve a timezone by its name.
+
+        :param timezone: name of the timezone, like ``Europe/Madrid``.
+        :returns: the timezone.
+
+        """
+        if timezone not in self._zones:
+            try:
+                self._zones[timezone] = ZoneInfo(timezone)
+            except (ZoneInfoNotFoundError, ValueError):
+                raise UnknownTimezoneError(f"Unknown timezone {timezone}")
+
+        return self._zones[timezone]
+
+    def _day(
+        self, timezone: Optional[str], timestamp: Optional[float]
+    ) -> DayEntry:
+        """Get the cached day of an instant, computing it if needed.
+
+        :param timezone: name of the timezone, or None for the local time.
+        :param timestamp: the UNIX timestamp. The current one if not provided.
+        :returns: the start and end timestamps of the day, its class and its
+            ordinal.
+
+        """
+        if timestamp is None:
+            timestamp = self._time_source()
+
+        day = self._days.get(timezone)
+
+        if day is None or not day[0] <= timestamp < day[1]:
+            day = self._days[timezone] = self._classify(timezone, timestamp)
+
+        return day
+
+    def _classify(self, timezone: Optional[str], timestamp: float) -> DayEntry:
+        """Compute the boundaries, class and ordinal of the day of an instant.
+
+        :param timezone: name of the timezone, or None for the local time.
+        :param timestamp: the UNIX timestamp.
+        :returns: the start and end timestamps of the day, its class and its
+            ordinal.
+
+        """
+        zone = self.zone(timezone) if timezone else None
+        day = datetime.fromtimestamp(timestamp, zone).date()
+        start = datetime(day.year, day.month, day.day, tzinfo=zone)
+        end = start + timedelta(days=1)
+        day_class = (
+            DayClass.WEEKEND
+            if day.weekday() in self._weekend_days
+            else DayClass.WEEKDAY
+        )
+
+        return start.timestamp(), end.timestamp(), day_class, day.toordinal()
+
+
+DEFAULT_CLOCK = RuleClock()
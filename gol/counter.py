@@ -3,20 +3,82 @@
 # This work is licensed under the terms of the MIT license.
 # For a copy, see <https://opensource.org/licenses/MIT>
 """Counter main class."""
-import json
-
-from json.decoder import JSONDecodeError
-from typing import Dict, Optional
-
-from gol.error import ParticipantNotFound, WrongCounterFileFormatError
-from gol.settings import SAVE_FILE
+import sys
+import threading
+
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from gol.clock import DEFAULT_CLOCK, RuleClock
+from gol.error import (
+    ParticipantNotFound,
+    RulesetNotFound,
+    UnknownTimezoneError,
+    WrongCounterFileFormatError,
+)
+from gol.events import (
+    Completion,
+    ErrorEvent,
+    Event,
+    PushUpsRequest,
+    VoiceEvent,
+    from_operation,
+    to_operation,
+)
+from gol.ledger import NormalsLedger
+from gol.rules import Beneficiary, Case, DayClass, Ruleset, get_ruleset
+from gol.settings import CHATS_DIR, JOURNAL_COMPACT_EVERY
+from gol.stats import CounterStats
+from gol.store import CounterStore, JsonCounterStore
+from gol.updates import RecentUpdates
 from gol.user import PushUpper
-from gol.utils import is_weekend
 
 
 class PushUpsCounter:
     """Manage the participants of the push-ups competition.
 
+    Every change is appended to the counter journal in the store. Snapshots
+    cover the changes up to a given journal sequence number, so loading the
+    counter reads the last snapshot and replays the journal tail.
+
+    Changes caused by an update carry its identification in their journal
+    record, and the last ``RECENT_UPDATES`` of them are kept in the snapshots,
+    so an update delivered again, even after a restart, is not applied twice.
+
+    Most counters sit idle in memory, so they and their parts use slots
+    instead of instance dictionaries, and the participant identifications
+    are interned, being the same few strings in every structure.
+
+    :ivar _chat_id: identification of the chat the counter belongs to.
+    :ivar _store: store where the counter is persisted.
+    :ivar _compact_every: number of journal records before taking a new
+        snapshot.
+    :ivar _on_change: function called with the counter after every change,
+        responsible of saving it. If not provided, the counter takes a
+        snapshot itself every ``_compact_every`` changes.
+    :ivar _lock: lock serializing the changes and the snapshots.
+    :ivar _seq: sequence number of the last applied change.
+    :ivar _snapshot_seq: sequence number of the last snapshot.
+    :ivar _ruleset: rules deciding who has to do the push-ups.
+    :ivar _clock: clock classifying the days for the rules.
+    :ivar _timezone: name of the chat timezone, or None to use the server
+        local time.
+    :ivar _version: number increased on every change of the counter state.
+    :ivar _renders: rendered representations of the counter, by name, with
+        the version they were rendered at.
+    :ivar _stats: aggregates of the participants, updated on every change.
+    :ivar _updates: identification of the last updates applied.
+    :ivar _imports: sequence number of the last change imported from every
+        other chat.
     :ivar _first_id: the first person identificator.
     :ivar _second_id: the second person identificator.
     :ivar _ppl: a dictionary containing the two participants by their
@@ -24,8 +86,66 @@ class PushUpsCounter:
 
     """
 
-    def __init__(self) -> None:
-        """Instantiate the class."""
+    __slots__ = (
+        "_chat_id",
+        "_store",
+        "_compact_every",
+        "_on_change",
+        "_lock",
+        "_seq",
+        "_snapshot_seq",
+        "_ruleset",
+        "_clock",
+        "_timezone",
+        "_version",
+        "_renders",
+        "_stats",
+        "_updates",
+        "_imports",
+        "_first_id",
+        "_second_id",
+        "_ppl",
+    )
+
+    def __init__(
+        self,
+        chat_id: int = 0,
+        store: Optional[CounterStore] = None,
+        compact_every: int = JOURNAL_COMPACT_EVERY,
+        on_change: Optional[Callable[["PushUpsCounter"], None]] = None,
+        clock: RuleClock = DEFAULT_CLOCK,
+    ) -> None:
+        """Instantiate the class.
+
+        :param chat_id: identification of the chat the counter belongs to.
+        :param store: store where the counter is persisted. By default, a JSON
+            store in the package data directory.
+        :param compact_every: number of journal records before taking a new
+            snapshot.
+        :param on_change: function called with the counter after every
+            change, responsible of saving it.
+        :param clock: clock classifying the days for the rules.
+
+        """
+        self._chat_id: int = chat_id
+        self._store: CounterStore = (
+            store if store is not None else JsonCounterStore(CHATS_DIR)
+        )
+        self._compact_every: int = compact_every
+        self._on_change: Optional[
+            Callable[["PushUpsCounter"], None]
+        ] = on_change
+        self._lock = threading.RLock()
+        self._seq: int = 0
+        self._snapshot_seq: int = 0
+        self._ruleset: Ruleset = get_ruleset()
+        self._clock: RuleClock = clock
+        self._timezone: Optional[str] = None
+        self._version: int = 0
+        self._renders: Dict[str, Tuple[int, str]] = {}
+        self._stats: CounterStats = CounterStats()
+        self._updates: RecentUpdates = RecentUpdates()
+        self._imports: Dict[int, int] = {}
         self._first_id: str = ""
         self._second_id: str = ""
         self._ppl: Dict[str, PushUpper] = {}
@@ -49,16 +169,14 @@ class PushUpsCounter:
             participant.
 
         """
-        self._clean()
-        self._first_id = first_person_id
-        self._second_id = second_person_id
-        self._ppl[self._first_id] = PushUpper(
-            first_person_name, first_person_id
-        )
-        self._ppl[self._second_id] = PushUpper(
-            second_person_name, second_person_id
-        )
-        self.save_count()
+        with self._lock:
+            self._setup(
+                first_person_name,
+                first_person_id,
+                second_person_name,
+                second_person_id,
+            )
+            self.save_count()
 
     def is_configured(self) -> bool:
         """Check if the counter is configured.
@@ -73,112 +191,595 @@ class PushUpsCounter:
 
         return is_configured
 
-    def add_pushups(self, requester: str, target: str) -> None:
+    def voice_days(self) -> FrozenSet[DayClass]:
+        """Get the kinds of day in which voice messages give push-ups.
+
+        :returns: the day classes, none if the counter is not configured.
+
+        """
+        with self._lock:
+            if not self.is_configured():
+                return frozenset()
+
+            cases = {
+                Case.VOICE_RIP if person.rip_wknd else Case.VOICE
+                for person in self._ppl.values()
+            }
+
+            return frozenset(
+                day_class
+                for day_class in DayClass
+                if any(
+                    self._ruleset.outcome(day_class, case)[1]
+                    for case in cases
+                )
+            )
+
+    @property
+    def chat_id(self) -> int:
+        """Variable ``_chat_id`` getter.
+
+        :returns: the ``_chat_id`` value.
+
+        """
+        return self._chat_id
+
+    @property
+    def ruleset(self) -> Ruleset:
+        """Variable ``_ruleset`` getter.
+
+        :returns: the ``_ruleset`` value.
+
+        """
+        return self._ruleset
+
+    def set_ruleset(self, name: str) -> None:
+        """Change the rules of the counter and save it.
+
+        :param name: name of a registered ruleset.
+
+        """
+        ruleset = get_ruleset(name)
+
+        with self._lock:
+            self._ruleset = ruleset
+            self.save_count()
+
+    @property
+    def timezone(self) -> Optional[str]:
+        """Variable ``_timezone`` getter.
+
+        :returns: the ``_timezone`` value.
+
+        """
+        return self._timezone
+
+    def set_timezone(self, timezone: Optional[str]) -> None:
+        """Change the timezone of the counter and save it.
+
+        :param timezone: name of the timezone, or None to use the server
+            local time.
+
+        """
+        if timezone:
+            self._clock.zone(timezone)
+
+        with self._lock:
+            self._timezone = timezone or None
+            self.save_count()
+
+    @property
+    def version(self) -> int:
+        """Variable ``_version`` getter.
+
+        :returns: the ``_version`` value.
+
+        """
+        return self._version
+
+    @property
+    def seq(self) -> int:
+        """Variable ``_seq`` getter.
+
+        :returns: the ``_seq`` value.
+
+        """
+        return self._seq
+
+    def is_dirty(self) -> bool:
+        """Check if the counter changed since the last snapshot.
+
+        :returns: True if there are changes not included in the snapshot.
+
+        """
+        return self._seq != self._snapshot_seq
+
+    def imported(self, source: int) -> int:
+        """Get the last change of a chat already applied to the counter.
+
+        :param source: identification of the chat the changes come from.
+        :returns: the sequence number of the last change imported from the
+            chat, or the counter one if it is its own chat.
+
+        """
+        with self._lock:
+            if source == self._chat_id:
+                return self._seq
+
+            return self._imports.get(source, 0)
+
+    def has_applied(self, update_id: int) -> bool:
+        """Check if an update was recently applied to the counter.
+
+        :param update_id: identification of the update.
+        :returns: True if one of the last changes was caused by the update.
+
+        """
+        with self._lock:
+            return update_id in self._updates
+
+    def add_pushups(
+        self, requester: str, target: str, update_id: Optional[int] = None
+    ) -> None:
         """Apply the correct push-ups depending of the choosen rules.
 
         :param requester: the requester participant identification.
         :param target: the identification of the target messager.
+        :param update_id: identification of the update causing the change.
+            Ignored if the update was already applied.
 
         """
-        requester_user = self._ppl[requester]
-        non_requester_user = self._ppl[self.opposite(requester)]
-
-        if requester == target:
-            if is_weekend():
-                requester_user.add_normals(1)
-            else:
-                non_requester_user.add_normals(1)
-        else:
-            if is_weekend():
-                requester_user.add_normals(2)
-            else:
-                requester_user.add_normals(1)
+        self._commit("push", [requester, target], update_id=update_id)
 
-    def process_audio(self, sender: str) -> None:
+    def process_audio(
+        self, sender: str, update_id: Optional[int] = None
+    ) -> None:
         """Add the necessary push-ups if the conditions are chosen.
 
         :param sender: the push-ups inquisitor.
+        :param update_id: identification of the update causing the change.
+            Ignored if the update was already applied.
+
+        """
+        timestamp = self._clock.now()
+
+        with self._lock:
+            weekend = self._clock.is_weekend(self._timezone, timestamp)
+
+            if self._evaluate(VoiceEvent(sender), weekend):
+                self._commit("voice", [sender], timestamp, update_id)
+
+    def reset_weekend(self) -> bool:
+        """Clear the weekend flag of both participants and save the counter.
+
+        :returns: True if any flag was set.
 
         """
-        if is_weekend() and self._ppl[sender].rip_wknd:
-            self.add_pushups(self.opposite(sender), sender)
+        with self._lock:
+            flagged = [
+                person for person in self._ppl.values() if person.rip_wknd
+            ]
+
+            for person in flagged:
+                person.rip_wknd = False
 
-    def process_error(self, sender: str) -> None:
+            if flagged:
+                self._version += 1
+                self.save_count()
+
+        return bool(flagged)
+
+    def process_error(
+        self, sender: str, update_id: Optional[int] = None
+    ) -> None:
         """Add necesary push-ups when error occurs.
 
         :param sender: the push-ups inquisitor.
+        :param update_id: identification of the update causing the change.
+            Ignored if the update was already applied.
+
+        """
+        self._commit("error", [sender], update_id=update_id)
+
+    def complete_pushups(
+        self,
+        participant_id: str,
+        number: int = 1,
+        update_id: Optional[int] = None,
+    ) -> None:
+        """Complete a number of pending push-ups of a participant.
+
+        :param participant_id: identification of the participant.
+        :param number: number of push-up groups completed.
+        :param update_id: identification of the update causing the change.
+            Ignored if the update was already applied.
+
+        """
+        self._commit(
+            "complete", [participant_id, number], update_id=update_id
+        )
+
+    def apply_batch(
+        self,
+        events: Iterable[Event],
+        timestamp: Optional[float] = None,
+        update_id: Optional[int] = None,
+        weekend: Optional[bool] = None,
+        origin: Optional[Tuple[int, int]] = None,
+    ) -> None:
+        """Apply several events at once.
+
+        Every event is evaluated against the same clock reading and the
+        whole batch is appended to the journal as a single record. If any
+        event is not valid, none of them is applied.
+
+        :param events: the events to apply, in order.
+        :param timestamp: UNIX timestamp the events happened at, to apply
+            past events with the rules of their day. The current one if not
+            provided.
+        :param update_id: identification of the update causing the changes.
+            Ignored if the update was already applied.
+        :param weekend: whether the events happened during the weekend.
+            Classified from the timestamp in the counter timezone if not
+            provided.
+        :param origin: chat and sequence number of the change the events
+            are imported from, remembered as the last one imported from that
+            chat.
+
+        """
+        operations = [list(to_operation(event)) for event in events]
+
+        if operations:
+            self._commit(
+                "batch", operations, timestamp, update_id, weekend, origin
+            )
+
+    def check_batch(self, events: Iterable[Event]) -> None:
+        """Check that several events could be applied, without applying them.
+
+        :param events: the events to check.
+
+        """
+        with self._lock:
+            for event in events:
+                self._evaluate(event, False)
+
+    def _commit(
+        self,
+        operation: str,
+        args: List[Any],
+        timestamp: Optional[float] = None,
+        update_id: Optional[int] = None,
+        weekend: Optional[bool] = None,
+        origin: Optional[Tuple[int, int]] = None,
+    ) -> None:
+        """Apply a change and append it to the journal.
+
+        The weekend flag is recorded so replaying the journal later gives the
+        same result regardless of the day, and the update causing the change
+        or the imported change, if any, so it is remembered as applied in the
+        same write.
+
+        :param operation: name of the change.
+        :param args: arguments of the change.
+        :param timestamp: UNIX timestamp of the change. The current one if
+            not provided.
+        :param update_id: identification of the update causing the change.
+            The change is discarded if the update was already applied.
+        :param weekend: whether the change happened during the weekend.
+            Classified from the timestamp if not provided.
+        :param origin: chat and sequence number of the imported change.
 
         """
-        opposite = self.opposite(sender)
-        self.add_pushups(sender, opposite)
-        self.add_pushups(sender, opposite)
+        if timestamp is None:
+            timestamp = self._clock.now()
+
+        with self._lock:
+            if update_id is not None and update_id in self._updates:
+                return
+
+            if weekend is None:
+                weekend = self._clock.is_weekend(self._timezone, timestamp)
+
+            record = {
+                "n": self._seq + 1,
+                "t": round(timestamp, 3),
+                "op": operation,
+                "args": args,
+                "w": weekend,
+            }
+
+            if update_id is not None:
+                record["u"] = update_id
+
+            if origin is not None:
+                record["o"] = list(origin)
+
+            self._apply(record)
+            self._store.append(self._chat_id, record)
+
+            if self._on_change is None:
+                if self._seq - self._snapshot_seq >= self._compact_every:
+                    self.save_count()
+
+                return
+
+        self._on_change(self)
+
+    def _apply(self, record: Dict[str, Any]) -> None:
+        """Apply a journal record to the participants.
+
+        Every operation of the record is evaluated before changing anything,
+        so an invalid record leaves the counter untouched.
+
+        :param record: the journal record.
+
+        """
+        weekend = record["w"]
+        operations = (
+            record["args"]
+            if record["op"] == "batch"
+            else [(record["op"], record["args"])]
+        )
+        changes = []
+
+        for operation, args in operations:
+            event = from_operation(operation, args)
+            changes.append((event, self._evaluate(event, weekend)))
+
+        day = self._clock.day_number(self._timezone, record["t"])
+
+        for event, effects in changes:
+            for add, participant_id, number in effects:
+                if add:
+                    self._ppl[participant_id].add_normals(number)
+                else:
+                    self._ppl[participant_id].complete_pushups(number)
+
+            self._stats.record(event, effects, day)
+
+        if "u" in record:
+            self._updates.add(record["u"])
+
+        if "o" in record:
+            source, seq = record["o"]
+            self._imports[source] = seq
+
+        self._seq = record["n"]
+        self._version += 1
+
+    def _evaluate(
+        self, event: Event, weekend: bool
+    ) -> List[Tuple[bool, str, int]]:
+        """Compute the changes caused by an event with the counter rules.
+
+        :param event: the counter event.
+        :param weekend: whether the event happened during the weekend.
+        :returns: the changes as tuples with whether push-up blocks are added
+            or completed, the participant and the number of blocks.
+
+        """
+        if isinstance(event, Completion):
+            if event.participant not in self._ppl:
+                raise ParticipantNotFound(
+                    f"Couldn't find the participant {event.participant}"
+                )
+
+            if event.number <= 0:
+                raise ValueError(
+                    "You only can pass a positive number of push-ups"
+                )
+
+            return [(False, event.participant, event.number)]
+
+        if isinstance(event, PushUpsRequest):
+            actor = event.requester
+            case = (
+                Case.PUSH_SELF
+                if event.requester == event.target
+                else Case.PUSH_OTHER
+            )
+        elif isinstance(event, ErrorEvent):
+            actor = event.sender
+            case = Case.ERROR
+        elif event.sender in self._ppl:
+            actor = event.sender
+            case = Case.VOICE_RIP if self._ppl[actor].rip_wknd else Case.VOICE
+        else:
+            return []
+
+        opposite = self.opposite(actor)
+        beneficiary, blocks = self._ruleset.outcome(
+            DayClass(int(weekend)), case
+        )
+
+        if not blocks:
+            return []
+
+        if beneficiary is Beneficiary.OPPOSITE:
+            return [(True, opposite, blocks)]
+
+        return [(True, actor, blocks)]
 
     def load_count(self) -> None:
-        """Read the counter saved values from a file."""
+        """Read the counter snapshot and replay the journal tail.
+
+        The counter is left unconfigured if it was never saved.
+
+        """
+        with self._lock:
+            snapshot = self._store.load(self._chat_id)
+
+            if snapshot is None:
+                return
+
+            self.restore(snapshot)
+
+            for record in self._store.replay(self._chat_id, self._seq):
+                self._apply(record)
+
+    def save_count(self) -> None:
+        """Save a snapshot of the counter and compact the journal."""
+        with self._lock:
+            self._store.save(self._chat_id, self.snapshot())
+            self._snapshot_seq = self._seq
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Serialize the counter state.
+
+        :returns: a JSON serializable snapshot of the counter.
+
+        """
+        with self._lock:
+            return {
+                "participants": [
+                    {
+                        "id": person.id,
+                        "name": person.name,
+                        "punishments": person.punishments,
+                        "rip_wknd": person.rip_wknd,
+                    }
+                    for person in (
+                        self._ppl[self._first_id],
+                        self._ppl[self._second_id],
+                    )
+                ],
+                "normals": self._ppl[self._first_id].normals.to_json(),
+                "seq": self._seq,
+                "ruleset": self._ruleset.name,
+                "timezone": self._timezone,
+                "stats": self._stats.to_json(),
+                "updates": self._updates.to_json(),
+                "imports": {
+                    str(source): seq for source, seq in self._imports.items()
+                },
+            }
+
+    def restore(self, snapshot: Dict[str, Any]) -> None:
+        """Replace the counter state with a snapshot.
+
+        Snapshots from the old format, with the participants keyed by their
+        identification, are also accepted.
+
+        :param snapshot: snapshot of the counter.
+
+        """
+        snapshot = dict(snapshot)
+        normals = NormalsLedger.from_json(snapshot.pop("normals"))
+        seq = snapshot.pop("seq", 0)
+
+        try:
+            ruleset = get_ruleset(snapshot.pop("ruleset", None))
+        except RulesetNotFound as error:
+            raise WrongCounterFileFormatError(str(error))
+
+        timezone = snapshot.pop("timezone", None)
+        stats = CounterStats.from_json(snapshot.pop("stats", None) or {})
+        updates = RecentUpdates.from_json(snapshot.pop("updates", None) or [])
+        imports = {
+            int(source): seq
+            for source, seq in (snapshot.pop("imports", None) or {}).items()
+        }
+
+        if timezone:
+            try:
+                self._clock.zone(timezone)
+            except UnknownTimezoneError as error:
+                raise WrongCounterFileFormatError(str(error))
+
         try:
-            json_count = json.load(SAVE_FILE.open("r"))
-        except JSONDecodeError as error:
+            participants = snapshot.pop("participants", None) or [
+                {"id": participant_id, **person}
+                for participant_id, person in snapshot.items()
+            ]
+            id_list = [person["id"] for person in participants]
+        except (KeyError, TypeError) as error:
             raise WrongCounterFileFormatError(
-                f"There was an error reading the config file: {error}"
+                f"The participants are not valid: {error}"
             )
-        normals = json_count.pop("normals")
 
-        if len(json_count) != 2:
+        if len(participants) != 2:
             raise WrongCounterFileFormatError(
                 "It should only be two id's in the serialized config file"
             )
 
-        id_list = list(json_count.keys())
-
-        if any(map(lambda x: x not in id_list, normals)):
+        if normals and normals.holder not in id_list:
             raise WrongCounterFileFormatError(
-                "The normals list does not match with the provided id's"
+                "The normals holder does not match with the provided id's"
             )
 
-        self.config(
-            json_count[id_list[0]]["name"],
-            id_list[0],
-            json_count[id_list[1]]["name"],
-            id_list[1],
-        )
+        with self._lock:
+            first_person, second_person = participants
+            self._setup(
+                first_person["name"],
+                first_person["id"],
+                second_person["name"],
+                second_person["id"],
+            )
+            self._ppl[self._first_id].normals = normals
 
-        first_person = json_count[self._first_id]
-        second_person = json_count[self._second_id]
+            for person in participants:
+                self._ppl[person["id"]].rip_wknd = person["rip_wknd"]
+                self._ppl[person["id"]].punishments = person["punishments"]
 
-        self._ppl[self._first_id].normals = normals
-        self._ppl[self._first_id].name = first_person["name"]
-        self._ppl[self._first_id].rip_wknd = first_person["rip_wknd"]
-        self._ppl[self._first_id].punishments = first_person["punishments"]
-        self._ppl[self._second_id].name = second_person["name"]
-        self._ppl[self._second_id].rip_wknd = second_person["rip_wknd"]
-        self._ppl[self._second_id].punishments = second_person["punishments"]
+            self._seq = self._snapshot_seq = seq
+            self._stats = stats
+            self._updates = updates
+            self._imports = imports
+            self._ruleset = ruleset
+            self._timezone = timezone
+            self._version += 1
 
-    def save_count(self) -> None:
-        """Save the counter into a file."""
-        p1 = self._ppl[self._first_id]
-        p2 = self._ppl[self._second_id]
+    def history(self) -> Iterator[Dict[str, Any]]:
+        """Read every change of the counter kept by its store.
 
-        json.dump(
-            {
-                self._first_id: {
-                    "name": p1.name,
-                    "rip_wknd": p1.rip_wknd,
-                    "punishments": p1.punishments,
-                },
-                self._second_id: {
-                    "name": p2.name,
-                    "rip_wknd": p2.rip_wknd,
-                    "punishments": p2.punishments,
-                },
-                "normals": p1.normals,
-            },
-            SAVE_FILE.open("w"),
-            indent=4,
-        )
+        :returns: an iterator over the journal records, in order.
+
+        """
+        return self._store.history(self._chat_id)
+
+    def sync(self) -> None:
+        """Force the journal records to disk."""
+        with self._lock:
+            self._store.sync(self._chat_id)
+
+    def close(self) -> None:
+        """Release the counter resources in the store."""
+        with self._lock:
+            self._store.release(self._chat_id)
 
     def push_up_table(self) -> str:
         """Write a pretty table with the counter information.
 
+        The table is only rendered again when the counter changes.
+
+        :returns: a table string.
+
+        """
+        return self._render("table", self._render_table)
+
+    def _render(self, name: str, render: Callable[[], str]) -> str:
+        """Get a rendered representation, rendering it if outdated.
+
+        :param name: name of the representation.
+        :param render: function rendering the representation.
+        :returns: the rendered representation.
+
+        """
+        version = self._version
+        cached = self._renders.get(name)
+
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        rendered = render()
+        self._renders[name] = (version, rendered)
+
+        return rendered
+
+    def _render_table(self) -> str:
+        """Write a pretty table with the counter information.
+
         :returns: a table string.
 
         """
@@ -194,6 +795,54 @@ class PushUpsCounter:
             "+-----------+----------+----------+"
         )
 
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Get the aggregates of the participants as seen today.
+
+        :returns: the aggregates by participant identification.
+
+        """
+        with self._lock:
+            return self._stats.view(self._clock.day_number(self._timezone))
+
+    def stats_table(self) -> str:
+        """Write a pretty table with the participants statistics.
+
+        :returns: a table string.
+
+        """
+        with self._lock:
+            stats = self.stats()
+            p1 = self._ppl[self._first_id]
+            p2 = self._ppl[self._second_id]
+
+        empty: Dict[str, int] = {}
+        s1 = stats.get(p1.id, empty)
+        s2 = stats.get(p2.id, empty)
+        rows = "".join(
+            f"|{label:>11}|{s1.get(field, 0):^10}|{s2.get(field, 0):^10}|\n"
+            for label, field in (
+                ("Owed today", "day_added"),
+                ("Owed week", "week_added"),
+                ("Owed total", "added"),
+                ("Done today", "day_completed"),
+                ("Done week", "week_completed"),
+                ("Done total", "completed"),
+                ("Err. today", "day_errors"),
+                ("Err. week", "week_errors"),
+                ("Errors", "errors"),
+                ("Voice", "voice"),
+                ("Streak", "streak"),
+                ("Best streak", "best_streak"),
+            )
+        )
+        return (
+            "            +----------+----------+\n"
+            f"            |{p1.name[:5]:^10}|{p2.name[:5]:^10}|\n"
+            "+-----------+----------+----------+\n"
+            f"{rows}"
+            "+-----------+----------+----------+"
+        )
+
     def opposite(self, participant_id: str) -> str:
         """Obtain the opposite participant.
 
@@ -208,11 +857,45 @@ class PushUpsCounter:
 
         return set(self._ppl).difference({participant_id}).pop()
 
+    def _setup(
+        self,
+        first_person_name: str,
+        first_person_id: str,
+        second_person_name: str,
+        second_person_id: str,
+    ) -> None:
+        """Set up the participants without saving the counter.
+
+        :param first_person_name: human readable name for the first
+            participant.
+        :param first_person_id: machine identification for the first
+            participant.
+        :param second_person_name: human readable name for the second
+            participant.
+        :param second_person_id: machine identification for the second
+            participant.
+
+        """
+        self._clean()
+        first_person_id = sys.intern(first_person_id)
+        second_person_id = sys.intern(second_person_id)
+        self._first_id = first_person_id
+        self._second_id = second_person_id
+        normals = NormalsLedger()
+        self._ppl[self._first_id] = PushUpper(
+            first_person_name, first_person_id, normals
+        )
+        self._ppl[self._second_id] = PushUpper(
+            second_person_name, second_person_id, normals
+        )
+        self._version += 1
+
     def _clean(self) -> None:
         """Clean the counter."""
         self._first_id = ""
         self._second_id = ""
         self._ppl.clear()
+        self._stats.clear()
 
     def __str__(self) -> str:
         """Return the string representation of the object.
@@ -220,4 +903,8 @@ class PushUpsCounter:
         :returns: the representation.
 
         """
-        return f"{self._ppl[self._first_id]}; {self._ppl[self._second_id]}."
+        return self._render(
+            "str",
+            lambda: f"{self._ppl[self._first_id]}; "
+            f"{self._ppl[self._second_id]}.",
+        )
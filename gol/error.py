@@ -21,3 +21,27 @@ class ParticipantNotFound(CounterError):
     """GOL participant was not found."""
 
     pass
+
+
+class RulesetNotFound(CounterError):
+    """The requested ruleset is not registered."""
+
+    pass
+
+
+class WrongRulesetFormatError(CounterError, ValueError):
+    """There was an error when parsing a ruleset."""
+
+    pass
+
+
+class UnknownTimezoneError(CounterError, ValueError):
+    """The timezone name is not valid."""
+
+    pass
+
+
+class WrongHistoryFormatError(CounterError, ValueError):
+    """There was an error when parsing an exported history."""
+
+    pass
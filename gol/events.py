@@ -0,0 +1,74 @@
+# Copyright (c) 2021 Luis Liñán Villafranca. All rights reserved.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>
+"""Events changing a push-ups counter."""
+from typing import Any, List, NamedTuple, Tuple, Union
+
+from gol.error import CounterError
+
+
+class PushUpsRequest(NamedTuple):
+    """A participant asks for push-ups, as with ``/flex``."""
+
+    requester: str
+    target: str
+
+
+class ErrorEvent(NamedTuple):
+    """A participant made a mistake, as with ``/error``."""
+
+    sender: str
+
+
+class VoiceEvent(NamedTuple):
+    """A participant sent a voice message."""
+
+    sender: str
+
+
+class Completion(NamedTuple):
+    """A participant completed some pending push-up blocks."""
+
+    participant: str
+    number: int = 1
+
+
+Event = Union[PushUpsRequest, ErrorEvent, VoiceEvent, Completion]
+
+OPERATIONS = {
+    PushUpsRequest: "push",
+    ErrorEvent: "error",
+    VoiceEvent: "voice",
+    Completion: "complete",
+}
+EVENT_TYPES = {
+    operation: event_type for event_type, operation in OPERATIONS.items()
+}
+
+
+def to_operation(event: Event) -> Tuple[str, List[Any]]:
+    """Convert an event to its journal operation.
+
+    :param event: the counter event.
+    :returns: the operation name and its arguments.
+
+    """
+    try:
+        return OPERATIONS[type(event)], list(event)
+    except KeyError:
+        raise CounterError(f"Unknown counter event: {event!r}")
+
+
+def from_operation(operation: str, args: List[Any]) -> Event:
+    """Convert a journal operation to its event.
+
+    :param operation: the operation name.
+    :param args: the operation arguments.
+    :returns: the counter event.
+
+    """
+    try:
+        return EVENT_TYPES[operation](*args)
+    except (KeyError, TypeError):
+        raise CounterError(f"Unknown counter operation: {operation}")
@@ -0,0 +1,349 @@
+# Copyright (c) 2021 Luis Liñán Villafranca. All rights reserved.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>
+"""Streaming export and import of the counters history.
+
+The history is written with one event per line or row, with the chat it
+comes from, ``c``, and the fields of the journal records: ``n`` (sequence
+number of the change), ``t`` (UNIX timestamp), ``w`` (whether it was
+weekend), ``op`` (operation name) and ``args`` (operation arguments). The
+events of a batch share the same sequence number and timestamp.
+
+Every function works on iterators, so histories of any size are exported and
+imported in constant memory.
+
+"""
+import csv
+import io
+import itertools
+import json
+import tempfile
+
+from pathlib import Path
+from typing import (
+    IO,
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Tuple,
+)
+
+from gol.error import CounterError, WrongHistoryFormatError
+from gol.events import from_operation
+
+if TYPE_CHECKING:
+    from gol.counter import PushUpsCounter
+
+FIELDS = ("c", "n", "t", "w", "op", "args")
+FORMATS = ("ndjson", "csv")
+SPOOL_SIZE = 1 << 20
+
+Row = Dict[str, Any]
+
+
+def history_events(
+    chat_id: int, records: Iterable[Dict[str, Any]]
+) -> Iterator[Row]:
+    """Split the journal records into one row per event.
+
+    :param chat_id: identification of the chat of the records.
+    :param records: the journal records, in order.
+    :returns: an iterator over the events.
+
+    """
+    for record in records:
+        if record["op"] == "batch":
+            operations = record["args"]
+        else:
+            operations = [[record["op"], record["args"]]]
+
+        for operation, args in operations:
+            yield {
+                "c": chat_id,
+                "n": record["n"],
+                "t": record["t"],
+                "w": record["w"],
+                "op": operation,
+                "args": args,
+            }
+
+
+def to_ndjson(rows: Iterable[Row]) -> Iterator[str]:
+    """Write the events as newline delimited JSON.
+
+    :param rows: the events.
+    :returns: an iterator over the lines.
+
+    """
+    for row in rows:
+        yield json.dumps(row, separators=(",", ":")) + "\n"
+
+
+def to_csv(rows: Iterable[Row]) -> Iterator[str]:
+    """Write the events as CSV, with the arguments as a JSON array.
+
+    :param rows: the events.
+    :returns: an iterator over the lines, starting with the header.
+
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDS)
+
+    for row in rows:
+        writer.writerow(
+            (
+                row["c"],
+                row["n"],
+                row["t"],
+                int(row["w"]),
+                row["op"],
+                json.dumps(row["args"], separators=(",", ":")),
+            )
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def from_ndjson(lines: Iterable[str]) -> Iterator[Row]:
+    """Read the events from newline delimited JSON.
+
+    :param lines: the lines.
+    :returns: an iterator over the events.
+
+    """
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+
+        try:
+            yield _check(json.loads(line))
+        except ValueError as error:
+            raise WrongHistoryFormatError(f"Wrong line {number}: {error}")
+
+
+def from_csv(lines: Iterable[str]) -> Iterator[Row]:
+    """Read the events from CSV.
+
+    :param lines: the lines, starting with the header.
+    :returns: an iterator over the events.
+
+    """
+    reader = csv.DictReader(lines)
+
+    for row in reader:
+        try:
+            yield _check(
+                {
+                    "c": int(row["c"]),
+                    "n": int(row["n"]),
+                    "t": float(row["t"]),
+                    "w": row["w"].strip().lower() in ("1", "true"),
+                    "op": row["op"],
+                    "args": json.loads(row["args"]),
+                }
+            )
+        except (KeyError, TypeError, ValueError) as error:
+            raise WrongHistoryFormatError(
+                f"Wrong row {reader.line_num}: {error}"
+            )
+
+
+WRITERS = {"ndjson": to_ndjson, "csv": to_csv}
+READERS = {"ndjson": from_ndjson, "csv": from_csv}
+
+
+def export_history(
+    chat_id: int,
+    records: Iterable[Dict[str, Any]],
+    history_format: str = "ndjson",
+) -> Iterator[str]:
+    """Write the journal records of a counter in an export format.
+
+    :param chat_id: identification of the chat of the records.
+    :param records: the journal records, in order.
+    :param history_format: ``ndjson`` or ``csv``.
+    :returns: an iterator over the lines.
+
+    """
+    try:
+        writer = WRITERS[history_format]
+    except KeyError:
+        raise WrongHistoryFormatError(f"Unknown format {history_format}")
+
+    return writer(history_events(chat_id, records))
+
+
+def read_history(
+    lines: Iterable[str], history_format: str = "ndjson"
+) -> Iterator[Row]:
+    """Read the events of an exported history.
+
+    :param lines: the lines of the exported history.
+    :param history_format: ``ndjson`` or ``csv``.
+    :returns: an iterator over the events.
+
+    """
+    try:
+        reader = READERS[history_format]
+    except KeyError:
+        raise WrongHistoryFormatError(f"Unknown format {history_format}")
+
+    return reader(lines)
+
+
+def import_history(
+    counter: "PushUpsCounter", read_rows: Callable[[], Iterable[Row]]
+) -> int:
+    """Apply the events of an exported history to a counter.
+
+    The events are applied again through the counter rules, as of their
+    timestamps and with the weekend classification they were recorded with.
+    The events of every exported change are applied together with
+    :meth:`PushUpsCounter.apply_batch`, so each one is imported as one
+    change, and the counter remembers the last change imported from every
+    chat. The changes of a chat already imported are skipped, so a history
+    imported twice is only applied once.
+
+    The whole history is read and checked before applying anything, so an
+    invalid history leaves the counter untouched.
+
+    :param counter: the configured counter receiving the events.
+    :param read_rows: function reading the events, in order. It is called
+        once to check them and once more to apply them.
+    :returns: the number of applied events.
+
+    """
+    # Last change of every chat already applied, read before importing
+    after: Dict[int, int] = {}
+
+    for _, events in _changes(read_rows(), counter, after):
+        try:
+            counter.check_batch(events)
+        except (CounterError, ValueError) as error:
+            raise WrongHistoryFormatError(str(error))
+
+    imported = 0
+
+    for row, events in _changes(read_rows(), counter, after):
+        counter.apply_batch(
+            events,
+            row["t"],
+            weekend=bool(row["w"]),
+            origin=(row["c"], row["n"]),
+        )
+        imported += len(events)
+
+    return imported
+
+
+def spool_history(
+    chat_id: int,
+    records: Iterable[Dict[str, Any]],
+    history_format: str = "ndjson",
+) -> IO[bytes]:
+    """Export the journal records of a counter to a temporary file.
+
+    The file is kept in memory up to :data:`SPOOL_SIZE` bytes.
+
+    :param chat_id: identification of the chat of the records.
+    :param records: the journal records, in order.
+    :param history_format: ``ndjson`` or ``csv``.
+    :returns: the temporary file, at its beginning.
+
+    """
+    spool = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+
+    for line in export_history(chat_id, records, history_format):
+        spool.write(line.encode("utf-8"))
+
+    spool.seek(0)
+
+    return spool
+
+
+def detect_format(path: Path) -> str:
+    """Guess the format of an exported history from its file name.
+
+    :param path: the file path.
+    :returns: ``csv`` for ``.csv`` files, ``ndjson`` otherwise.
+
+    """
+    return "csv" if path.suffix.lower() == ".csv" else "ndjson"
+
+
+def _changes(
+    rows: Iterable[Row], counter: "PushUpsCounter", after: Dict[int, int]
+) -> Iterator[Tuple[Row, List[Any]]]:
+    """Group the history rows by the change they belong to.
+
+    :param rows: the rows, in order.
+    :param counter: the counter receiving the changes.
+    :param after: sequence number of the last change of every chat already
+        applied to the counter, filled from the counter when missing.
+    :returns: an iterator over the first row and the events of every change
+        not applied yet.
+
+    """
+    last: Dict[int, int] = {}
+
+    for (source, seq), group in itertools.groupby(
+        rows, key=lambda row: (row["c"], row["n"])
+    ):
+        if seq <= last.get(source, 0):
+            raise WrongHistoryFormatError(
+                f"The change {seq} of the chat {source} is not in order"
+            )
+
+        last[source] = seq
+        chunk = list(group)
+
+        if source not in after:
+            after[source] = counter.imported(source)
+
+        if seq > after[source]:
+            yield chunk[0], _to_events(chunk)
+
+
+def _to_events(rows: List[Row]) -> List[Any]:
+    """Convert some history rows to counter events.
+
+    :param rows: the rows.
+    :returns: the events.
+
+    """
+    try:
+        return [from_operation(row["op"], row["args"]) for row in rows]
+    except CounterError as error:
+        raise WrongHistoryFormatError(str(error))
+
+
+def _check(row: Any) -> Row:
+    """Check that a history row has every field.
+
+    :param row: the decoded row.
+    :returns: the row.
+
+    """
+    if not isinstance(row, dict) or any(field not in row for field in FIELDS):
+        raise ValueError(f"the fields {', '.join(FIELDS)} are required")
+
+    if not isinstance(row["args"], list):
+        raise ValueError("the arguments must be a list")
+
+    if not all(isinstance(row[field], int) for field in ("c", "n")):
+        raise ValueError("the chat and sequence number must be integers")
+
+    if not isinstance(row["t"], (int, float)):
+        raise ValueError("the timestamp must be a number")
+
+    return row
@@ -0,0 +1,200 @@
+# Copyright (c) 2021 Luis Liñán Villafranca. All rights reserved.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>
+"""Append-only journal of counter events."""
+import json
+import os
+import shutil
+import time
+
+from pathlib import Path
+from typing import IO, Any, BinaryIO, Dict, Iterator, Optional, Tuple
+
+from gol.settings import JOURNAL_SYNC_EVERY, JOURNAL_SYNC_INTERVAL
+
+
+class EventJournal:
+    """Write-ahead log with one compact JSON record per line.
+
+    Records are written and flushed on every append, but ``fsync`` is only
+    issued every ``sync_every`` records or ``sync_interval`` seconds.
+
+    :ivar _path: file where the records are appended.
+    :ivar _sync_every: number of records appended between two syncs.
+    :ivar _sync_interval: maximum seconds between two syncs.
+    :ivar _file: the open journal file, if any.
+    :ivar _pending: number of records appended since the last sync.
+    :ivar _last_sync: monotonic time of the last sync.
+
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        sync_every: int = JOURNAL_SYNC_EVERY,
+        sync_interval: float = JOURNAL_SYNC_INTERVAL,
+    ) -> None:
+        """Instantiate the class.
+
+        :param path: file where the records are appended.
+        :param sync_every: number of records appended between two syncs.
+        :param sync_interval: maximum seconds between two syncs.
+
+        """
+        self._path: Path = path
+        self._sync_every: int = sync_every
+        self._sync_interval: float = sync_interval
+        self._file: Optional[IO[str]] = None
+        self._pending: int = 0
+        self._last_sync: float = time.monotonic()
+
+    @property
+    def path(self) -> Path:
+        """Variable ``_path`` getter.
+
+        :returns: the ``_path`` value.
+
+        """
+        return self._path
+
+    def append(self, record: Dict[str, Any]) -> int:
+        """Append a record to the journal.
+
+        :param record: JSON serializable record.
+        :returns: the number of bytes written.
+
+        """
+        if self._file is None:
+            self._file = self._path.open("a", encoding="utf-8")
+
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        self._file.write(line)
+        self._file.flush()
+        self._pending += 1
+
+        if (
+            self._pending >= self._sync_every
+            or time.monotonic() - self._last_sync >= self._sync_interval
+        ):
+            self.sync()
+
+        return len(line)
+
+    def sync(self) -> None:
+        """Force the appended records to disk."""
+        if self._file is not None and self._pending:
+            os.fsync(self._file.fileno())
+
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def replay(self) -> Iterator[Dict[str, Any]]:
+        """Read the records of the journal.
+
+        A partially written last record, left by a crash, is discarded and
+        removed from the file.
+
+        :returns: an iterator over the records.
+
+        """
+        if not self._path.exists():
+            return
+
+        valid_size = 0
+
+        for record, valid_size in read_records(self._path):
+            yield record
+
+        if valid_size != self._path.stat().st_size:
+            self.close()
+            os.truncate(self._path, valid_size)
+
+    def archive(self, archive_path: Path) -> None:
+        """Move every record of the journal to the end of another file.
+
+        :param archive_path: file where the records are appended.
+
+        """
+        self.close()
+
+        if not self._path.exists() or not self._path.stat().st_size:
+            return
+
+        with self._path.open("rb") as journal_file, archive_path.open(
+            "a+b"
+        ) as archive_file:
+            _drop_partial_line(archive_file)
+            shutil.copyfileobj(journal_file, archive_file)
+            archive_file.flush()
+            os.fsync(archive_file.fileno())
+
+        os.truncate(self._path, 0)
+
+    def truncate(self) -> None:
+        """Remove every record from the journal."""
+        self.close()
+
+        if self._path.exists():
+            os.truncate(self._path, 0)
+
+    def close(self) -> None:
+        """Sync and close the journal file."""
+        if self._file is None:
+            return
+
+        self.sync()
+        self._file.close()
+        self._file = None
+
+
+def read_records(path: Path) -> Iterator[Tuple[Dict[str, Any], int]]:
+    """Read the records of a journal file without modifying it.
+
+    The reading stops at the first partially written record.
+
+    :param path: the journal file.
+    :returns: an iterator over the records and the file offset after them.
+
+    """
+    if not path.exists():
+        return
+
+    offset = 0
+
+    with path.open("rb") as journal_file:
+        for line in journal_file:
+            if not line.endswith(b"\n"):
+                return
+
+            try:
+                record = json.loads(line)
+            except ValueError:
+                return
+
+            offset += len(line)
+            yield record, offset
+
+
+def _drop_partial_line(open_file: BinaryIO) -> None:
+    """Remove a partially written record from the end of a file.
+
+    :param open_file: the file, open for reading and writing.
+
+    """
+    end = open_file.seek(0, os.SEEK_END)
+    position = end
+
+    while position > 0:
+        start = max(position - 4096, 0)
+        open_file.seek(start)
+        newline = open_file.read(position - start).rfind(b"\n")
+
+        if newline != -1:
+            position = start + newline + 1
+            break
+
+        position = start
+
+    if position != end:
+        open_file.truncate(position)
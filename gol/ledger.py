@@ -0,0 +1,159 @@
+# Copyright (c) 2021 Luis Liñán Villafranca. All rights reserved.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>
+"""Compact ledger for the shared normal push-ups."""
+import sys
+
+from typing import Any, Dict, List, Union
+
+from gol.error import WrongCounterFileFormatError
+
+
+class NormalsLedger:
+    """Keep the shared normal push-ups as a single (holder, count) run.
+
+    Only one of the participants can owe normal push-ups at any given time, so
+    instead of storing one identificator per block, the ledger keeps who owes
+    them and how many. Adding, cancelling and completing blocks is O(1).
+
+    :ivar _holder: identification of the participant owing the push-ups.
+    :ivar _count: number of pending push-up blocks.
+
+    """
+
+    __slots__ = ("_holder", "_count")
+
+    def __init__(self, holder: str = "", count: int = 0) -> None:
+        """Build a new ledger.
+
+        :param holder: identification of the participant owing the push-ups.
+        :param count: number of pending push-up blocks.
+
+        """
+        self._holder: str = holder if count > 0 else ""
+        self._count: int = max(count, 0)
+
+    @property
+    def holder(self) -> str:
+        """Variable ``_holder`` getter.
+
+        :returns: the ``_holder`` value.
+
+        """
+        return self._holder
+
+    @property
+    def count(self) -> int:
+        """Variable ``_count`` getter.
+
+        :returns: the ``_count`` value.
+
+        """
+        return self._count
+
+    def owed_by(self, participant_id: str) -> int:
+        """Get the number of blocks owed by a participant.
+
+        :param participant_id: identification of the participant.
+        :returns: the pending blocks for the participant, 0 if the other one
+            is the holder.
+
+        """
+        return self._count if self._holder == participant_id else 0
+
+    def add(self, participant_id: str, number: int) -> None:
+        """Add push-up blocks to a participant, cancelling the other's first.
+
+        :param participant_id: identification of the participant.
+        :param number: number of blocks to add.
+
+        """
+        if not self._count or self._holder == participant_id:
+            self._holder = participant_id
+            self._count += number
+        elif self._count > number:
+            self._count -= number
+        else:
+            self._holder = participant_id
+            self._count = number - self._count
+
+        if not self._count:
+            self._holder = ""
+
+    def remove(self, participant_id: str, number: int) -> None:
+        """Remove push-up blocks owed by a participant.
+
+        :param participant_id: identification of the participant.
+        :param number: number of blocks to remove.
+
+        """
+        if self._holder != participant_id:
+            return
+
+        self._count = max(self._count - number, 0)
+
+        if not self._count:
+            self._holder = ""
+
+    def reset(self, holder: str = "", count: int = 0) -> None:
+        """Replace the ledger contents.
+
+        :param holder: identification of the participant owing the push-ups.
+        :param count: number of pending push-up blocks.
+
+        """
+        self._holder = holder if count > 0 else ""
+        self._count = max(count, 0)
+
+    def to_json(self) -> Dict[str, Any]:
+        """Serialize the ledger.
+
+        :returns: a JSON serializable dictionary.
+
+        """
+        return {"holder": self._holder, "count": self._count}
+
+    @classmethod
+    def from_json(
+        cls, serialized: Union[Dict[str, Any], List[str]]
+    ) -> "NormalsLedger":
+        """Deserialize a ledger.
+
+        The old format, a list with one identificator per block, is also
+        accepted. In that case the holder is the last element of the list, as
+        it was the one checked when computing the pending normals.
+
+        :param serialized: the serialized ledger.
+        :returns: the new ledger.
+
+        """
+        if isinstance(serialized, list):
+            holder = str(serialized[-1]) if serialized else ""
+
+            return cls(sys.intern(holder), len(serialized))
+
+        try:
+            return cls(
+                sys.intern(str(serialized["holder"])), int(serialized["count"])
+            )
+        except (KeyError, TypeError, ValueError) as error:
+            raise WrongCounterFileFormatError(
+                f"The normals entry is not valid: {error}"
+            )
+
+    def __len__(self) -> int:
+        """Get the number of pending blocks.
+
+        :returns: the pending blocks.
+
+        """
+        return self._count
+
+    def __repr__(self) -> str:
+        """Return the representation of the object.
+
+        :returns: the representation.
+
+        """
+        return f"NormalsLedger({self._holder!r}, {self._count!r})"
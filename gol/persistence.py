@@ -0,0 +1,171 @@
+# Copyright (c) 2021 Luis Liñán Villafranca. All rights reserved.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>
+"""Background persistence of the counters."""
+import logging
+import threading
+import time
+
+from typing import TYPE_CHECKING, Optional, Set
+
+from gol.settings import JOURNAL_SYNC_INTERVAL
+
+if TYPE_CHECKING:
+    from gol.checkpoint import UpdateCheckpoint
+    from gol.counter import PushUpsCounter
+
+logger = logging.getLogger(__name__)
+
+
+class PersistenceWorker:
+    """Save the changed counters from a background thread.
+
+    Counters are marked as dirty when they change and saved together every
+    ``interval`` seconds, or as soon as ``threshold`` counters are dirty. A
+    burst of changes in one counter ends up in a single write. Between two
+    flushes the journals of the dirty counters are synced every
+    ``sync_interval`` seconds, as their appends only sync them when another
+    record arrives.
+
+    The update checkpoint, if any, is saved after every flush where all the
+    counters were saved, with the position it had before the flush started.
+
+    :ivar _interval: maximum seconds between two flushes.
+    :ivar _threshold: number of dirty counters that triggers a flush.
+    :ivar _checkpoint: checkpoint of the processed updates, if any.
+    :ivar _sync_interval: maximum seconds between two syncs of the journals.
+    :ivar _dirty: counters changed since the last flush.
+    :ivar _condition: condition protecting the dirty counters and used to
+        wake the thread up.
+    :ivar _stopped: whether the worker was asked to stop.
+    :ivar _thread: the background thread.
+
+    """
+
+    def __init__(
+        self,
+        interval: float = 5.0,
+        threshold: int = 64,
+        checkpoint: Optional["UpdateCheckpoint"] = None,
+        sync_interval: float = JOURNAL_SYNC_INTERVAL,
+    ) -> None:
+        """Instantiate the class.
+
+        :param interval: maximum seconds between two flushes.
+        :param threshold: number of dirty counters that triggers a flush.
+        :param checkpoint: checkpoint of the processed updates.
+        :param sync_interval: maximum seconds between two syncs of the
+            journals.
+
+        """
+        self._interval: float = interval
+        self._threshold: int = threshold
+        self._checkpoint: Optional["UpdateCheckpoint"] = checkpoint
+        self._sync_interval: float = sync_interval
+        self._dirty: Set["PushUpsCounter"] = set()
+        self._condition = threading.Condition()
+        self._stopped: bool = False
+        self._thread = threading.Thread(
+            target=self._run, name="gol-persistence", daemon=True
+        )
+
+    def start(self) -> None:
+        """Start the background thread."""
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread and flush the dirty counters."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+        if self._thread.is_alive():
+            self._thread.join()
+
+        self.flush()
+
+    def mark_dirty(self, counter: "PushUpsCounter") -> None:
+        """Schedule the save of a counter.
+
+        :param counter: the changed counter.
+
+        """
+        with self._condition:
+            self._dirty.add(counter)
+
+            if len(self._dirty) >= self._threshold:
+                self._condition.notify()
+
+    def discard(self, counter: "PushUpsCounter") -> None:
+        """Cancel the scheduled save of a counter.
+
+        :param counter: the counter saved by other means.
+
+        """
+        with self._condition:
+            self._dirty.discard(counter)
+
+    def flush(self) -> None:
+        """Save every dirty counter now, and then the update checkpoint."""
+        # The counters changed by the updates up to the position are dirty
+        position = None
+        saved = True
+
+        if self._checkpoint is not None:
+            position = self._checkpoint.position()
+
+        with self._condition:
+            dirty = self._dirty
+            self._dirty = set()
+
+        for counter in dirty:
+            try:
+                counter.save_count()
+            except OSError as error:
+                logger.error("Couldn't save a counter: %s", error)
+                self.mark_dirty(counter)
+                saved = False
+
+        if saved and position is not None:
+            try:
+                self._checkpoint.save(position)
+            except OSError as error:
+                logger.error("Couldn't save the update checkpoint: %s", error)
+
+    def sync(self) -> None:
+        """Force the journal records of every dirty counter to disk."""
+        with self._condition:
+            dirty = list(self._dirty)
+
+        for counter in dirty:
+            try:
+                counter.sync()
+            except OSError as error:
+                logger.error("Couldn't sync a counter journal: %s", error)
+
+    def _run(self) -> None:
+        """Flush the dirty counters until the worker is stopped."""
+        deadline = time.monotonic() + self._interval
+
+        while True:
+            with self._condition:
+                wait = deadline - time.monotonic()
+
+                if (
+                    not self._stopped
+                    and len(self._dirty) < self._threshold
+                    and wait > 0
+                ):
+                    self._condition.wait(min(wait, self._sync_interval))
+
+                if self._stopped:
+                    return
+
+                full = len(self._dirty) >= self._threshold
+
+            if full or time.monotonic() >= deadline:
+                self.flush()
+                deadline = time.monotonic() + self._interval
+            else:
+                self.sync()
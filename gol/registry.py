@@ -0,0 +1,425 @@
+# Copyright (c) 2021 Luis Liñán Villafranca. All rights reserved.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>
+"""Registry with one push-ups counter per chat."""
+import logging
+import threading
+import time
+
+from collections import OrderedDict
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from gol.counter import PushUpsCounter
+from gol.error import WrongCounterFileFormatError
+from gol.persistence import PersistenceWorker
+from gol.store import CounterStore
+
+logger = logging.getLogger(__name__)
+
+Unloaded = List[Tuple[int, PushUpsCounter]]
+
+
+class CounterRegistry:
+    """Keep the counters of the most recently used chats in memory.
+
+    Counters are loaded from the store the first time their chat is accessed.
+    When there are more than ``capacity`` counters loaded, or a counter has
+    not been accessed in ``max_idle`` seconds, it is saved and evicted.
+    Changed counters are saved in the background by the persistence worker,
+    if any.
+
+    The counters of the pinned chats, like the ones being used by a handler,
+    are never evicted, so a chat never has two live counters. The counters
+    are loaded, saved and closed without holding the registry lock, so the
+    disk access of a chat doesn't block the rest, and a chat can't be loaded
+    while its counter is being saved and closed.
+
+    Bulk changes of the stored snapshots, like the weekend resets, are done
+    without loading the counters. Their chats can't be loaded meanwhile, and
+    counters whose load overlapped one of them are loaded again.
+
+    :ivar _store: store where the counters of every chat are persisted.
+    :ivar _persistence: worker saving the changed counters.
+    :ivar _capacity: maximum number of counters kept in memory.
+    :ivar _max_idle: seconds a counter can stay unused in memory.
+    :ivar _counters: loaded counters and their last access time, ordered from
+        the least to the most recently used.
+    :ivar _pins: number of pins of every pinned chat.
+    :ivar _unloading: chats whose counter is being saved and closed.
+    :ivar _resetting: chats whose stored snapshot is being rewritten.
+    :ivar _resets: number of bulk rewrites started.
+    :ivar _lock: lock protecting the loaded counters.
+    :ivar _settled: condition notified when an unload or a bulk rewrite
+        finishes.
+
+    """
+
+    def __init__(
+        self,
+        store: CounterStore,
+        capacity: int = 1024,
+        max_idle: Optional[float] = None,
+        persistence: Optional[PersistenceWorker] = None,
+    ) -> None:
+        """Instantiate the class.
+
+        :param store: store where the counters of every chat are persisted.
+        :param capacity: maximum number of counters kept in memory.
+        :param max_idle: seconds a counter can stay unused in memory. If not
+            provided, counters are only evicted when the capacity is reached.
+        :param persistence: worker saving the changed counters. If not
+            provided, counters save themselves periodically.
+
+        """
+        if capacity <= 0:
+            raise ValueError("The registry capacity must be positive")
+
+        self._store: CounterStore = store
+        self._persistence: Optional[PersistenceWorker] = persistence
+        self._capacity: int = capacity
+        self._max_idle: Optional[float] = max_idle
+        self._counters: "OrderedDict[int, Tuple[PushUpsCounter, float]]" = (
+            OrderedDict()
+        )
+        self._pins: Dict[int, int] = {}
+        self._unloading: Set[int] = set()
+        self._resetting: Set[int] = set()
+        self._resets: int = 0
+        self._lock = threading.Lock()
+        self._settled = threading.Condition(self._lock)
+
+    def get(self, chat_id: int) -> PushUpsCounter:
+        """Obtain the counter of a chat, loading it if needed.
+
+        :param chat_id: identification of the chat.
+        :returns: the chat counter.
+
+        """
+        while True:
+            with self._lock:
+                while chat_id in self._unloading or chat_id in self._resetting:
+                    self._settled.wait()
+
+                if chat_id in self._counters:
+                    counter, _ = self._counters.pop(chat_id)
+                    evicted = self._touch(chat_id, counter)
+                    break
+
+                resets = self._resets
+
+            # Load outside the lock, so a slow load doesn't block other chats
+            loaded = self._load(chat_id)
+
+            with self._lock:
+                if chat_id in self._counters:
+                    counter, _ = self._counters.pop(chat_id)
+                    evicted = self._touch(chat_id, counter)
+                    break
+
+                if resets == self._resets:
+                    counter = loaded
+                    evicted = self._touch(chat_id, counter)
+                    break
+
+            # The snapshot may have been rewritten while it was read
+            loaded.close()
+
+        self._unload_all(evicted)
+
+        return counter
+
+    def pin(self, chat_id: int) -> None:
+        """Keep the counter of a chat loaded until it is unpinned.
+
+        The chat doesn't need to be loaded yet. Every pin must be followed by
+        an unpin.
+
+        :param chat_id: identification of the chat.
+
+        """
+        with self._lock:
+            self._pins[chat_id] = self._pins.get(chat_id, 0) + 1
+
+    def unpin(self, chat_id: int) -> None:
+        """Release a pin of a chat, evicting the counters left over.
+
+        :param chat_id: identification of the chat.
+
+        """
+        with self._lock:
+            pins = self._pins.pop(chat_id) - 1
+
+            if pins:
+                self._pins[chat_id] = pins
+
+            evicted = self._evict(time.monotonic())
+
+        self._unload_all(evicted)
+
+    def snapshots(
+        self, include: Optional[Callable[[int], bool]] = None
+    ) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """Read the snapshot of every configured counter, loaded or stored.
+
+        The loaded counters are serialized from memory, so their changes not
+        saved yet are included, and the rest are read from the store.
+
+        :param include: function telling if the snapshot of a chat, given its
+            identification, is read. Every snapshot is read if not provided.
+        :returns: an iterator over the chat identifications and snapshots.
+
+        """
+        with self._lock:
+            loaded = {
+                chat_id: counter
+                for chat_id, (counter, _) in self._counters.items()
+                if include is None or include(chat_id)
+            }
+
+        for chat_id, counter in loaded.items():
+            if counter.is_configured():
+                yield chat_id, counter.snapshot()
+
+        for chat_id, snapshot in self._store.snapshots(include):
+            if chat_id not in loaded:
+                yield chat_id, snapshot
+
+    def reset_weekend(self, chat_ids: Iterable[int]) -> int:
+        """Clear the weekend flags of several chat counters.
+
+        The loaded counters are pinned, changed and saved, and the stored
+        ones are rewritten in bulk by the store, without loading them.
+
+        :param chat_ids: identification of the chats.
+        :returns: the number of chats that had a flag set.
+
+        """
+        chat_ids = list(chat_ids)
+
+        with self._lock:
+            # A snapshot being saved by an unload can't be rewritten meanwhile
+            while not self._unloading.isdisjoint(chat_ids):
+                self._settled.wait()
+
+            loaded = []
+            stored = []
+
+            for chat_id in chat_ids:
+                if chat_id in self._counters:
+                    self._pins[chat_id] = self._pins.get(chat_id, 0) + 1
+                    loaded.append((chat_id, self._counters[chat_id][0]))
+                else:
+                    stored.append(chat_id)
+
+            self._resetting.update(stored)
+            self._resets += 1
+
+        reset = 0
+
+        try:
+            for chat_id, counter in loaded:
+                try:
+                    reset += counter.reset_weekend()
+                finally:
+                    self.unpin(chat_id)
+
+            reset += self._store.reset_weekend(stored)
+        finally:
+            with self._lock:
+                self._resetting.difference_update(stored)
+                self._settled.notify_all()
+
+        return reset
+
+    def flush(self) -> None:
+        """Save every loaded counter with changes."""
+        with self._lock:
+            loaded = list(self._counters.items())
+
+            for chat_id, _ in loaded:
+                self._pins[chat_id] = self._pins.get(chat_id, 0) + 1
+
+        for chat_id, (counter, _) in loaded:
+            try:
+                self._save(counter)
+            finally:
+                self.unpin(chat_id)
+
+    def release(self, keep: Callable[[int], bool]) -> int:
+        """Save and unload the counters of the chats that are not kept.
+
+        :param keep: function telling if the counter of a chat, given its
+            identification, stays loaded.
+        :returns: the number of unloaded counters.
+
+        """
+        with self._lock:
+            released = [
+                (chat_id, self._counters.pop(chat_id)[0])
+                for chat_id in list(self._counters)
+                if not keep(chat_id)
+            ]
+            self._unloading.update(chat_id for chat_id, _ in released)
+
+        self._unload_all(released)
+
+        return len(released)
+
+    def close(self) -> None:
+        """Save and unload every counter and close the store."""
+        with self._lock:
+            closed = [
+                (chat_id, counter)
+                for chat_id, (counter, _) in self._counters.items()
+            ]
+            self._counters.clear()
+            self._unloading.update(chat_id for chat_id, _ in closed)
+
+        try:
+            self._unload_all(closed)
+        finally:
+            self._store.close()
+
+    def _touch(self, chat_id: int, counter: PushUpsCounter) -> Unloaded:
+        """Mark a counter as the most recently used one.
+
+        .. note:: The registry lock must be held.
+
+        :param chat_id: identification of the chat.
+        :param counter: the chat counter.
+        :returns: the evicted counters, to unload without the lock.
+
+        """
+        now = time.monotonic()
+        self._counters[chat_id] = (counter, now)
+
+        return self._evict(now)
+
+    def _load(self, chat_id: int) -> PushUpsCounter:
+        """Load the counter of a chat from the store.
+
+        :param chat_id: identification of the chat.
+        :returns: the chat counter, not configured if it was never saved.
+
+        """
+        counter = PushUpsCounter(
+            chat_id,
+            self._store,
+            on_change=(
+                self._persistence.mark_dirty if self._persistence else None
+            ),
+        )
+
+        try:
+            counter.load_count()
+        except WrongCounterFileFormatError as error:
+            logger.error("Couldn't load the chat %s: %s", chat_id, error)
+
+        return counter
+
+    def _evict(self, now: float) -> Unloaded:
+        """Remove the least recently used and the idle counters not pinned.
+
+        The most recently used counter is never removed, as it is the one
+        just obtained.
+
+        .. note:: The registry lock must be held.
+
+        :param now: current monotonic time.
+        :returns: the evicted counters, to unload without the lock.
+
+        """
+        excess = len(self._counters) - self._capacity
+        newest = next(reversed(self._counters), None)
+        evicted = []
+
+        for chat_id, (counter, last_access) in self._counters.items():
+            if chat_id == newest or (
+                excess <= 0
+                and (
+                    self._max_idle is None
+                    or now - last_access < self._max_idle
+                )
+            ):
+                break
+
+            if chat_id not in self._pins:
+                evicted.append((chat_id, counter))
+                excess -= 1
+
+        for chat_id, _ in evicted:
+            del self._counters[chat_id]
+            self._unloading.add(chat_id)
+
+        return evicted
+
+    def _unload_all(self, unloaded: Unloaded) -> None:
+        """Save and close counters removed from memory.
+
+        Their chats can be loaded again once done.
+
+        :param unloaded: the chats and counters removed.
+
+        """
+        if not unloaded:
+            return
+
+        try:
+            for _, counter in unloaded:
+                self._unload(counter)
+        finally:
+            with self._lock:
+                self._unloading.difference_update(
+                    chat_id for chat_id, _ in unloaded
+                )
+                self._settled.notify_all()
+
+    def _unload(self, counter: PushUpsCounter) -> None:
+        """Save a counter before removing it from memory.
+
+        :param counter: the counter to unload.
+
+        """
+        if self._persistence is not None:
+            self._persistence.discard(counter)
+
+        self._save(counter)
+        counter.close()
+
+    @staticmethod
+    def _save(counter: PushUpsCounter) -> None:
+        """Save a counter if it is configured and has changes.
+
+        :param counter: the counter to save.
+
+        """
+        if counter.is_configured() and counter.is_dirty():
+            counter.save_count()
+
+    def __getitem__(self, chat_id: int) -> PushUpsCounter:
+        """Obtain the counter of a chat, loading it if needed.
+
+        :param chat_id: identification of the chat.
+        :returns: the chat counter.
+
+        """
+        return self.get(chat_id)
+
+    def __len__(self) -> int:
+        """Get the number of loaded counters.
+
+        :returns: the loaded counters.
+
+        """
+        return len(self._counters)
@@ -0,0 +1,216 @@
+# Copyright (c) 2021 Luis Liñán Villafranca. All rights reserved.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>
+"""Rulesets deciding who has to do the push-ups."""
+import json
+
+from enum import IntEnum
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from gol.error import RulesetNotFound, WrongRulesetFormatError
+
+
+class DayClass(IntEnum):
+    """Kind of day an event happens in."""
+
+    WEEKDAY = 0
+    WEEKEND = 1
+
+
+class Case(IntEnum):
+    """Kind of event, from the point of view of the participant causing it."""
+
+    PUSH_SELF = 0
+    PUSH_OTHER = 1
+    ERROR = 2
+    VOICE = 3
+    VOICE_RIP = 4
+
+
+class Beneficiary(IntEnum):
+    """Participant receiving the push-ups of a rule."""
+
+    ACTOR = 0
+    OPPOSITE = 1
+
+
+Outcome = Tuple[Beneficiary, int]
+
+NO_PUSHUPS: Outcome = (Beneficiary.ACTOR, 0)
+DEFAULT_RULES: Dict[str, Dict[str, List[Any]]] = {
+    "weekday": {
+        "push_self": ["opposite", 1],
+        "push_other": ["actor", 1],
+        "error": ["actor", 2],
+    },
+    "weekend": {
+        "push_self": ["actor", 1],
+        "push_other": ["actor", 2],
+        "error": ["actor", 4],
+        "voice_rip": ["opposite", 2],
+    },
+}
+
+
+class Ruleset:
+    """Rules compiled into a lookup table by day class and case.
+
+    The rules are given as a dictionary with the ``weekday`` and ``weekend``
+    day classes, each one mapping the case names (``push_self``,
+    ``push_other``, ``error``, ``voice`` and ``voice_rip``) to the
+    beneficiary (``actor`` or ``opposite``) and the number of push-up blocks.
+    Missing cases give no push-ups.
+
+    :ivar _name: name of the ruleset.
+    :ivar _rules: the rules the ruleset was compiled from.
+    :ivar _table: outcomes indexed by day class and case.
+
+    """
+
+    def __init__(self, name: str, rules: Dict[str, Dict[str, List[Any]]]):
+        """Compile a ruleset.
+
+        :param name: name of the ruleset.
+        :param rules: the rules to compile.
+
+        """
+        self._name: str = name
+        self._rules: Dict[str, Dict[str, List[Any]]] = rules
+        self._table: Tuple[Tuple[Outcome, ...], ...] = self._compile(rules)
+
+    @property
+    def name(self) -> str:
+        """Variable ``_name`` getter.
+
+        :returns: the ``_name`` value.
+
+        """
+        return self._name
+
+    @property
+    def rules(self) -> Dict[str, Dict[str, List[Any]]]:
+        """Variable ``_rules`` getter.
+
+        :returns: the ``_rules`` value.
+
+        """
+        return self._rules
+
+    def outcome(self, day_class: DayClass, case: Case) -> Outcome:
+        """Look up the outcome of an event.
+
+        :param day_class: kind of day the event happens in.
+        :param case: kind of event.
+        :returns: who receives the push-ups and the number of blocks.
+
+        """
+        return self._table[day_class][case]
+
+    @staticmethod
+    def _compile(
+        rules: Dict[str, Dict[str, List[Any]]]
+    ) -> Tuple[Tuple[Outcome, ...], ...]:
+        """Build the lookup table of a ruleset.
+
+        :param rules: the rules to compile.
+        :returns: the outcomes indexed by day class and case.
+
+        """
+        if not isinstance(rules, dict) or not all(
+            isinstance(day_rules, dict) for day_rules in rules.values()
+        ):
+            raise WrongRulesetFormatError("The rules must be an object")
+
+        unknown_days = set(rules).difference(
+            day_class.name.lower() for day_class in DayClass
+        )
+
+        if unknown_days:
+            raise WrongRulesetFormatError(
+                f"Unknown day classes: {', '.join(sorted(unknown_days))}"
+            )
+
+        table = []
+
+        for day_class in DayClass:
+            day_rules = dict(rules.get(day_class.name.lower(), {}))
+            outcomes = []
+
+            for case in Case:
+                rule = day_rules.pop(case.name.lower(), None)
+
+                if rule is None:
+                    outcomes.append(NO_PUSHUPS)
+                    continue
+
+                try:
+                    beneficiary, blocks = rule
+                    outcomes.append(
+                        (Beneficiary[beneficiary.upper()], int(blocks))
+                    )
+                except (AttributeError, KeyError, TypeError, ValueError):
+                    raise WrongRulesetFormatError(
+                        f"Wrong rule for {case.name.lower()}: {rule!r}"
+                    )
+
+                if outcomes[-1][1] < 0:
+                    raise WrongRulesetFormatError(
+                        "The number of push-up blocks can't be negative"
+                    )
+
+            if day_rules:
+                raise WrongRulesetFormatError(
+                    f"Unknown cases: {', '.join(sorted(day_rules))}"
+                )
+
+            table.append(tuple(outcomes))
+
+        return tuple(table)
+
+
+DEFAULT_RULESET = Ruleset("default", DEFAULT_RULES)
+RULESETS: Dict[str, Ruleset] = {DEFAULT_RULESET.name: DEFAULT_RULESET}
+
+
+def get_ruleset(name: Optional[str] = None) -> Ruleset:
+    """Obtain a registered ruleset.
+
+    :param name: name of the ruleset. The default one if not provided.
+    :returns: the ruleset.
+
+    """
+    if not name:
+        return DEFAULT_RULESET
+
+    try:
+        return RULESETS[name]
+    except KeyError:
+        raise RulesetNotFound(f"Couldn't find the ruleset {name}")
+
+
+def load_rulesets(rules_file: Path) -> List[Ruleset]:
+    """Compile and register the rulesets of a JSON file.
+
+    The file contains an object mapping the ruleset names to their rules.
+
+    :param rules_file: the JSON file.
+    :returns: the loaded rulesets.
+
+    """
+    try:
+        with rules_file.open("r") as rules_fd:
+            serialized = json.load(rules_fd)
+    except ValueError as error:
+        raise WrongRulesetFormatError(
+            f"There was an error reading the rules file: {error}"
+        )
+
+    if not isinstance(serialized, dict):
+        raise WrongRulesetFormatError("The rules file must contain an object")
+
+    rulesets = [Ruleset(name, rules) for name, rules in serialized.items()]
+    RULESETS.update((ruleset.name, ruleset) for ruleset in rulesets)
+
+    return rulesets
@@ -2,11 +2,22 @@
 #
 # This work is licensed under the terms of the MIT license.
 # For a copy, see <https://opensource.org/licenses/MIT>
-"""Common globals and settings for the :mod:`gol` module."""
+"""Common globals and settings for the :mod:`gol` module.
+
+The data directory can be changed with the ``GOL_DATA_DIR`` environment
+variable. It is not created until something is saved in it.
+
+"""
+import os
+
 from pathlib import Path
 
 CURRENT_DIR = Path(__file__).resolve().parent
-SAVE_DIR = CURRENT_DIR / "data"
-SAVE_DIR.mkdir(exist_ok=True)
-SAVE_FILE = SAVE_DIR / "push_ups_save.json"
-SAVE_FILE.touch(exist_ok=True)
+SAVE_DIR = Path(os.environ.get("GOL_DATA_DIR") or CURRENT_DIR / "data")
+CHATS_DIR = SAVE_DIR / "chats"
+SQLITE_FILE = SAVE_DIR / "gol.sqlite3"
+LEGACY_SAVE_FILE = SAVE_DIR / "push_ups_save.json"
+JOURNAL_SYNC_EVERY = 32
+JOURNAL_SYNC_INTERVAL = 1.0
+JOURNAL_COMPACT_EVERY = 1000
+RECENT_UPDATES = 64
@@ -0,0 +1,407 @@
+# Copyright (c) 2021 Luis Liñán Villafranca. All rights reserved.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>
+"""Compact binary format for the counter snapshots.
+
+A snapshot file keeps the snapshots of many chats::
+
+    header | record | record | ... | index
+
+The fixed-size header has the format version, the number of records and the
+offset of the index. The index has one fixed-size entry per chat, sorted by
+chat identification, with the offset and size of its record. Every record
+packs the fixed-size fields of a counter first, followed by its
+length-prefixed strings.
+
+The file is memory mapped, so opening it only reads the header, whatever the
+number of chats, and a record is only decoded when its chat is loaded.
+
+"""
+import json
+import mmap
+import os
+import struct
+
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from gol.error import WrongCounterFileFormatError
+
+MAGIC = b"GOLS"
+VERSION = 1
+HEADER = struct.Struct("<4sHHQQ")
+INDEX_ENTRY = struct.Struct("<qQI")
+RECORD = struct.Struct("<QIBB")
+PARTICIPANT = struct.Struct("<IB")
+STRING = struct.Struct("<H")
+NO_HOLDER = 0xFF
+RECORD_KEYS = ("participants", "normals", "seq", "ruleset", "timezone")
+
+
+def pack_record(snapshot: Dict[str, Any]) -> bytes:
+    """Serialize a counter snapshot as a binary record.
+
+    Entries of the snapshot without a field of their own are kept as JSON at
+    the end of the record.
+
+    :param snapshot: the counter snapshot.
+    :returns: the packed record.
+
+    """
+    participants = snapshot["participants"]
+    normals = snapshot["normals"]
+    ids = [participant["id"] for participant in participants]
+
+    if not normals["count"]:
+        holder = NO_HOLDER
+    elif normals["holder"] in ids:
+        holder = ids.index(normals["holder"])
+    else:
+        raise WrongCounterFileFormatError(
+            "The normals holder does not match with the provided id's"
+        )
+
+    extra = {
+        key: value
+        for key, value in snapshot.items()
+        if key not in RECORD_KEYS
+    }
+
+    try:
+        parts = [
+            RECORD.pack(
+                snapshot["seq"], normals["count"], holder, len(participants)
+            )
+        ]
+
+        for participant in participants:
+            parts.append(
+                PARTICIPANT.pack(
+                    participant["punishments"], int(participant["rip_wknd"])
+                )
+            )
+            parts.append(_pack_string(participant["id"]))
+            parts.append(_pack_string(participant["name"]))
+
+        parts.append(_pack_string(snapshot.get("ruleset") or ""))
+        parts.append(_pack_string(snapshot.get("timezone") or ""))
+        parts.append(
+            _pack_string(
+                json.dumps(extra, separators=(",", ":")) if extra else ""
+            )
+        )
+    except struct.error as error:
+        raise WrongCounterFileFormatError(
+            f"The snapshot can't be packed: {error}"
+        )
+
+    return b"".join(parts)
+
+
+def unpack_record(buffer: Any, offset: int = 0) -> Dict[str, Any]:
+    """Deserialize a binary record into a counter snapshot.
+
+    :param buffer: bytes-like object containing the record.
+    :param offset: position of the record in the buffer.
+    :returns: the counter snapshot.
+
+    """
+    try:
+        seq, count, holder, n_participants = RECORD.unpack_from(
+            buffer, offset
+        )
+        offset += RECORD.size
+        participants = []
+
+        for _ in range(n_participants):
+            punishments, rip_wknd = PARTICIPANT.unpack_from(buffer, offset)
+            participant_id, offset = _unpack_string(
+                buffer, offset + PARTICIPANT.size
+            )
+            name, offset = _unpack_string(buffer, offset)
+            participants.append(
+                {
+                    "id": participant_id,
+                    "name": name,
+                    "punishments": punishments,
+                    "rip_wknd": bool(rip_wknd),
+                }
+            )
+
+        ruleset, offset = _unpack_string(buffer, offset)
+        timezone, offset = _unpack_string(buffer, offset)
+        extra, offset = _unpack_string(buffer, offset)
+        holder_id = "" if holder == NO_HOLDER else participants[holder]["id"]
+
+        return {
+            **(json.loads(extra) if extra else {}),
+            "participants": participants,
+            "normals": {"holder": holder_id, "count": count},
+            "seq": seq,
+            "ruleset": ruleset or None,
+            "timezone": timezone or None,
+        }
+    except (struct.error, IndexError, UnicodeDecodeError, ValueError) as error:
+        raise WrongCounterFileFormatError(
+            f"The snapshot record is not valid: {error}"
+        )
+
+
+def write_snapshot_file(
+    path: Path, records: Iterable[Tuple[int, bytes]]
+) -> int:
+    """Replace a snapshot file atomically.
+
+    The records are written as they are read, only keeping the index in
+    memory, then the file is synced to disk and moved over the destination.
+
+    :param path: file to write.
+    :param records: chat identifications and their packed records. Every
+        chat must appear only once.
+    :returns: the number of bytes written.
+
+    """
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    index: List[Tuple[int, int, int]] = []
+
+    with tmp_path.open("wb") as tmp_file:
+        offset = tmp_file.write(HEADER.pack(MAGIC, VERSION, 0, 0, 0))
+
+        for chat_id, record in records:
+            index.append((chat_id, offset, len(record)))
+            offset += tmp_file.write(record)
+
+        index.sort()
+
+        for entry in index:
+            tmp_file.write(INDEX_ENTRY.pack(*entry))
+
+        size = tmp_file.tell()
+        tmp_file.seek(0)
+        tmp_file.write(HEADER.pack(MAGIC, VERSION, 0, len(index), offset))
+        tmp_file.flush()
+        os.fsync(tmp_file.fileno())
+
+    os.replace(tmp_path, path)
+
+    return size
+
+
+class SnapshotFile:
+    """Read the records of a snapshot file through a memory map.
+
+    A missing or empty file is read as a file without records.
+
+    :ivar _path: the snapshot file.
+    :ivar _map: memory map of the file, if it has any contents.
+    :ivar _entries: number of records in the file.
+    :ivar _index_offset: position of the index in the file.
+
+    """
+
+    def __init__(self, path: Path) -> None:
+        """Open a snapshot file.
+
+        :param path: the snapshot file.
+
+        """
+        self._path: Path = path
+        self._map: Optional[mmap.mmap] = None
+        self._entries: int = 0
+        self._index_offset: int = 0
+
+        try:
+            with path.open("rb") as snapshot_file:
+                if os.fstat(snapshot_file.fileno()).st_size:
+                    self._map = mmap.mmap(
+                        snapshot_file.fileno(), 0, access=mmap.ACCESS_READ
+                    )
+        except FileNotFoundError:
+            return
+
+        if self._map is not None:
+            self._read_header()
+
+    @property
+    def path(self) -> Path:
+        """Variable ``_path`` getter.
+
+        :returns: the ``_path`` value.
+
+        """
+        return self._path
+
+    def load(self, chat_id: int) -> Optional[Dict[str, Any]]:
+        """Decode the snapshot of a chat.
+
+        :param chat_id: identification of the chat.
+        :returns: the snapshot, or None if the file doesn't have it.
+
+        """
+        entry = self._find(chat_id)
+
+        if entry is None:
+            return None
+
+        return unpack_record(self._map, entry[0])
+
+    def raw(self, chat_id: int) -> Optional[bytes]:
+        """Get the packed record of a chat without decoding it.
+
+        :param chat_id: identification of the chat.
+        :returns: the record, or None if the file doesn't have it.
+
+        """
+        entry = self._find(chat_id)
+
+        if entry is None:
+            return None
+
+        offset, size = entry
+
+        return self._map[offset : offset + size]
+
+    def records(self) -> Iterator[Tuple[int, bytes]]:
+        """Read every packed record, in chat identification order.
+
+        :returns: an iterator over the chat identifications and records.
+
+        """
+        for position in range(self._entries):
+            chat_id, offset, size = self._entry(position)
+
+            yield chat_id, self._map[offset : offset + size]
+
+    def close(self) -> None:
+        """Unmap the file."""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+            self._entries = 0
+
+    def _read_header(self) -> None:
+        """Read and validate the file header."""
+        try:
+            magic, version, _, entries, index_offset = HEADER.unpack_from(
+                self._map
+            )
+        except struct.error as error:
+            raise WrongCounterFileFormatError(
+                f"The snapshot file {self._path} is not valid: {error}"
+            )
+
+        if magic != MAGIC:
+            raise WrongCounterFileFormatError(
+                f"The file {self._path} is not a snapshot file"
+            )
+
+        if version != VERSION:
+            raise WrongCounterFileFormatError(
+                f"Unsupported snapshot file version {version} in {self._path}"
+            )
+
+        if index_offset + entries * INDEX_ENTRY.size > len(self._map):
+            raise WrongCounterFileFormatError(
+                f"The snapshot file {self._path} is truncated"
+            )
+
+        self._entries = entries
+        self._index_offset = index_offset
+
+    def _entry(self, position: int) -> Tuple[int, int, int]:
+        """Read an index entry.
+
+        :param position: position of the entry in the index.
+        :returns: the chat identification, record offset and record size.
+
+        """
+        return INDEX_ENTRY.unpack_from(
+            self._map, self._index_offset + position * INDEX_ENTRY.size
+        )
+
+    def _find(self, chat_id: int) -> Optional[Tuple[int, int]]:
+        """Binary search a chat in the index.
+
+        :param chat_id: identification of the chat.
+        :returns: the record offset and size, or None if not found.
+
+        """
+        low, high = 0, self._entries
+
+        while low < high:
+            middle = (low + high) // 2
+            entry_id, offset, size = self._entry(middle)
+
+            if entry_id == chat_id:
+                return offset, size
+
+            if entry_id < chat_id:
+                low = middle + 1
+            else:
+                high = middle
+
+        return None
+
+    def __contains__(self, chat_id: int) -> bool:
+        """Check if the file has the snapshot of a chat.
+
+        :param chat_id: identification of the chat.
+        :returns: True if the chat is in the file.
+
+        """
+        return self._find(chat_id) is not None
+
+    def __len__(self) -> int:
+        """Get the number of records.
+
+        :returns: the records in the file.
+
+        """
+        return self._entries
+
+    def __enter__(self) -> "SnapshotFile":
+        """Use the file as a context manager.
+
+        :returns: the file itself.
+
+        """
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        """Unmap the file when leaving the context.
+
+        :param args: exception information, ignored.
+
+        """
+        self.close()
+
+
+def _pack_string(value: str) -> bytes:
+    """Serialize a length-prefixed UTF-8 string.
+
+    :param value: the string.
+    :returns: the packed string.
+
+    """
+    encoded = value.encode("utf-8")
+
+    return STRING.pack(len(encoded)) + encoded
+
+
+def _unpack_string(buffer: Any, offset: int) -> Tuple[str, int]:
+    """Deserialize a length-prefixed UTF-8 string.
+
+    :param buffer: bytes-like object containing the string.
+    :param offset: position of the string in the buffer.
+    :returns: the string and the position after it.
+
+    """
+    (length,) = STRING.unpack_from(buffer, offset)
+    start = offset + STRING.size
+    end = start + length
+
+    if end > len(buffer):
+        raise ValueError("string out of bounds")
+
+    return bytes(buffer[start:end]).decode("utf-8"), end
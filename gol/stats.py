@@ -0,0 +1,300 @@
+# Copyright (c) 2021 Luis Liñán Villafranca. All rights reserved.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>
+"""Incrementally maintained statistics of a push-ups counter."""
+import sys
+
+from typing import Any, Dict, Iterable, Tuple
+
+from gol.error import WrongCounterFileFormatError
+from gol.events import ErrorEvent, Event, VoiceEvent
+
+FIELDS = (
+    "added",
+    "completed",
+    "errors",
+    "voice",
+    "day",
+    "day_added",
+    "day_completed",
+    "day_errors",
+    "week",
+    "week_added",
+    "week_completed",
+    "week_errors",
+    "streak",
+    "best_streak",
+    "last_completed",
+)
+
+
+def week_number(day: int) -> int:
+    """Get the week of a day, with the weeks starting on monday.
+
+    :param day: the day ordinal, as in :meth:`date.toordinal`.
+    :returns: the week number.
+
+    """
+    return (day - 1) // 7
+
+
+class ParticipantStats:
+    """Aggregates of one participant, updated in O(1) on every event.
+
+    The daily and weekly totals are kept only for the last day and week with
+    events, and restart when a newer one begins. Events older than them only
+    count for the global totals.
+
+    :ivar added: push-up blocks the participant was given.
+    :ivar completed: push-up blocks the participant completed.
+    :ivar errors: errors reported by the participant.
+    :ivar voice: voice messages of the participant that gave push-ups.
+    :ivar day: ordinal of the last day with events.
+    :ivar day_added: blocks given during ``day``.
+    :ivar day_completed: blocks completed during ``day``.
+    :ivar day_errors: errors reported during ``day``.
+    :ivar week: number of the last week with events.
+    :ivar week_added: blocks given during ``week``.
+    :ivar week_completed: blocks completed during ``week``.
+    :ivar week_errors: errors reported during ``week``.
+    :ivar streak: consecutive days with completed blocks, up to
+        ``last_completed``.
+    :ivar best_streak: longest streak of the participant.
+    :ivar last_completed: ordinal of the last day with completed blocks.
+
+    """
+
+    __slots__ = FIELDS
+
+    def __init__(self, **values: int) -> None:
+        """Build the aggregates.
+
+        :param values: initial values of the aggregates, 0 if not provided.
+
+        """
+        self.added: int = 0
+        self.completed: int = 0
+        self.errors: int = 0
+        self.voice: int = 0
+        self.day: int = 0
+        self.day_added: int = 0
+        self.day_completed: int = 0
+        self.day_errors: int = 0
+        self.week: int = 0
+        self.week_added: int = 0
+        self.week_completed: int = 0
+        self.week_errors: int = 0
+        self.streak: int = 0
+        self.best_streak: int = 0
+        self.last_completed: int = 0
+
+        for field, value in values.items():
+            if field not in FIELDS:
+                raise ValueError(f"unknown aggregate {field}")
+
+            setattr(self, field, int(value))
+
+    def add(self, day: int, blocks: int) -> None:
+        """Count push-up blocks given to the participant.
+
+        :param day: ordinal of the day of the event.
+        :param blocks: number of blocks.
+
+        """
+        self.added += blocks
+
+        if self._roll(day):
+            self.day_added += blocks
+
+        if week_number(day) == self.week:
+            self.week_added += blocks
+
+    def complete(self, day: int, blocks: int) -> None:
+        """Count push-up blocks completed by the participant.
+
+        :param day: ordinal of the day of the event.
+        :param blocks: number of blocks.
+
+        """
+        self.completed += blocks
+
+        if self._roll(day):
+            self.day_completed += blocks
+
+        if week_number(day) == self.week:
+            self.week_completed += blocks
+
+        if day > self.last_completed:
+            if day - self.last_completed == 1:
+                self.streak += 1
+            else:
+                self.streak = 1
+
+            self.best_streak = max(self.best_streak, self.streak)
+            self.last_completed = day
+
+    def error(self, day: int) -> None:
+        """Count an error reported by the participant.
+
+        :param day: ordinal of the day of the event.
+
+        """
+        self.errors += 1
+
+        if self._roll(day):
+            self.day_errors += 1
+
+        if week_number(day) == self.week:
+            self.week_errors += 1
+
+    def view(self, today: int) -> Dict[str, int]:
+        """Get the aggregates as seen in a given day.
+
+        The daily and weekly totals of past days and weeks are reported as 0,
+        and so is a streak without completions since yesterday.
+
+        :param today: ordinal of the day.
+        :returns: the aggregates by name.
+
+        """
+        values = self.to_json()
+        same_day = self.day == today
+        same_week = self.week == week_number(today)
+
+        for field in ("added", "completed", "errors"):
+            values[f"day_{field}"] *= same_day
+            values[f"week_{field}"] *= same_week
+
+        if today - self.last_completed > 1:
+            values["streak"] = 0
+
+        return values
+
+    def to_json(self) -> Dict[str, int]:
+        """Serialize the aggregates.
+
+        :returns: a JSON serializable dictionary.
+
+        """
+        return {field: getattr(self, field) for field in FIELDS}
+
+    def _roll(self, day: int) -> bool:
+        """Restart the daily and weekly totals if a newer day begins.
+
+        :param day: ordinal of the day of the event.
+        :returns: True if the event belongs to the current day.
+
+        """
+        if day > self.day:
+            if week_number(day) != self.week:
+                self.week = week_number(day)
+                self.week_added = self.week_completed = self.week_errors = 0
+
+            self.day = day
+            self.day_added = self.day_completed = self.day_errors = 0
+
+        return day == self.day
+
+
+class CounterStats:
+    """Aggregates of every participant of a counter.
+
+    :ivar _participants: aggregates by participant identification.
+
+    """
+
+    __slots__ = ("_participants",)
+
+    def __init__(self) -> None:
+        """Instantiate the class."""
+        self._participants: Dict[str, ParticipantStats] = {}
+
+    def record(
+        self, event: Event, effects: Iterable[Tuple[bool, str, int]], day: int
+    ) -> None:
+        """Update the aggregates with an applied event.
+
+        :param event: the counter event.
+        :param effects: the changes caused by the event, as tuples with
+            whether push-up blocks are added or completed, the participant and
+            the number of blocks.
+        :param day: ordinal of the day of the event.
+
+        """
+        given = False
+
+        for add, participant_id, number in effects:
+            if add:
+                self[participant_id].add(day, number)
+                given = True
+            else:
+                self[participant_id].complete(day, number)
+
+        if isinstance(event, ErrorEvent):
+            self[event.sender].error(day)
+        elif isinstance(event, VoiceEvent) and given:
+            self[event.sender].voice += 1
+
+    def view(self, today: int) -> Dict[str, Dict[str, int]]:
+        """Get the aggregates of every participant as seen in a given day.
+
+        :param today: ordinal of the day.
+        :returns: the aggregates by participant identification.
+
+        """
+        return {
+            participant_id: stats.view(today)
+            for participant_id, stats in self._participants.items()
+        }
+
+    def clear(self) -> None:
+        """Forget every aggregate."""
+        self._participants.clear()
+
+    def to_json(self) -> Dict[str, Dict[str, int]]:
+        """Serialize the aggregates.
+
+        :returns: a JSON serializable dictionary.
+
+        """
+        return {
+            participant_id: stats.to_json()
+            for participant_id, stats in self._participants.items()
+        }
+
+    @classmethod
+    def from_json(cls, serialized: Dict[str, Any]) -> "CounterStats":
+        """Deserialize the aggregates.
+
+        :param serialized: the serialized aggregates.
+        :returns: the new aggregates.
+
+        """
+        stats = cls()
+
+        try:
+            for participant_id, values in serialized.items():
+                stats._participants[
+                    sys.intern(participant_id)
+                ] = ParticipantStats(**values)
+        except (AttributeError, TypeError, ValueError) as error:
+            raise WrongCounterFileFormatError(
+                f"The stats entry is not valid: {error}"
+            )
+
+        return stats
+
+    def __getitem__(self, participant_id: str) -> ParticipantStats:
+        """Get the aggregates of a participant, creating them if needed.
+
+        :param participant_id: identification of the participant.
+        :returns: the participant aggregates.
+
+        """
+        stats = self._participants.get(participant_id)
+
+        if stats is None:
+            stats = self._participants[participant_id] = ParticipantStats()
+
+        return stats
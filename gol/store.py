@@ -0,0 +1,1077 @@
+# Copyright (c) 2021 Luis Liñán Villafranca. All rights reserved.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>
+"""Storage backends for the push-ups counters."""
+import itertools
+import json
+import logging
+import threading
+import time
+
+from abc import ABC, abstractmethod
+from json.decoder import JSONDecodeError
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from gol.error import WrongCounterFileFormatError
+from gol.journal import EventJournal, read_records
+from gol.snapshot import (
+    SnapshotFile,
+    pack_record,
+    unpack_record,
+    write_snapshot_file,
+)
+from gol.utils import atomic_write
+
+if TYPE_CHECKING:
+    import sqlite3
+
+logger = logging.getLogger(__name__)
+
+
+class CounterStore(ABC):
+    """Persist the counters snapshots and their journal of changes.
+
+    A snapshot covers every change up to its ``seq`` number. Saving a new
+    snapshot allows the store to discard the older changes.
+
+    :ivar _on_write: function called after every write with its kind
+        (``append`` or ``save``), the seconds it took and the number of
+        serialized bytes written.
+
+    """
+
+    def __init__(
+        self, on_write: Optional[Callable[[str, float, int], None]] = None
+    ) -> None:
+        """Instantiate the class.
+
+        :param on_write: function called after every write with its kind,
+            duration and size.
+
+        """
+        self._on_write: Optional[Callable[[str, float, int], None]] = on_write
+
+    @abstractmethod
+    def load(self, chat_id: int) -> Optional[Dict[str, Any]]:
+        """Read the last snapshot of a chat counter.
+
+        :param chat_id: identification of the chat.
+        :returns: the snapshot, or None if the chat counter was never saved.
+
+        """
+
+    @abstractmethod
+    def replay(self, chat_id: int, after: int) -> Iterator[Dict[str, Any]]:
+        """Read the changes of a chat counter newer than a snapshot.
+
+        :param chat_id: identification of the chat.
+        :param after: sequence number of the snapshot.
+        :returns: an iterator over the change records, in order.
+
+        """
+
+    def history(self, chat_id: int) -> Iterator[Dict[str, Any]]:
+        """Read every change of a chat counter kept by the store.
+
+        Stores discarding the changes older than the last snapshot only
+        return the newer ones.
+
+        :param chat_id: identification of the chat.
+        :returns: an iterator over the change records, in order.
+
+        """
+        return self.replay(chat_id, 0)
+
+    @abstractmethod
+    def append(self, chat_id: int, record: Dict[str, Any]) -> None:
+        """Append a change record to a chat counter journal.
+
+        :param chat_id: identification of the chat.
+        :param record: the change record.
+
+        """
+
+    @abstractmethod
+    def save(self, chat_id: int, snapshot: Dict[str, Any]) -> None:
+        """Save a new snapshot of a chat counter.
+
+        :param chat_id: identification of the chat.
+        :param snapshot: the counter snapshot.
+
+        """
+
+    @abstractmethod
+    def snapshots(
+        self, include: Optional[Callable[[int], bool]] = None
+    ) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """Read the last snapshot of every chat counter in the store.
+
+        Snapshots that can't be read are skipped.
+
+        :param include: function telling if the snapshot of a chat, given its
+            identification, is read. Every snapshot is read if not provided.
+        :returns: an iterator over the chat identifications and snapshots.
+
+        """
+
+    @abstractmethod
+    def reset_weekend(self, chat_ids: Iterable[int]) -> int:
+        """Clear the weekend flags of several chat counters in bulk.
+
+        Only the snapshots are rewritten, so the counters don't have to be
+        loaded. The journals are left untouched, as replaying them never sets
+        a flag.
+
+        :param chat_ids: identification of the chats.
+        :returns: the number of chats that had a flag set.
+
+        """
+
+    @abstractmethod
+    def load_checkpoint(self) -> Optional[int]:
+        """Read the identification of the last update fully processed.
+
+        :returns: the update identification, or None if it was never saved.
+
+        """
+
+    @abstractmethod
+    def save_checkpoint(self, update_id: int) -> None:
+        """Save the identification of the last update fully processed.
+
+        Every update up to it must have its changes saved in the store.
+
+        :param update_id: the update identification.
+
+        """
+
+    def sync(self, chat_id: int) -> None:
+        """Force the appended records of a chat counter to disk.
+
+        :param chat_id: identification of the chat.
+
+        """
+
+    def release(self, chat_id: int) -> None:
+        """Free the resources used by a chat counter.
+
+        :param chat_id: identification of the chat.
+
+        """
+
+    def close(self) -> None:
+        """Free every resource used by the store."""
+
+    def _written(self, kind: str, start: float, size: int) -> None:
+        """Report a finished write.
+
+        :param kind: kind of write, ``append`` or ``save``.
+        :param start: ``time.perf_counter`` value when the write started.
+        :param size: number of serialized bytes written.
+
+        """
+        if self._on_write is not None:
+            self._on_write(kind, time.perf_counter() - start, size)
+
+
+class JsonCounterStore(CounterStore):
+    """Keep every chat counter in its own JSON snapshot and journal files.
+
+    The journal records covered by a new snapshot are moved to the end of
+    the chat history file, so the whole history stays available.
+
+    :ivar _save_dir: directory where the files are saved, created on the
+        first write.
+    :ivar _save_dir_ready: whether the directory is known to exist.
+    :ivar _journals: open journals by chat identification.
+    :ivar _archived: number of times the journal of every chat was archived.
+    :ivar _lock: lock protecting the open journals and archive counts.
+
+    """
+
+    def __init__(
+        self,
+        save_dir: Path,
+        on_write: Optional[Callable[[str, float, int], None]] = None,
+    ) -> None:
+        """Instantiate the class.
+
+        :param save_dir: directory where the files are saved.
+        :param on_write: function called after every write with its kind,
+            duration and size.
+
+        """
+        super().__init__(on_write)
+        self._save_dir: Path = save_dir
+        self._save_dir_ready: bool = False
+        self._journals: Dict[int, EventJournal] = {}
+        self._archived: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def snapshot_file(self, chat_id: int) -> Path:
+        """Get the file where a chat counter snapshot is saved.
+
+        :param chat_id: identification of the chat.
+        :returns: the snapshot file path.
+
+        """
+        return self._save_dir / f"{chat_id}.json"
+
+    def load(self, chat_id: int) -> Optional[Dict[str, Any]]:
+        """Read the last snapshot of a chat counter.
+
+        :param chat_id: identification of the chat.
+        :returns: the snapshot, or None if the chat counter was never saved.
+
+        """
+        snapshot_file = self.snapshot_file(chat_id)
+
+        if not snapshot_file.exists():
+            return None
+
+        try:
+            with snapshot_file.open("r") as save_file:
+                return json.load(save_file)
+        except JSONDecodeError as error:
+            raise WrongCounterFileFormatError(
+                f"There was an error reading the config file: {error}"
+            )
+
+    def checkpoint_file(self) -> Path:
+        """Get the file where the last processed update is saved.
+
+        :returns: the checkpoint file path.
+
+        """
+        return self._save_dir / "updates.checkpoint"
+
+    def journal_file(self, chat_id: int) -> Path:
+        """Get the file where a chat counter journal is written.
+
+        :param chat_id: identification of the chat.
+        :returns: the journal file path.
+
+        """
+        return self._save_dir / f"{chat_id}.log"
+
+    def history_file(self, chat_id: int) -> Path:
+        """Get the file where a chat counter history is archived.
+
+        :param chat_id: identification of the chat.
+        :returns: the history file path.
+
+        """
+        return self._save_dir / f"{chat_id}.history"
+
+    def replay(self, chat_id: int, after: int) -> Iterator[Dict[str, Any]]:
+        """Read the changes of a chat counter newer than a snapshot.
+
+        :param chat_id: identification of the chat.
+        :param after: sequence number of the snapshot.
+        :returns: an iterator over the change records, in order.
+
+        """
+        for record in self._journal(chat_id).replay():
+            if record["n"] > after:
+                yield record
+
+    def history(self, chat_id: int) -> Iterator[Dict[str, Any]]:
+        """Read every change of a chat counter, archived or not.
+
+        If the journal is archived while reading, the history file is read
+        again, so no record is missed. Records archived twice, by a crash
+        before the journal was emptied, are only returned once.
+
+        :param chat_id: identification of the chat.
+        :returns: an iterator over the change records, in order.
+
+        """
+        last = 0
+
+        while True:
+            with self._lock:
+                generation = self._archived.get(chat_id, 0)
+
+            archived = (
+                record
+                for record, _ in read_records(self.history_file(chat_id))
+            )
+            journal = (
+                record
+                for record, _ in read_records(self.journal_file(chat_id))
+            )
+
+            for record in itertools.chain(archived, journal):
+                if record["n"] > last:
+                    last = record["n"]
+                    yield record
+
+            with self._lock:
+                if self._archived.get(chat_id, 0) == generation:
+                    return
+
+    def append(self, chat_id: int, record: Dict[str, Any]) -> None:
+        """Append a change record to a chat counter journal.
+
+        :param chat_id: identification of the chat.
+        :param record: the change record.
+
+        """
+        start = time.perf_counter()
+        self._ensure_save_dir()
+        size = self._journal(chat_id).append(record)
+        self._written("append", start, size)
+
+    def save(self, chat_id: int, snapshot: Dict[str, Any]) -> None:
+        """Save a new snapshot of a chat counter and archive its journal.
+
+        :param chat_id: identification of the chat.
+        :param snapshot: the counter snapshot.
+
+        """
+        start = time.perf_counter()
+        size = self._replace_snapshot(chat_id, snapshot)
+
+        with self._lock:
+            self._archived[chat_id] = self._archived.get(chat_id, 0) + 1
+
+        self._journal(chat_id).archive(self.history_file(chat_id))
+        self._written("save", start, size)
+
+    def snapshots(
+        self, include: Optional[Callable[[int], bool]] = None
+    ) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """Read the last snapshot of every chat counter in the store.
+
+        Snapshots that can't be read are skipped.
+
+        :param include: function telling if the snapshot of a chat, given its
+            identification, is read. Every snapshot is read if not provided.
+        :returns: an iterator over the chat identifications and snapshots.
+
+        """
+        for path in self._save_dir.glob("*.json"):
+            try:
+                chat_id = int(path.stem)
+            except ValueError:
+                continue
+
+            if include is not None and not include(chat_id):
+                continue
+
+            try:
+                snapshot = self.load(chat_id)
+            except WrongCounterFileFormatError as error:
+                logger.error("Couldn't read the chat %s: %s", chat_id, error)
+                continue
+
+            if snapshot is not None:
+                yield chat_id, snapshot
+
+    def reset_weekend(self, chat_ids: Iterable[int]) -> int:
+        """Clear the weekend flags of several chat counters in bulk.
+
+        Only the snapshots with a flag set are rewritten, and the journals
+        are left untouched.
+
+        :param chat_ids: identification of the chats.
+        :returns: the number of chats that had a flag set.
+
+        """
+        reset = 0
+
+        for chat_id in chat_ids:
+            snapshot = self.load(chat_id)
+
+            if snapshot is not None and _clear_weekend(snapshot):
+                start = time.perf_counter()
+                size = self._replace_snapshot(chat_id, snapshot)
+                self._written("save", start, size)
+                reset += 1
+
+        return reset
+
+    def load_checkpoint(self) -> Optional[int]:
+        """Read the identification of the last update fully processed.
+
+        :returns: the update identification, or None if it was never saved.
+
+        """
+        checkpoint_file = self.checkpoint_file()
+
+        if not checkpoint_file.exists():
+            return None
+
+        try:
+            return int(checkpoint_file.read_text())
+        except ValueError as error:
+            raise WrongCounterFileFormatError(
+                f"There was an error reading the checkpoint file: {error}"
+            )
+
+    def save_checkpoint(self, update_id: int) -> None:
+        """Save the identification of the last update fully processed.
+
+        :param update_id: the update identification.
+
+        """
+        self._ensure_save_dir()
+        atomic_write(self.checkpoint_file(), str(update_id).encode())
+
+    def sync(self, chat_id: int) -> None:
+        """Force the appended records of a chat counter to disk.
+
+        :param chat_id: identification of the chat.
+
+        """
+        self._journal(chat_id).sync()
+
+    def release(self, chat_id: int) -> None:
+        """Close the journal of a chat counter.
+
+        :param chat_id: identification of the chat.
+
+        """
+        with self._lock:
+            journal = self._journals.pop(chat_id, None)
+
+        if journal is not None:
+            journal.close()
+
+    def close(self) -> None:
+        """Close every open journal."""
+        with self._lock:
+            journals = list(self._journals.values())
+            self._journals.clear()
+
+        for journal in journals:
+            journal.close()
+
+    def _replace_snapshot(self, chat_id: int, snapshot: Dict[str, Any]) -> int:
+        """Write the snapshot of a chat counter, without archiving its journal.
+
+        :param chat_id: identification of the chat.
+        :param snapshot: the counter snapshot.
+        :returns: the number of bytes written.
+
+        """
+        data = json.dumps(snapshot, separators=(",", ":")).encode("utf-8")
+        self._ensure_save_dir()
+        atomic_write(self.snapshot_file(chat_id), data)
+
+        return len(data)
+
+    def _ensure_save_dir(self) -> None:
+        """Create the directory where the files are saved, if needed."""
+        if not self._save_dir_ready:
+            self._save_dir.mkdir(parents=True, exist_ok=True)
+            self._save_dir_ready = True
+
+    def _journal(self, chat_id: int) -> EventJournal:
+        """Get the journal of a chat counter.
+
+        :param chat_id: identification of the chat.
+        :returns: the chat journal.
+
+        """
+        with self._lock:
+            if chat_id not in self._journals:
+                self._journals[chat_id] = EventJournal(
+                    self.journal_file(chat_id)
+                )
+
+            return self._journals[chat_id]
+
+
+class BinaryCounterStore(JsonCounterStore):
+    """Keep the counter snapshots in a memory-mapped binary snapshot file.
+
+    Opening the store only reads the header of the packed snapshot file, so
+    it takes the same time whatever the number of chats, and a counter is
+    only decoded when it is loaded. Saved snapshots are written to a small
+    per-chat snapshot file, which takes precedence over the packed one, and
+    are merged into the packed file by :meth:`compact`. The journals are kept
+    as in the JSON store.
+
+    :ivar _packed: the packed snapshot file, opened on first use.
+    :ivar _snapshots_lock: lock serializing the snapshot writes and the
+        compactions.
+
+    """
+
+    PACKED_FILE = "snapshots.bin"
+
+    def __init__(
+        self,
+        save_dir: Path,
+        on_write: Optional[Callable[[str, float, int], None]] = None,
+    ) -> None:
+        """Instantiate the class.
+
+        :param save_dir: directory where the files are saved.
+        :param on_write: function called after every write with its kind,
+            duration and size.
+
+        """
+        super().__init__(save_dir, on_write)
+        self._packed: Optional[SnapshotFile] = None
+        self._snapshots_lock = threading.Lock()
+
+    def snapshot_file(self, chat_id: int) -> Path:
+        """Get the file where a chat counter snapshot is saved.
+
+        :param chat_id: identification of the chat.
+        :returns: the snapshot file path.
+
+        """
+        return self._save_dir / f"{chat_id}.snap"
+
+    def packed_file(self) -> Path:
+        """Get the file where the snapshots of every chat are packed.
+
+        :returns: the packed snapshot file path.
+
+        """
+        return self._save_dir / self.PACKED_FILE
+
+    def load(self, chat_id: int) -> Optional[Dict[str, Any]]:
+        """Read the last snapshot of a chat counter.
+
+        :param chat_id: identification of the chat.
+        :returns: the snapshot, or None if the chat counter was never saved.
+
+        """
+        with self._snapshots_lock:
+            with SnapshotFile(self.snapshot_file(chat_id)) as snapshot_file:
+                snapshot = snapshot_file.load(chat_id)
+
+            if snapshot is None:
+                snapshot = self._packed_snapshots().load(chat_id)
+
+        return snapshot
+
+    def snapshots(
+        self, include: Optional[Callable[[int], bool]] = None
+    ) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """Read the last snapshot of every chat counter in the store.
+
+        The records are copied while holding the lock, and decoded one at a
+        time afterwards. Records that can't be decoded are skipped.
+
+        :param include: function telling if the snapshot of a chat, given its
+            identification, is read. Every snapshot is read if not provided.
+        :returns: an iterator over the chat identifications and snapshots.
+
+        """
+        with self._snapshots_lock:
+            records = dict(self._packed_snapshots().records())
+
+            for path in self._save_dir.glob("*.snap"):
+                with SnapshotFile(path) as snapshot_file:
+                    records.update(snapshot_file.records())
+
+        for chat_id, record in records.items():
+            if include is not None and not include(chat_id):
+                continue
+
+            try:
+                yield chat_id, unpack_record(record)
+            except WrongCounterFileFormatError as error:
+                logger.error("Couldn't read the chat %s: %s", chat_id, error)
+
+    def compact(self) -> None:
+        """Merge the per-chat snapshot files into the packed file.
+
+        The records are copied without decoding them.
+
+        """
+        with self._snapshots_lock:
+            saved = {}
+
+            for path in self._save_dir.glob("*.snap"):
+                with SnapshotFile(path) as snapshot_file:
+                    saved.update(snapshot_file.records())
+
+            if not saved:
+                return
+
+            packed = self._packed_snapshots()
+            records = itertools.chain(
+                (
+                    (chat_id, record)
+                    for chat_id, record in packed.records()
+                    if chat_id not in saved
+                ),
+                saved.items(),
+            )
+            write_snapshot_file(self.packed_file(), records)
+            packed.close()
+            self._packed = None
+
+            for chat_id in saved:
+                self.snapshot_file(chat_id).unlink()
+
+    def close(self) -> None:
+        """Close every open journal and compact the snapshots."""
+        super().close()
+        self.compact()
+
+        with self._snapshots_lock:
+            if self._packed is not None:
+                self._packed.close()
+                self._packed = None
+
+    def _replace_snapshot(self, chat_id: int, snapshot: Dict[str, Any]) -> int:
+        """Write the snapshot of a chat counter to its own snapshot file.
+
+        :param chat_id: identification of the chat.
+        :param snapshot: the counter snapshot.
+        :returns: the number of bytes written.
+
+        """
+        record = pack_record(snapshot)
+        self._ensure_save_dir()
+
+        with self._snapshots_lock:
+            return write_snapshot_file(
+                self.snapshot_file(chat_id), [(chat_id, record)]
+            )
+
+    def _packed_snapshots(self) -> SnapshotFile:
+        """Get the packed snapshot file, opening it if needed.
+
+        .. note:: The snapshots lock must be held.
+
+        :returns: the packed snapshot file.
+
+        """
+        if self._packed is None:
+            self._packed = SnapshotFile(self.packed_file())
+
+        return self._packed
+
+
+class SqliteCounterStore(CounterStore):
+    """Keep every chat counter in a single SQLite database in WAL mode.
+
+    The changes are kept in an events table after taking a snapshot, so the
+    history of every chat stays available. Snapshot entries without a column
+    of their own are kept as JSON in the ``extra`` column of the chat, which
+    is the only part of a saved snapshot counted as written bytes.
+
+    :ivar _database: file of the SQLite database.
+    :ivar _connection: connection open from the first use of the store until
+        it is closed.
+    :ivar _lock: lock serializing the use of the connection.
+
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS chats ("
+        " chat_id INTEGER PRIMARY KEY,"
+        " seq INTEGER NOT NULL,"
+        " holder TEXT NOT NULL,"
+        " normals INTEGER NOT NULL,"
+        " extra TEXT NOT NULL DEFAULT '{}')",
+        "CREATE TABLE IF NOT EXISTS participants ("
+        " chat_id INTEGER NOT NULL,"
+        " position INTEGER NOT NULL,"
+        " participant_id TEXT NOT NULL,"
+        " name TEXT NOT NULL,"
+        " punishments INTEGER NOT NULL,"
+        " rip_wknd INTEGER NOT NULL,"
+        " PRIMARY KEY (chat_id, position))",
+        "CREATE TABLE IF NOT EXISTS events ("
+        " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        " chat_id INTEGER NOT NULL,"
+        " seq INTEGER NOT NULL,"
+        " ts REAL NOT NULL,"
+        " record TEXT NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS events_chat_seq ON events (chat_id, seq)",
+        "CREATE INDEX IF NOT EXISTS events_ts ON events (ts)",
+        "CREATE TABLE IF NOT EXISTS checkpoints ("
+        " name TEXT PRIMARY KEY,"
+        " value INTEGER NOT NULL)",
+    )
+    SNAPSHOT_COLUMNS = ("participants", "normals", "seq")
+    SELECT_CHAT = (
+        "SELECT seq, holder, normals, extra FROM chats WHERE chat_id = ?"
+    )
+    SELECT_PARTICIPANTS = (
+        "SELECT participant_id, name, punishments, rip_wknd"
+        " FROM participants WHERE chat_id = ? ORDER BY position"
+    )
+    SELECT_CHATS = "SELECT chat_id, seq, holder, normals, extra FROM chats"
+    SELECT_ALL_PARTICIPANTS = (
+        "SELECT chat_id, participant_id, name, punishments, rip_wknd"
+        " FROM participants ORDER BY chat_id, position"
+    )
+    RESET_WEEKEND = (
+        "UPDATE participants SET rip_wknd = 0"
+        " WHERE chat_id = ? AND rip_wknd != 0"
+    )
+    SELECT_CHECKPOINT = "SELECT value FROM checkpoints WHERE name = 'updates'"
+    UPSERT_CHECKPOINT = (
+        "INSERT OR REPLACE INTO checkpoints (name, value)"
+        " VALUES ('updates', ?)"
+    )
+    SELECT_EVENTS = (
+        "SELECT record FROM events WHERE chat_id = ? AND seq > ? ORDER BY seq"
+    )
+    SELECT_EVENTS_PAGE = (
+        "SELECT seq, record FROM events WHERE chat_id = ? AND seq > ?"
+        " ORDER BY seq LIMIT ?"
+    )
+    HISTORY_PAGE_SIZE = 1000
+    INSERT_EVENT = (
+        "INSERT INTO events (chat_id, seq, ts, record) VALUES (?, ?, ?, ?)"
+    )
+    UPSERT_CHAT = (
+        "INSERT OR REPLACE INTO chats (chat_id, seq, holder, normals, extra)"
+        " VALUES (?, ?, ?, ?, ?)"
+    )
+    UPSERT_PARTICIPANT = (
+        "INSERT OR REPLACE INTO participants"
+        " (chat_id, position, participant_id, name, punishments, rip_wknd)"
+        " VALUES (?, ?, ?, ?, ?, ?)"
+    )
+
+    def __init__(
+        self,
+        database: Path,
+        on_write: Optional[Callable[[str, float, int], None]] = None,
+    ) -> None:
+        """Instantiate the class.
+
+        :param database: file of the SQLite database.
+        :param on_write: function called after every write with its kind,
+            duration and size.
+
+        """
+        super().__init__(on_write)
+
+        self._database: Path = database
+        self._connection: Optional["sqlite3.Connection"] = None
+        self._lock = threading.Lock()
+
+    def load(self, chat_id: int) -> Optional[Dict[str, Any]]:
+        """Read the last snapshot of a chat counter.
+
+        :param chat_id: identification of the chat.
+        :returns: the snapshot, or None if the chat counter was never saved.
+
+        """
+        with self._lock:
+            connection = self._connect(create=False)
+
+            if connection is None:
+                return None
+
+            chat = connection.execute(self.SELECT_CHAT, (chat_id,)).fetchone()
+            participants = connection.execute(
+                self.SELECT_PARTICIPANTS, (chat_id,)
+            ).fetchall()
+
+        if chat is None:
+            return None
+
+        return self._snapshot(chat, participants)
+
+    def replay(self, chat_id: int, after: int) -> Iterator[Dict[str, Any]]:
+        """Read the changes of a chat counter newer than a snapshot.
+
+        :param chat_id: identification of the chat.
+        :param after: sequence number of the snapshot.
+        :returns: an iterator over the change records, in order.
+
+        """
+        with self._lock:
+            connection = self._connect(create=False)
+
+            if connection is None:
+                return
+
+            rows = connection.execute(
+                self.SELECT_EVENTS, (chat_id, after)
+            ).fetchall()
+
+        for (record,) in rows:
+            yield json.loads(record)
+
+    def history(self, chat_id: int) -> Iterator[Dict[str, Any]]:
+        """Read every change of a chat counter.
+
+        The events are read in pages, so the history is never fully loaded.
+
+        :param chat_id: identification of the chat.
+        :returns: an iterator over the change records, in order.
+
+        """
+        last = 0
+
+        while True:
+            with self._lock:
+                connection = self._connect(create=False)
+
+                if connection is None:
+                    return
+
+                rows = connection.execute(
+                    self.SELECT_EVENTS_PAGE,
+                    (chat_id, last, self.HISTORY_PAGE_SIZE),
+                ).fetchall()
+
+            for last, record in rows:
+                yield json.loads(record)
+
+            if len(rows) < self.HISTORY_PAGE_SIZE:
+                return
+
+    def append(self, chat_id: int, record: Dict[str, Any]) -> None:
+        """Append a change record to a chat counter journal.
+
+        :param chat_id: identification of the chat.
+        :param record: the change record.
+
+        """
+        start = time.perf_counter()
+        serialized = json.dumps(record, separators=(",", ":"))
+
+        with self._lock, self._connect() as connection:
+            connection.execute(
+                self.INSERT_EVENT,
+                (chat_id, record["n"], record["t"], serialized),
+            )
+
+        self._written("append", start, len(serialized))
+
+    def save(self, chat_id: int, snapshot: Dict[str, Any]) -> None:
+        """Save a new snapshot of a chat counter.
+
+        :param chat_id: identification of the chat.
+        :param snapshot: the counter snapshot.
+
+        """
+        start = time.perf_counter()
+        normals = snapshot["normals"]
+        extra = json.dumps(
+            {
+                key: value
+                for key, value in snapshot.items()
+                if key not in self.SNAPSHOT_COLUMNS
+            },
+            separators=(",", ":"),
+        )
+
+        with self._lock, self._connect() as connection:
+            connection.execute(
+                self.UPSERT_CHAT,
+                (
+                    chat_id,
+                    snapshot["seq"],
+                    normals["holder"],
+                    normals["count"],
+                    extra,
+                ),
+            )
+            connection.executemany(
+                self.UPSERT_PARTICIPANT,
+                (
+                    (
+                        chat_id,
+                        position,
+                        participant["id"],
+                        participant["name"],
+                        participant["punishments"],
+                        int(participant["rip_wknd"]),
+                    )
+                    for position, participant in enumerate(
+                        snapshot["participants"]
+                    )
+                ),
+            )
+
+        self._written("save", start, len(extra))
+
+    def snapshots(
+        self, include: Optional[Callable[[int], bool]] = None
+    ) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """Read the last snapshot of every chat counter in the store.
+
+        Both tables are read with one query each.
+
+        :param include: function telling if the snapshot of a chat, given its
+            identification, is read. Every snapshot is read if not provided.
+        :returns: an iterator over the chat identifications and snapshots.
+
+        """
+        with self._lock:
+            connection = self._connect(create=False)
+
+            if connection is None:
+                return
+
+            chats = connection.execute(self.SELECT_CHATS).fetchall()
+            rows = connection.execute(self.SELECT_ALL_PARTICIPANTS).fetchall()
+
+        participants: Dict[int, List[Tuple[Any, ...]]] = {}
+
+        for chat_id, *participant in rows:
+            participants.setdefault(chat_id, []).append(tuple(participant))
+
+        for chat_id, *chat in chats:
+            if include is not None and not include(chat_id):
+                continue
+
+            yield chat_id, self._snapshot(chat, participants.get(chat_id, []))
+
+    def reset_weekend(self, chat_ids: Iterable[int]) -> int:
+        """Clear the weekend flags of several chat counters in bulk.
+
+        Every chat is updated in the same transaction.
+
+        :param chat_ids: identification of the chats.
+        :returns: the number of chats that had a flag set.
+
+        """
+        start = time.perf_counter()
+        reset = 0
+
+        with self._lock:
+            connection = self._connect(create=False)
+
+            if connection is None:
+                return 0
+
+            with connection:
+                for chat_id in chat_ids:
+                    cursor = connection.execute(self.RESET_WEEKEND, (chat_id,))
+                    reset += cursor.rowcount > 0
+
+        self._written("save", start, 0)
+
+        return reset
+
+    def load_checkpoint(self) -> Optional[int]:
+        """Read the identification of the last update fully processed.
+
+        :returns: the update identification, or None if it was never saved.
+
+        """
+        with self._lock:
+            connection = self._connect(create=False)
+
+            if connection is None:
+                return None
+
+            row = connection.execute(self.SELECT_CHECKPOINT).fetchone()
+
+        return row[0] if row is not None else None
+
+    def save_checkpoint(self, update_id: int) -> None:
+        """Save the identification of the last update fully processed.
+
+        :param update_id: the update identification.
+
+        """
+        with self._lock, self._connect() as connection:
+            connection.execute(self.UPSERT_CHECKPOINT, (update_id,))
+
+    @staticmethod
+    def _snapshot(
+        chat: Iterable[Any], participants: Iterable[Iterable[Any]]
+    ) -> Dict[str, Any]:
+        """Build a snapshot from the rows of a chat.
+
+        :param chat: the sequence number, normals holder, normals count and
+            extra entries of the chat.
+        :param participants: the identification, name, punishments and
+            weekend flag of every participant, in order.
+        :returns: the counter snapshot.
+
+        """
+        seq, holder, normals, extra = chat
+
+        return {
+            **json.loads(extra),
+            "participants": [
+                {
+                    "id": participant_id,
+                    "name": name,
+                    "punishments": punishments,
+                    "rip_wknd": bool(rip_wknd),
+                }
+                for participant_id, name, punishments, rip_wknd in participants
+            ],
+            "normals": {"holder": holder, "count": normals},
+            "seq": seq,
+        }
+
+    def _connect(
+        self, create: bool = True
+    ) -> Optional["sqlite3.Connection"]:
+        """Get the database connection, opening it on first use.
+
+        .. note:: The store lock must be held.
+
+        :param create: whether to create the database if it doesn't exist.
+        :returns: the connection, or None if the database doesn't exist and
+            it must not be created.
+
+        """
+        if self._connection is not None:
+            return self._connection
+
+        if not create and not self._database.exists():
+            return None
+
+        import sqlite3
+
+        self._database.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(
+            str(self._database), check_same_thread=False, cached_statements=64
+        )
+
+        with self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+
+            for statement in self.SCHEMA:
+                self._connection.execute(statement)
+
+        return self._connection
+
+    def close(self) -> None:
+        """Close the database connection, if open."""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+def _clear_weekend(snapshot: Dict[str, Any]) -> bool:
+    """Clear the weekend flags of the participants of a snapshot.
+
+    :param snapshot: the counter snapshot, changed in place.
+    :returns: True if any flag was set.
+
+    """
+    participants = snapshot.get("participants") or []
+    flagged = any(participant["rip_wknd"] for participant in participants)
+
+    for participant in participants:
+        participant["rip_wknd"] = False
+
+    return flagged
@@ -0,0 +1,103 @@
+# Copyright (c) 2021 Luis Liñán Villafranca. All rights reserved.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>
+"""Compact ring of the last updates applied to a counter."""
+from array import array
+from typing import Any, Iterable, Iterator, List
+
+from gol.error import WrongCounterFileFormatError
+from gol.settings import RECENT_UPDATES
+
+
+class RecentUpdates:
+    """Keep the identifications of the last updates in a bounded ring.
+
+    The identifications are stored as machine integers in an array, which
+    takes 8 bytes per update instead of a Python integer and a list slot.
+    Once full, every new update replaces the oldest one.
+
+    :ivar _capacity: maximum number of updates kept.
+    :ivar _ids: the updates, as a ring starting at ``_start``.
+    :ivar _start: position of the oldest update once the ring is full.
+
+    """
+
+    __slots__ = ("_capacity", "_ids", "_start")
+
+    def __init__(
+        self, ids: Iterable[int] = (), capacity: int = RECENT_UPDATES
+    ) -> None:
+        """Build a new ring.
+
+        :param ids: initial updates, from the oldest to the newest.
+        :param capacity: maximum number of updates kept.
+
+        """
+        self._capacity: int = capacity
+        self._ids = array("q")
+        self._start: int = 0
+
+        for update_id in ids:
+            self.add(update_id)
+
+    def add(self, update_id: int) -> None:
+        """Remember an update, forgetting the oldest one if full.
+
+        :param update_id: identification of the update.
+
+        """
+        if len(self._ids) < self._capacity:
+            self._ids.append(update_id)
+        else:
+            self._ids[self._start] = update_id
+            self._start = (self._start + 1) % self._capacity
+
+    def to_json(self) -> List[int]:
+        """Serialize the ring.
+
+        :returns: the updates, from the oldest to the newest.
+
+        """
+        return list(self)
+
+    @classmethod
+    def from_json(cls, serialized: Any) -> "RecentUpdates":
+        """Deserialize a ring.
+
+        :param serialized: the updates, from the oldest to the newest.
+        :returns: the new ring.
+
+        """
+        try:
+            return cls(serialized)
+        except (OverflowError, TypeError) as error:
+            raise WrongCounterFileFormatError(
+                f"The recent updates are not valid: {error}"
+            )
+
+    def __contains__(self, update_id: object) -> bool:
+        """Check if an update is in the ring.
+
+        :param update_id: identification of the update.
+        :returns: True if the update is one of the last ones.
+
+        """
+        return update_id in self._ids
+
+    def __iter__(self) -> Iterator[int]:
+        """Iterate over the updates.
+
+        :returns: an iterator from the oldest to the newest update.
+
+        """
+        yield from self._ids[self._start :]
+        yield from self._ids[: self._start]
+
+    def __len__(self) -> int:
+        """Get the number of updates kept.
+
+        :returns: the updates in the ring.
+
+        """
+        return len(self._ids)
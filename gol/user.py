@@ -5,7 +5,9 @@
 """User related information."""
 from enum import Enum
 from operator import eq, ne
-from typing import List
+from typing import Optional
+
+from gol.ledger import NormalsLedger
 
 
 class UserOp(Enum):
@@ -18,7 +20,7 @@ class UserOp(Enum):
 class PushUpper:
     """Save information about one participant and their shared count.
 
-    :cvar _normals: shared list of current person with normal push-ups to-do.
+    :ivar _normals: ledger shared with the other participant of the counter.
     :ivar _name: name of the participant.
     :ivar _id: identification of the participant.
     :ivar _punishments: number of punishment push-ups the participant has
@@ -28,15 +30,25 @@ class PushUpper:
 
     """
 
-    _normals: List[str] = []
+    __slots__ = ("_normals", "_name", "_id", "_punishments", "_rip_wknd")
 
-    def __init__(self, person_name: str, person_id: str) -> None:
+    def __init__(
+        self,
+        person_name: str,
+        person_id: str,
+        normals: Optional[NormalsLedger] = None,
+    ) -> None:
         """Build a new push-ups counter.
 
         :param person_name: human readable name for the participant.
         :param person_id: ne identification for the participant.
+        :param normals: ledger shared with the other participant. A new one is
+            created if not provided.
 
         """
+        self._normals: NormalsLedger = (
+            normals if normals is not None else NormalsLedger()
+        )
         self._name: str = person_name
         self._id: str = person_id
         self._punishments: int = 0
@@ -106,13 +118,13 @@ class PushUpper:
         """
         has_normals = False
 
-        if self._normals and who.value(self._normals[-1], self._id):
+        if self._normals and who.value(self._normals.holder, self._id):
             has_normals = True
 
         return has_normals
 
     @property
-    def normals(self) -> List[str]:
+    def normals(self) -> NormalsLedger:
         """Variable ``_normals`` getter.
 
         :returns: the ``_normals`` value.
@@ -121,13 +133,16 @@ class PushUpper:
         return self._normals
 
     @normals.setter
-    def normals(self, normals: List[str]) -> None:
+    def normals(self, normals: NormalsLedger) -> None:
         """Variable ``_normals`` setter.
 
-        :param self: new value for the variable.
+        The shared ledger is updated in place so both participants keep
+        seeing the same one.
+
+        :param normals: new value for the variable.
 
         """
-        self._normals = normals
+        self._normals.reset(normals.holder, normals.count)
 
     @property
     def n_normals(self) -> int:
@@ -136,7 +151,7 @@ class PushUpper:
         :returns: number of normal push-ups for the current user if any.
 
         """
-        return len(self._normals) if self._has_normals() else 0
+        return self._normals.owed_by(self._id)
 
     def add_normals(self, number: int = 1) -> None:
         """Add normal push-ups to the current user.
@@ -151,17 +166,7 @@ class PushUpper:
         if number <= 0:
             raise ValueError("You only can add positive punishment push-ups")
 
-        while number > 0:
-            if self._has_normals(UserOp.OTHER):
-                if len(self._normals) > number:
-                    del self._normals[-number:]
-                    break
-                else:
-                    number -= len(self._normals)
-                    self._normals.clear()
-            else:
-                self._normals.extend([self._id] * number)
-                break
+        self._normals.add(self._id, number)
 
     @property
     def punishments(self) -> int:
@@ -213,10 +218,7 @@ class PushUpper:
             self._punishments = 0
 
             if self._has_normals():
-                if len(self._normals) > number:
-                    del self._normals[-number:]
-                else:
-                    self._normals.clear()
+                self._normals.remove(self._id, number)
 
     def __str__(self) -> str:
         """String representation of the object.
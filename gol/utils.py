@@ -3,13 +3,37 @@
 # This work is licensed under the terms of the MIT license.
 # For a copy, see <https://opensource.org/licenses/MIT>
 """Utitilites for the push-ups counter."""
-from datetime import datetime
+import os
+
+from pathlib import Path
 
 
 def is_weekend() -> bool:
-    """Checks if the current day is weekend.
+    """Checks if the current day is weekend in the server local time.
 
     :returns: True when the current day is weekend.
 
     """
-    return datetime.today().weekday() > 3
+    from gol.clock import DEFAULT_CLOCK
+
+    return DEFAULT_CLOCK.is_weekend()
+
+
+def atomic_write(path: Path, data: bytes) -> None:
+    """Replace the contents of a file atomically.
+
+    The data is written to a temporary file in the same directory, synced to
+    disk and then moved over the destination file.
+
+    :param path: file to write.
+    :param data: new contents of the file.
+
+    """
+    tmp_path = path.with_name(f".{path.name}.tmp")
+
+    with tmp_path.open("wb") as tmp_file:
+        tmp_file.write(data)
+        tmp_file.flush()
+        os.fsync(tmp_file.fileno())
+
+    os.replace(tmp_path, path)
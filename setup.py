@@ -22,7 +22,6 @@ setup(
         "Environment :: Console",
         "Programming Language :: Python",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.6",
         "Programming Language :: Python :: 3.7",
         "Programming Language :: Python :: 3.8",
         "Programming Language :: Python :: 3.9",
@@ -33,6 +32,7 @@ setup(
     install_requires=[
         "python-telegram-bot",
         "python-decouple",
+        "backports.zoneinfo; python_version < '3.9'",
     ],
     entry_points={
         "console_scripts": [
@@ -43,5 +43,5 @@ setup(
         "Source Code": "https://github.com/lulivi/gol-bot",
         "Bug Tracker": "https://github.com/lulivi/gol-bot/issues",
     },
-    python_requires=">=3.6",
+    python_requires=">=3.7",
 )